@@ -4,11 +4,18 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Tuple
 
+from public_api.pool import DuckDBPool
 
 
 DB = "warehouse.duckdb"
 
+# Una única base de datos abierta por proceso y en solo lectura (como la API pública);
+# cada consulta usa un cursor del pool y las escrituras abren una conexión de escritura breve
+POOL = DuckDBPool(DB, read_only=True, size=4)
+
 app = FastAPI(title="EMSV Local API")
+app.add_event_handler("startup", POOL.open)
+app.add_event_handler("shutdown", POOL.close)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,15 +29,13 @@ app.add_middleware(
 # -------------------------------
 
 def _query(sql: str, params: list | tuple = ()):
-    """Abre una conexión, ejecuta una consulta y devuelve fetchall()."""
-    with duckdb.connect(DB) as con:
-        con.execute("LOAD spatial;")
+    """Toma un cursor del pool, ejecuta una consulta y devuelve fetchall()."""
+    with POOL.connection() as con:
         return con.execute(sql, params).fetchall()
 
 def _exec_many(statements: list[tuple[str, list | tuple]]):
-    """Ejecuta varias sentencias dentro de una transacción."""
-    with duckdb.connect(DB) as con:
-        con.execute("LOAD spatial;")
+    """Ejecuta varias sentencias dentro de una transacción (cierra la base de solo lectura mientras tanto)."""
+    with POOL.write_connection() as con:
         con.execute("BEGIN")
         try:
             for sql, params in statements:
@@ -366,12 +371,7 @@ async def lookup_address(
     street_norm = norm(street)
     number_norm = norm(number)
     
-    con = duckdb.connect("warehouse.duckdb", read_only=True)
-    
-    try:
-        # 🔧 IMPORTANTE: Cargar la extensión spatial
-        con.execute("LOAD spatial;")
-        
+    with POOL.connection() as con:
         # Busca la referencia en address_index
         result = con.execute("""
             SELECT reference 
@@ -414,9 +414,6 @@ async def lookup_address(
         }
         
         return {"reference": reference, "feature": feature}
-        
-    finally:
-        con.close()
 
 
 
@@ -0,0 +1,7 @@
+# benchmark — offline performance measurement of public_api without the production warehouse
+#
+#   python -m benchmark.generate bench.duckdb --scale 1.0      # synthetic Getafe-scale warehouse
+#   python -m benchmark.run bench.duckdb --users 8 --duration 60 --out run.json
+#   python -m benchmark.run bench.duckdb --baseline run.json   # compare against an earlier run
+#
+# Run from server/ (derived.py and public_api/ are imported from there).
@@ -0,0 +1,255 @@
+# generate.py — synthetic warehouse with the production table schemas, at Getafe scale
+from __future__ import annotations
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from derived import build_all, connect  # noqa: E402
+
+# Getafe municipal extent (WGS84) and the neighbourhood centres buildings cluster around
+EXTENT = (-3.775, 40.275, -3.665, 40.335)
+CENTRES = [(-3.7325, 40.3050), (-3.7200, 40.3120), (-3.7450, 40.2950), (-3.7100, 40.2980),
+           (-3.7550, 40.3180), (-3.6950, 40.3090), (-3.7380, 40.3220), (-3.7250, 40.2880)]
+M_LON = 1 / 85_000.0     # degrees per metre at Getafe's latitude
+M_LAT = 1 / 111_000.0
+
+# Rows at scale 1.0 (roughly the production warehouse)
+ROWS = {
+    "buildings": 15_000,
+    "shadows": 250_000,
+    "irr_points": 1_000_000,
+    "big_points": 300_000,
+    "autoconsumos_CELS": 150,
+}
+ADDRESSES_PER_BUILDING = 1.5
+
+STREETS = [
+    "MADRID", "TOLEDO", "LEGANES", "GENERAL PINGARRON", "ARBOLEDA", "JUAN DE LA CIERVA",
+    "FILIPINAS", "ALEMANIA", "ESPAÑA", "CONSTITUCION", "DOCTOR PEDRO LAGUNA", "RAMON Y CAJAL",
+    "VILLAVERDE", "ESTUDIANTES", "MARIA MORENO", "POLVORANCA", "ISAAC PERAL", "HOSPITAL DE SAN JOSE",
+    "GRANADOS", "LOS ANGELES", "SECTOR III", "AVIACION", "CERRO DE LOS ANGELES", "JUAN VERGARA",
+    "MORAS", "ALFONSO X", "PINTO", "BUENAVISTA", "PERALES", "MAGALLANES",
+]
+USES = ["1_residential", "1_residential", "1_residential", "3_industrial", "4_1_office",
+        "4_2_retail", "4_3_publicServices", "2_agriculture"]
+
+
+def _u(seed: int, key: int, *cols: str) -> str:
+    """Deterministic uniform [0, 1) from hash(cols, key, seed) — same rows for the same seed."""
+    return f"((hash({', '.join(cols)}, {key}, {seed}) % 1000003) / 1000003.0)"
+
+
+def _n(seed: int, key: int, col: str) -> str:
+    """Roughly normal in [-1.5, 1.5): sum of three uniforms, centred."""
+    return f"({_u(seed, key, col)} + {_u(seed, key + 1, col)} + {_u(seed, key + 2, col)} - 1.5)"
+
+
+def _list(values: list) -> str:
+    return "[" + ", ".join(repr(v) if not isinstance(v, str) else "'" + v.replace("'", "''") + "'"
+                           for v in values) + "]"
+
+
+def generate(path: str, scale: float = 1.0, seed: int = 1) -> dict[str, int]:
+    con = connect(path)
+    con.execute("INSTALL spatial; LOAD spatial;")
+    n = {name: max(1, int(rows * scale)) for name, rows in ROWS.items()}
+    minx, miny, maxx, maxy = EXTENT
+    cx = _list([c[0] for c in CENTRES])
+    cy = _list([c[1] for c in CENTRES])
+    k = len(CENTRES)
+
+    # Building centres/sizes: 75 % clustered around the centres (~1.2 km spread), rest uniform
+    con.execute(f"""
+        CREATE TEMP TABLE _b AS
+        SELECT i,
+               CASE WHEN {_u(seed, 1, 'i')} < 0.75
+                    THEN {cx}[1 + i % {k}] + {_n(seed, 10, 'i')} * 1200 * {M_LON!r}
+                    ELSE {minx!r} + {_u(seed, 2, 'i')} * {maxx - minx!r} END AS x,
+               CASE WHEN {_u(seed, 1, 'i')} < 0.75
+                    THEN {cy}[1 + i % {k}] + {_n(seed, 20, 'i')} * 1200 * {M_LAT!r}
+                    ELSE {miny!r} + {_u(seed, 3, 'i')} * {maxy - miny!r} END AS y,
+               (8 + {_u(seed, 4, 'i')} * 32) * {M_LON!r} AS w,
+               (8 + {_u(seed, 5, 'i')} * 32) * {M_LAT!r} AS h,
+               printf('%07dVK%04dN', 1000000 + i // 2, 3000 + (i // 2) % 7000) AS ref14
+        FROM range({n['buildings']}) t(i);
+    """)
+
+    con.execute(f"""
+        CREATE TABLE buildings AS
+        SELECT ST_MakeEnvelope(x - w / 2, y - h / 2, x + w / 2, y + h / 2) AS geom,
+               'ES.SDGC.BU.' || ref14 AS gml_id,
+               ref14 || printf('%04d', 1 + i % 2) || 'AB' AS reference,
+               ref14 AS localId,
+               'functional' AS conditionOfConstruction,
+               DATE '1950-01-01' + CAST(floor({_u(seed, 30, 'i')} * 26000) AS INTEGER) AS beginning,
+               {_list(USES)}[1 + CAST(floor({_u(seed, 31, 'i')} * {len(USES)}) AS INTEGER)] AS currentUse,
+               1 + CAST(floor({_u(seed, 32, 'i')} * 40) AS INTEGER) AS numberOfBuildingUnits,
+               CAST(floor({_u(seed, 33, 'i')} * 36) AS INTEGER) AS numberOfDwellings,
+               1 + CAST(floor({_u(seed, 34, 'i')} * 9) AS INTEGER) AS numberOfFloorsAboveGround,
+               round((w / {M_LON!r}) * (h / {M_LAT!r}) * (1 + CAST(floor({_u(seed, 34, 'i')} * 9) AS INTEGER))) AS value,
+               'm2' AS value_uom
+        FROM _b;
+    """)
+
+    con.execute(f"""
+        CREATE TABLE edificios_metrics AS
+        WITH m AS (
+          SELECT ref14 || printf('%04d', 1 + i % 2) || 'AB' AS reference,
+                 (w / {M_LON!r}) * (h / {M_LAT!r}) AS area_m2,
+                 1100 + {_u(seed, 40, 'i')} * 700 AS irr,
+                 {_u(seed, 41, 'i')} AS u
+          FROM _b
+        )
+        SELECT reference,
+               irr AS irr_average,
+               area_m2,
+               area_m2 * (0.4 + u * 0.3) AS superficie_util_m2,
+               area_m2 * (0.4 + u * 0.3) / 6.0 AS pot_kWp,
+               area_m2 * (0.4 + u * 0.3) / 6.0 * irr * 0.8 AS energy_total_kWh,
+               12 + u * 8 AS factor_capacidad_pct,
+               irr * (0.9 + u * 0.2) AS irr_mean_kWhm2_y,
+               area_m2 * (0.4 + u * 0.3) / 6.0 * irr * 0.8 * 0.25 AS reduccion_emisiones,
+               area_m2 * (0.4 + u * 0.3) / 6.0 * irr * 0.8 * 0.15 AS ahorro_eur,
+               CAST(1 + floor(u * 7) AS DOUBLE) AS certificadoCO2,
+               CAST(1 + floor({_u(seed, 42, 'reference')} * 7) AS DOUBLE) AS cal_norenov,
+               CAST(u < 0.6 AS DOUBLE) AS certificadoCO2_es_estimado,
+               CAST(u < 0.4 AS DOUBLE) AS cal_norenov_es_estimado
+        FROM m;
+    """)
+
+    # Shadow cells (~5 m) and irradiance samples fall on and around the buildings
+    con.execute(f"""
+        CREATE TABLE shadows AS
+        WITH c AS (
+          SELECT s, b.x + ({_u(seed, 50, 's')} - 0.5) * 3 * b.w AS x,
+                    b.y + ({_u(seed, 51, 's')} - 0.5) * 3 * b.h AS y
+          FROM range({n['shadows']}) t(s)
+          JOIN _b b ON b.i = hash(s, 52, {seed}) % {n['buildings']}
+        )
+        SELECT ST_MakeEnvelope(x, y, x + 5 * {M_LON!r}, y + 5 * {M_LAT!r}) AS geom,
+               CAST(floor({_u(seed, 53, 's')} * 25) AS INTEGER) AS shadow_count
+        FROM c;
+    """)
+    con.execute(f"""
+        CREATE TABLE irr_points AS
+        WITH p AS (
+          SELECT s, b.x + ({_u(seed, 60, 's')} - 0.5) * b.w AS x,
+                    b.y + ({_u(seed, 61, 's')} - 0.5) * b.h AS y
+          FROM range({n['irr_points']}) t(s)
+          JOIN _b b ON b.i = hash(s, 62, {seed}) % {n['buildings']}
+        )
+        SELECT ST_Transform(ST_Point(x, y), 'EPSG:4326', 'EPSG:25830', TRUE) AS geom,
+               round(700 + {_u(seed, 63, 's')} * 1200, 1) AS value
+        FROM p;
+    """)
+
+    con.execute(f"""
+        CREATE TABLE big_points AS
+        SELECT i + 1 AS id,
+               ST_Point(
+                 CASE WHEN {_u(seed, 70, 'i')} < 0.6
+                      THEN {cx}[1 + i % {k}] + {_n(seed, 71, 'i')} * 1500 * {M_LON!r}
+                      ELSE {minx!r} + {_u(seed, 74, 'i')} * {maxx - minx!r} END,
+                 CASE WHEN {_u(seed, 70, 'i')} < 0.6
+                      THEN {cy}[1 + i % {k}] + {_n(seed, 75, 'i')} * 1500 * {M_LAT!r}
+                      ELSE {miny!r} + {_u(seed, 78, 'i')} * {maxy - miny!r} END
+               ) AS geom,
+               ['farola', 'arbol', 'contenedor', 'banco', 'parada'][1 + CAST(floor({_u(seed, 79, 'i')} * 5) AS INTEGER)]
+                 AS category,
+               round({_u(seed, 80, 'i')} * 100, 2) AS value
+        FROM range({n['big_points']}) t(i);
+    """)
+
+    # Addresses: each building gets one or two numbers, unique along a street picked by its position
+    con.execute(f"""
+        CREATE TABLE address_index AS
+        WITH a AS (
+          SELECT {_list(STREETS)}[1 + abs(CAST(floor(x / 0.004) + floor(y / 0.004) * 7 AS INTEGER)) % {len(STREETS)}]
+                   AS street_norm,
+                 ref14 || printf('%04d', 1 + i % 2) || 'AB' AS reference,
+                 i, n
+          FROM _b, range(2) r(n)
+          WHERE n = 0 OR {_u(seed, 90, 'i')} < {ADDRESSES_PER_BUILDING - 1!r}
+        )
+        SELECT street_norm,
+               CAST(row_number() OVER (PARTITION BY street_norm ORDER BY i, n) AS VARCHAR) AS number_norm,
+               reference
+        FROM a;
+    """)
+    con.execute("CREATE INDEX idx_addr ON address_index(street_norm, number_norm);")
+
+    con.execute(f"""
+        CREATE TABLE autoconsumos_CELS AS
+        WITH c AS (
+          SELECT i, hash(i, 100, {seed}) % {n['buildings']} AS j FROM range({n['autoconsumos_CELS']}) t(i)
+        ),
+        a AS (
+          SELECT reference, any_value(street_norm) AS street_norm, min(number_norm) AS number_norm
+          FROM address_index GROUP BY reference
+        )
+        SELECT c.i + 1 AS id,
+               'CELS ' || (c.i + 1) AS nombre,
+               a.street_norm, a.number_norm,
+               b.ref14 || printf('%04d', 1 + b.i % 2) || 'AB' AS reference,
+               1 + CAST({_u(seed, 101, 'c.i')} < 0.3 AS INTEGER) AS auto_CEL,
+               round({_u(seed, 102, 'c.i')} * 100, 1) AS por_ocupacion,
+               CAST([500.0, 1000.0, 2000.0] AS DOUBLE[])[1 + CAST(floor({_u(seed, 103, 'c.i')} * 3) AS INTEGER)] AS radio
+        FROM c
+        JOIN _b b ON b.i = c.j
+        LEFT JOIN a ON a.reference = b.ref14 || printf('%04d', 1 + b.i % 2) || 'AB';
+    """)
+
+    # Same points table / buffers view as ingest.py, for /buffers
+    con.execute("""
+        CREATE TABLE points (
+          id BIGINT,
+          created_at TIMESTAMP DEFAULT now(),
+          user_id VARCHAR,
+          geom GEOMETRY,
+          buffer_m DOUBLE DEFAULT 100.0,
+          props JSON
+        );
+    """)
+    con.execute("""
+        INSERT INTO points (id, user_id, geom, buffer_m, props) VALUES
+          (1, 'tech1', ST_Point(-3.732336, 40.300712), 250.0, '{"name":"Puerta del Sol"}'::JSON),
+          (2, 'tech2', ST_Point(-3.730748, 40.319223), 100.0, '{"name":"Callao"}'::JSON);
+    """)
+    con.execute("""
+        CREATE OR REPLACE VIEW point_buffers AS
+        SELECT id, user_id, created_at, buffer_m, ST_Buffer(geom, buffer_m / 111000.0)::GEOMETRY AS geom
+        FROM points;
+    """)
+    con.execute("DROP TABLE _b;")
+
+    build_all(con)
+    con.execute("CHECKPOINT;")
+    counts = {
+        t: con.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0]
+        for t in ("buildings", "edificios_metrics", "shadows", "irr_points", "big_points",
+                  "autoconsumos_CELS", "address_index")
+    }
+    con.close()
+    return counts
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Build a synthetic warehouse for benchmarking public_api")
+    ap.add_argument("db", help="output .duckdb file")
+    ap.add_argument("--scale", type=float, default=1.0, help="row counts relative to Getafe (default 1.0)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--force", action="store_true", help="overwrite an existing file")
+    args = ap.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.force:
+            sys.exit(f"{args.db} ya existe (usa --force para sobrescribirlo)")
+        os.remove(args.db)
+    t0 = time.perf_counter()
+    counts = generate(args.db, args.scale, args.seed)
+    for table, rows in counts.items():
+        print(f"{table:<20} {rows:>10,}")
+    print(f"✅ {args.db} generado en {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
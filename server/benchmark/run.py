@@ -0,0 +1,246 @@
+# run.py — in-process load harness: replays map sessions against public_api/app.py
+from __future__ import annotations
+import argparse, asyncio, json, math, os, random, resource, sys, time
+from collections import Counter, defaultdict
+from urllib.parse import urlencode
+
+from benchmark.scenarios import SCENARIOS, Call, Sample, load_sample
+
+PUBLIC_API = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "public_api")
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> int:
+    """Current resident set size (peak so far where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class AsgiClient:
+    """Calls the ASGI app directly (no sockets) and reads whole responses, as a browser would."""
+
+    def __init__(self, app, state: dict, accept_encoding: str):
+        self.app = app
+        self.state = state
+        self.accept_encoding = accept_encoding.encode()
+
+    async def request(self, call: Call) -> tuple[int, int]:
+        body = json.dumps(call.body).encode() if call.body is not None else b""
+        headers = [(b"host", b"bench"), (b"accept-encoding", self.accept_encoding)]
+        if call.body is not None:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": call.method, "scheme": "http", "path": call.path, "raw_path": call.path.encode(),
+            "query_string": urlencode(call.params).encode(), "root_path": "", "headers": headers,
+            "client": ("127.0.0.1", 0), "server": ("bench", 80), "state": dict(self.state),
+        }
+        done = asyncio.Event()
+        request_sent = False
+        status, size = 0, 0
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await done.wait()  # the client stays connected until the response is read
+            return {"type": "http.disconnect"}
+
+        async def send(msg):
+            nonlocal status, size
+            if msg["type"] == "http.response.start":
+                status = msg["status"]
+            elif msg["type"] == "http.response.body":
+                size += len(msg.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            done.set()
+        return status, size
+
+
+class Recorder:
+    def __init__(self, label):
+        self.label = label
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        self.bytes: Counter = Counter()
+        self.peak_rss: dict[str, int] = defaultdict(int)
+        self.enabled = True
+
+    def add(self, path: str, seconds: float, status: int, size: int) -> None:
+        if not self.enabled:
+            return
+        name = self.label(path)
+        self.latencies[name].append(seconds)
+        self.statuses[name][status] += 1
+        self.bytes[name] += size
+        self.peak_rss[name] = max(self.peak_rss[name], rss_bytes())
+
+
+async def _user(client: AsgiClient, recorder: Recorder, sample: Sample, rng: random.Random,
+                scenarios: list[str], weights: list[int], stop_at: float, think: float) -> None:
+    while time.monotonic() < stop_at:
+        name = rng.choices(scenarios, weights)[0]
+        for step in SCENARIOS[name][0](rng, sample):
+            if time.monotonic() >= stop_at:
+                return
+
+            async def timed(call: Call):
+                t0 = time.perf_counter()
+                status, size = await client.request(call)
+                recorder.add(call.path, time.perf_counter() - t0, status, size)
+
+            await asyncio.gather(*(timed(c) for c in step))
+            if think:
+                await asyncio.sleep(rng.uniform(0, 2 * think))
+
+
+def _percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile."""
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    endpoints = {}
+    for name, values in sorted(recorder.latencies.items()):
+        values.sort()
+        statuses = recorder.statuses[name]
+        endpoints[name] = {
+            "requests": len(values),
+            "rps": len(values) / elapsed,
+            "p50_ms": _percentile(values, 50) * 1000,
+            "p95_ms": _percentile(values, 95) * 1000,
+            "p99_ms": _percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000,
+            "errors": sum(n for s, n in statuses.items() if s >= 400 and s != 404),
+            "statuses": {str(s): n for s, n in sorted(statuses.items())},
+            "bytes": recorder.bytes[name],
+            "peak_rss_mb": recorder.peak_rss[name] / 2**20,
+        }
+    total = sum(e["requests"] for e in endpoints.values())
+    return {
+        "elapsed_s": elapsed,
+        "requests": total,
+        "rps": total / elapsed if elapsed else 0.0,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "endpoints": endpoints,
+    }
+
+
+def print_report(summary: dict, baseline: dict | None = None) -> None:
+    cols = f"{'endpoint':<34}{'n':>7}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'err':>6}{'MB':>8}{'RSS MB':>8}"
+    if baseline:
+        cols += f"{'Δp95':>9}"
+    print(cols)
+    for name, e in summary["endpoints"].items():
+        line = (f"{name:<34}{e['requests']:>7}{e['rps']:>8.1f}{e['p50_ms']:>9.1f}{e['p95_ms']:>9.1f}"
+                f"{e['p99_ms']:>9.1f}{e['errors']:>6}{e['bytes'] / 2**20:>8.1f}{e['peak_rss_mb']:>8.0f}")
+        if baseline:
+            old = baseline["endpoints"].get(name)
+            line += f"{(e['p95_ms'] / old['p95_ms'] - 1) * 100:>+8.0f}%" if old and old["p95_ms"] else f"{'—':>9}"
+        print(line)
+    print(f"\n{summary['requests']} peticiones en {summary['elapsed_s']:.1f}s "
+          f"({summary['rps']:.1f} req/s), RSS máximo {summary['peak_rss_mb']:.0f} MB")
+
+
+def regressions(summary: dict, baseline: dict, tolerance: float, min_requests: int = 20) -> list[str]:
+    """Endpoints whose p95 grew by more than `tolerance` (endpoints with few samples are ignored)."""
+    out = []
+    for name, e in summary["endpoints"].items():
+        old = baseline["endpoints"].get(name)
+        if (old and old["p95_ms"] and min(e["requests"], old["requests"]) >= min_requests
+                and e["p95_ms"] > old["p95_ms"] * (1 + tolerance)):
+            out.append(f"{name}: p95 {old['p95_ms']:.1f} → {e['p95_ms']:.1f} ms")
+    return out
+
+
+async def run(api, sample: Sample, args) -> dict:
+    """`api` is the public_api app module: its FastAPI app and route labels (endpoint_label)."""
+    recorder = Recorder(api.endpoint_label)
+    async with api.app.router.lifespan_context(api.app) as state:
+        client = AsgiClient(api.app, state or {}, args.accept_encoding)
+        names = args.scenarios.split(",")
+        weights = [SCENARIOS[n][1] for n in names]
+
+        async def phase(seconds: float, record: bool) -> float:
+            recorder.enabled = record
+            stop_at = time.monotonic() + seconds
+            t0 = time.perf_counter()
+            await asyncio.gather(*(
+                _user(client, recorder, sample, random.Random(args.seed * 1000 + i), names, weights,
+                      stop_at, args.think)
+                for i in range(args.users)
+            ))
+            return time.perf_counter() - t0
+
+        if args.warmup:
+            await phase(args.warmup, record=False)
+        elapsed = await phase(args.duration, record=True)
+    return summarize(recorder, elapsed)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Load test public_api in-process against a warehouse")
+    ap.add_argument("db", help="warehouse .duckdb (see python -m benchmark.generate)")
+    ap.add_argument("--users", type=int, default=8, help="concurrent simulated map sessions")
+    ap.add_argument("--duration", type=float, default=60.0, help="measured seconds")
+    ap.add_argument("--warmup", type=float, default=10.0, help="unmeasured seconds before")
+    ap.add_argument("--think", type=float, default=0.0, help="mean pause between steps (s)")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of "
+                    + ", ".join(SCENARIOS))
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--accept-encoding", default="gzip, br", help="sent by every request")
+    ap.add_argument("--result-cache", action="store_true", help="keep the API's result cache on")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra API setting")
+    ap.add_argument("--out", help="write the summary as JSON")
+    ap.add_argument("--baseline", help="JSON from an earlier run: show p95 change, exit 1 on regression")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="p95 growth counted as regression")
+    args = ap.parse_args()
+    for n in args.scenarios.split(","):
+        if n not in SCENARIOS:
+            ap.error(f"escenario desconocido: {n}")
+
+    db = os.path.abspath(args.db)
+    sample = load_sample(db, seed=args.seed)
+
+    # Settings are read when app.py is imported; cached tiles/results would hide query cost
+    os.environ.update({
+        "DUCKDB_PATH": db,
+        "READ_ONLY": "true",
+        "TILE_STORE": "false",
+        "RESULT_CACHE_MB": os.environ.get("RESULT_CACHE_MB", "256") if args.result_cache else "0",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        os.environ[key] = value
+    sys.path.insert(0, PUBLIC_API)
+    import app as api  # noqa: E402
+
+    summary = asyncio.run(run(api, sample, args))
+    summary["settings"] = {k: v for k, v in vars(args).items() if k not in ("out", "baseline")}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(summary, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if baseline:
+        worse = regressions(summary, baseline, args.tolerance)
+        for line in worse:
+            print(f"⚠️  {line}")
+        if worse:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
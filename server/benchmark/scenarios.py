@@ -0,0 +1,148 @@
+# scenarios.py — request sequences a map session produces: pan, zoom, lookups and zonal stats
+from __future__ import annotations
+import math, random
+from dataclasses import dataclass, field
+
+import duckdb
+
+VIEW_W, VIEW_H = 1280, 800   # viewport in pixels
+
+
+@dataclass(frozen=True)
+class Call:
+    method: str
+    path: str
+    params: dict = field(default_factory=dict)
+    body: dict | None = None
+
+
+# A step is what the viewer sends at once (layers of one viewport, a lookup's requests)
+Step = list[Call]
+
+
+@dataclass
+class Sample:
+    """Real keys and places from the warehouse, so lookups hit and viewports have data."""
+    centres: list[tuple[float, float]]
+    references: list[str]
+    addresses: list[tuple[str, str]]
+
+
+def load_sample(db_path: str, size: int = 500, seed: int = 1) -> Sample:
+    sample = f"reservoir({int(size)} ROWS) REPEATABLE ({int(seed)})"
+    con = duckdb.connect(db_path, read_only=True)
+    try:
+        con.execute("LOAD spatial;")
+        centres = con.execute(f"""
+            SELECT ST_X(c), ST_Y(c) FROM (SELECT ST_Centroid(geom) AS c FROM buildings USING SAMPLE {sample})
+        """).fetchall()
+        references = [r[0] for r in con.execute(
+            f"SELECT reference FROM edificios_metrics USING SAMPLE {sample}").fetchall()]
+        addresses = con.execute(
+            f"SELECT street_norm, number_norm FROM address_index USING SAMPLE {sample}").fetchall()
+    finally:
+        con.close()
+    if not centres:
+        raise SystemExit("El warehouse no tiene edificios: genera uno con python -m benchmark.generate")
+    return Sample(centres, references, addresses)
+
+
+def viewport(lon: float, lat: float, zoom: int) -> tuple[float, float, float, float]:
+    """WGS84 bbox of a VIEW_W × VIEW_H map centred on (lon, lat) at `zoom`."""
+    deg_px = 360.0 / (256 * (1 << zoom))
+    half_w = VIEW_W / 2 * deg_px
+    half_h = VIEW_H / 2 * deg_px * math.cos(math.radians(lat))
+    return lon - half_w, lat - half_h, lon + half_w, lat + half_h
+
+
+def _tile(lon: float, lat: float, z: int) -> tuple[int, int]:
+    n = 1 << z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return x, y
+
+
+def map_layers(lon: float, lat: float, zoom: int) -> Step:
+    """The requests the viewer fires for one viewport: layers depend on the zoom."""
+    bounds = viewport(lon, lat, zoom)
+    bbox = ",".join(f"{v:.6f}" for v in bounds)
+    calls = [Call("GET", "/buildings/features", {"bbox": bbox, "zoom": zoom})]
+    if zoom < 15:
+        calls += [Call("GET", "/irradiance/grid", {"bbox": bbox, "zoom": zoom}),
+                  Call("GET", "/points/grid", {"bbox": bbox, "zoom": zoom})]
+    else:
+        calls += [Call("GET", "/buildings/irradiance", {"bbox": bbox, "zoom": zoom}),
+                  Call("GET", "/shadows/features", {"bbox": bbox}),
+                  Call("GET", "/cels/features", {"bbox": bbox}),
+                  Call("GET", "/points/count", {"bbox": bbox})]
+    if zoom >= 17:
+        calls.append(Call("GET", "/irradiance/features", {"bbox": bbox}))
+    if zoom >= 13:
+        x0, y0 = _tile(bounds[0], bounds[3], zoom)
+        x1, y1 = _tile(bounds[2], bounds[1], zoom)
+        calls += [Call("GET", f"/tiles/buildings/{zoom}/{x}/{y}.mvt")
+                  for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+    return calls
+
+
+def pan(rng: random.Random, sample: Sample) -> list[Step]:
+    """A few drags of ~1/3 of the screen in one direction, at a street-level zoom."""
+    lon, lat = rng.choice(sample.centres)
+    zoom = rng.choice((14, 15, 16, 17))
+    angle = rng.uniform(0, 2 * math.pi)
+    minx, miny, maxx, maxy = viewport(lon, lat, zoom)
+    dx, dy = (maxx - minx) / 3 * math.cos(angle), (maxy - miny) / 3 * math.sin(angle)
+    return [map_layers(lon + i * dx, lat + i * dy, zoom) for i in range(rng.randint(3, 6))]
+
+
+def zoom(rng: random.Random, sample: Sample) -> list[Step]:
+    """Zooming in from the town view to a building, or back out."""
+    lon, lat = rng.choice(sample.centres)
+    levels = list(range(rng.choice((12, 13)), rng.choice((17, 18)) + 1))
+    if rng.random() < 0.3:
+        levels.reverse()
+    return [map_layers(lon, lat, z) for z in levels]
+
+
+def lookup(rng: random.Random, sample: Sample) -> list[Step]:
+    """Address search, then the building's card (metrics + outline)."""
+    steps = []
+    if sample.addresses:
+        street, number = rng.choice(sample.addresses)
+        steps.append([Call("GET", "/address/lookup",
+                           {"street": street, "number": number, "include_feature": "true"})])
+    ref = rng.choice(sample.references) if sample.references else None
+    if ref:
+        steps.append([Call("GET", "/buildings/metrics", {"reference": ref}),
+                      Call("GET", "/buildings/by_ref", {"ref": ref}),
+                      Call("GET", "/cadastre/feature", {"refcat": ref})])
+    return steps
+
+
+def _polygon(lon: float, lat: float, radius_m: float, sides: int = 12) -> dict:
+    dlon = radius_m / (111_320.0 * math.cos(math.radians(lat)))
+    dlat = radius_m / 110_540.0
+    ring = [[lon + dlon * math.cos(2 * math.pi * i / sides), lat + dlat * math.sin(2 * math.pi * i / sides)]
+            for i in range(sides)]
+    return {"type": "Polygon", "coordinates": [ring + [ring[0]]]}
+
+
+def zonal(rng: random.Random, sample: Sample) -> list[Step]:
+    """A drawn zone (100–800 m across) and its statistics / nearby CELS."""
+    lon, lat = rng.choice(sample.centres)
+    zone = {"geometry": _polygon(lon, lat, rng.uniform(50, 400))}
+    point = {"geometry": {"type": "Point", "coordinates": [lon, lat]}}
+    return [
+        [Call("POST", "/shadows/zonal", body=zone), Call("POST", "/irradiance/zonal", body=zone)],
+        [Call("POST", "/cels/within", {"radius_m": rng.choice((500, 1000, 2000))}, point),
+         Call("POST", "/cels/nearest", {"k": 5}, point)],
+    ]
+
+
+# name -> (sequence builder, relative weight in the mix)
+SCENARIOS = {
+    "pan": (pan, 4),
+    "zoom": (zoom, 2),
+    "lookup": (lookup, 3),
+    "zonal": (zonal, 1),
+}
@@ -0,0 +1,363 @@
+# derived.py — índices y estructuras derivadas del warehouse
+#
+# Se ejecuta al final de cada carga (ingest.py) y también a mano:
+#   python derived.py [warehouse.duckdb]     # por defecto el DUCKDB_PATH de la API
+# Todas las operaciones son idempotentes.
+import math, sys, duckdb
+
+
+# Columnas de geometría que llevan índice RTREE (en cualquier tabla que las tenga)
+RTREE_COLUMNS = ("geom", "geom_25830", "geom_4326")
+
+# Tablas guardadas en un CRS métrico que reciben además la geometría en WGS84
+# (tabla -> SRID de geom), para que la API filtre y devuelva en 4326 sin reproyectar filas
+WGS84_COPIES = {"irr_points": 25830}
+
+# Sube al cambiar el esquema de cels_points para forzar su reconstrucción
+CELS_POINTS_VERSION = 2
+
+# Niveles de detalle de las huellas de buildings: columna -> tolerancia de
+# ST_SimplifyPreserveTopology en grados (1e-5° ≈ 1 m en Getafe). La API elige
+# columna según el zoom (ver BUILDING_LOD en public_api/app.py).
+BUILDING_LODS = {"geom_lod1": 1e-5, "geom_lod2": 4e-5}
+BUILDING_LODS_VERSION = 1
+
+# Celdas cuadradas precalculadas para /irradiance/grid y /points/grid:
+# tabla -> (columna de geometría WGS84, columna de valor o None). Mismo tamaño de
+# celda que public_api/grid.py (CELL_PX px de un tile de 256 a la latitud de Getafe).
+GRID_LAYERS = {"irr_points": ("geom_4326", "value"), "big_points": ("geom", None)}
+GRID_ZOOMS = range(10, 16)
+GRID_CELL_PX = 32
+GRID_REF_LAT = 40.3
+
+# Tablas con referencia catastral: reciben ref_key (completa) y ref14 (parcela) normalizadas
+REF_TABLES = ("buildings", "edificios_metrics", "autoconsumos_CELS")
+
+# Tablas agrupadas espacialmente: tabla -> columna de geometría en WGS84. Se reescriben
+# en el orden de la curva de Hilbert y reciben el bbox de cada fila (BBOX_COLUMNS), que
+# la API filtra antes de ST_Intersects (ver public_api/spatial.py)
+SPATIAL_ORDER = {"buildings": "geom", "shadows": "geom", "irr_points": "geom_4326", "big_points": "geom"}
+SPATIAL_ORDER_VERSION = 1
+BBOX_COLUMNS = ("xmin", "ymin", "xmax", "ymax")
+
+# Filas por row group de las tablas que se escriben. Con el valor por defecto de DuckDB
+# (122.880) buildings entera cabe en un row group y sus min/max no descartan nada.
+# No se guarda en el fichero: hay que abrir el warehouse con connect().
+ROW_GROUP_SIZE = 16384
+
+
+def connect(path: str) -> duckdb.DuckDBPyConnection:
+    """Abre el warehouse para escribir en él (como base de datos por defecto) con ROW_GROUP_SIZE."""
+    literal = "'" + path.replace("'", "''") + "'"
+    con = duckdb.connect()
+    con.execute(f"ATTACH {literal} AS warehouse (ROW_GROUP_SIZE {ROW_GROUP_SIZE});")
+    con.execute("USE warehouse;")
+    return con
+
+
+def _tables(con: duckdb.DuckDBPyConnection) -> set[str]:
+    rows = con.execute("""
+        SELECT table_name FROM duckdb_tables()
+        WHERE database_name = current_database() AND schema_name = 'main';
+    """).fetchall()
+    return {r[0] for r in rows}
+
+
+def _columns(con: duckdb.DuckDBPyConnection, table: str) -> list[str]:
+    rows = con.execute("""
+        SELECT column_name FROM duckdb_columns()
+        WHERE database_name = current_database() AND schema_name = 'main' AND table_name = ?
+        ORDER BY column_index;
+    """, [table]).fetchall()
+    return [r[0] for r in rows]
+
+
+def _source_fingerprint(con: duckdb.DuckDBPyConnection) -> str:
+    """Huella de las filas de buildings + autoconsumos_CELS que alimentan cels_points."""
+    b = con.execute("SELECT COUNT(*), bit_xor(hash(ref14, geom)) FROM buildings").fetchone()
+    c = con.execute("SELECT COUNT(*), bit_xor(hash(to_json(c))) FROM autoconsumos_CELS c").fetchone()
+    return f"v{CELS_POINTS_VERSION}|{b[0]}:{b[1]}|{c[0]}:{c[1]}"
+
+
+def _meta_get(con: duckdb.DuckDBPyConnection, name: str) -> str | None:
+    con.execute("CREATE TABLE IF NOT EXISTS derived_meta (name VARCHAR PRIMARY KEY, value VARCHAR);")
+    row = con.execute("SELECT value FROM derived_meta WHERE name = ?", [name]).fetchone()
+    return row[0] if row else None
+
+
+def _meta_set(con: duckdb.DuckDBPyConnection, name: str, value: str) -> None:
+    con.execute("INSERT OR REPLACE INTO derived_meta VALUES (?, ?);", [name, value])
+
+
+def _drop_indexes(con: duckdb.DuckDBPyConnection, table: str) -> None:
+    """DuckDB no permite ALTER TABLE con índices dependientes; se recrean después."""
+    rows = con.execute(
+        "SELECT index_name FROM duckdb_indexes()"
+        " WHERE database_name = current_database() AND schema_name = 'main' AND table_name = ?",
+        [table],
+    ).fetchall()
+    for (name,) in rows:
+        con.execute(f'DROP INDEX IF EXISTS "{name}";')
+
+
+def _geometry_columns(con: duckdb.DuckDBPyConnection) -> list[tuple[str, str]]:
+    return con.execute("""
+        SELECT c.table_name, c.column_name
+        FROM duckdb_columns() c
+        JOIN duckdb_tables() t USING (database_name, schema_name, table_name)
+        WHERE c.database_name = current_database() AND c.schema_name = 'main' AND c.data_type = 'GEOMETRY'
+        ORDER BY c.table_name, c.column_index;
+    """).fetchall()
+
+
+def build_rtree_indexes(con: duckdb.DuckDBPyConnection) -> list[str]:
+    """
+    Crea (si falta) un índice RTREE sobre cada columna de RTREE_COLUMNS de todas las
+    tablas. DuckDB lo mantiene en INSERT/UPDATE/DELETE; un DROP/CREATE de la tabla
+    lo elimina, por eso se vuelve a llamar tras cada recarga.
+    """
+    created = []
+    for table, column in _geometry_columns(con):
+        if column.lower() not in RTREE_COLUMNS:
+            continue
+        name = f"{table}_{column}_rtree"
+        con.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" USING RTREE ("{column}");')
+        created.append(name)
+    return created
+
+
+def build_ref_keys(con: duckdb.DuckDBPyConnection) -> list[str]:
+    """
+    Añade/recalcula ref_key = UPPER(TRIM(reference)) y ref14 = LEFT(ref_key, 14) con
+    índice ART en las tablas de REF_TABLES, para que las búsquedas por referencia y los
+    cruces por parcela no tengan que evaluar UPPER()/LEFT() fila a fila.
+    """
+    done = []
+    present = _tables(con)
+    for table in REF_TABLES:
+        if table not in present or "reference" not in [c.lower() for c in _columns(con, table)]:
+            continue
+        _drop_indexes(con, table)
+        con.execute(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS ref_key VARCHAR;')
+        con.execute(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS ref14 VARCHAR;')
+        con.execute(f"""
+            UPDATE "{table}"
+            SET ref_key = UPPER(TRIM(CAST(reference AS VARCHAR))),
+                ref14   = LEFT(UPPER(TRIM(CAST(reference AS VARCHAR))), 14);
+        """)
+        con.execute(f'CREATE INDEX IF NOT EXISTS "{table}_ref_key_idx" ON "{table}" (ref_key);')
+        con.execute(f'CREATE INDEX IF NOT EXISTS "{table}_ref14_idx" ON "{table}" (ref14);')
+        done.append(table)
+    return done
+
+
+def build_cels_points(con: duckdb.DuckDBPyConnection, force: bool = False) -> bool:
+    """
+    Materializa la ubicación de cada CELS (un punto interior de cada edificio de su
+    parcela) para no repetir el cruce buildings × autoconsumos_CELS en cada petición.
+    Guarda también el punto en EPSG:25830 (distancias en metros) y el radio propio del
+    CELS si la tabla origen trae columna `radio`.
+    Solo se recalcula si cambió alguna de las dos tablas origen. Devuelve True si se rehízo.
+    """
+    if not {"buildings", "autoconsumos_CELS"} <= _tables(con):
+        return False
+    fingerprint = _source_fingerprint(con)
+    if not force and fingerprint == _meta_get(con, "cels_points") and "cels_points" in _tables(con):
+        return False
+    has_radio = "radio" in [col.lower() for col in _columns(con, "autoconsumos_CELS")]
+    radius = "TRY_CAST(c.radio AS DOUBLE)" if has_radio else "NULL::DOUBLE"
+    con.execute(f"""
+        CREATE OR REPLACE TABLE cels_points AS
+        WITH p AS (
+          SELECT c.* REPLACE (CAST(c.por_ocupacion AS DOUBLE) AS por_ocupacion),
+                 {radius} AS radius_m,
+                 b.reference AS building_ref,
+                 ST_PointOnSurface(b.geom) AS geom
+          FROM autoconsumos_CELS c
+          JOIN buildings b ON b.ref14 = c.ref14
+          WHERE b.geom IS NOT NULL
+        )
+        SELECT *, ST_Transform(geom, 'EPSG:4326', 'EPSG:25830', TRUE) AS geom_25830
+        FROM p;
+    """)
+    _meta_set(con, "cels_points", fingerprint)
+    return True
+
+
+def build_building_lods(con: duckdb.DuckDBPyConnection, force: bool = False) -> bool:
+    """
+    Añade a buildings una geometría simplificada por nivel de BUILDING_LODS y
+    footprint_m2 (área de la huella en EPSG:25830), con la que la API descarta los
+    edificios más pequeños que un píxel a zoom bajo. Solo se recalcula si cambiaron
+    las geometrías. Devuelve True si se rehízo.
+    """
+    if "buildings" not in _tables(con):
+        return False
+    row = con.execute("SELECT COUNT(*), bit_xor(hash(geom)) FROM buildings").fetchone()
+    fingerprint = f"v{BUILDING_LODS_VERSION}|{sorted(BUILDING_LODS.items())}|{row[0]}:{row[1]}"
+    columns = [c.lower() for c in _columns(con, "buildings")]
+    if (not force and fingerprint == _meta_get(con, "building_lods")
+            and all(c in columns for c in (*BUILDING_LODS, "footprint_m2"))):
+        return False
+    _drop_indexes(con, "buildings")
+    for column in BUILDING_LODS:
+        con.execute(f'ALTER TABLE buildings ADD COLUMN IF NOT EXISTS "{column}" GEOMETRY;')
+    con.execute("ALTER TABLE buildings ADD COLUMN IF NOT EXISTS footprint_m2 DOUBLE;")
+    lods = ",\n".join(
+        f'"{column}" = ST_SimplifyPreserveTopology(geom, {tolerance!r})'
+        for column, tolerance in BUILDING_LODS.items()
+    )
+    con.execute(f"""
+        UPDATE buildings
+        SET {lods},
+            footprint_m2 = ST_Area(ST_Transform(geom, 'EPSG:4326', 'EPSG:25830', TRUE));
+    """)
+    _meta_set(con, "building_lods", fingerprint)
+    return True
+
+
+def build_wgs84_copies(con: duckdb.DuckDBPyConnection, force: bool = False) -> list[str]:
+    """
+    Añade/recalcula geom_4326 = geom reproyectada a EPSG:4326 en las tablas de
+    WGS84_COPIES (su índice RTREE lo crea build_rtree_indexes). Solo se recalcula
+    si cambiaron las geometrías. Devuelve las tablas rehechas.
+    """
+    done = []
+    present = _tables(con)
+    for table, srid in WGS84_COPIES.items():
+        if table not in present:
+            continue
+        row = con.execute(f'SELECT COUNT(*), bit_xor(hash(geom)) FROM "{table}"').fetchone()
+        fingerprint = f"{srid}|{row[0]}:{row[1]}"
+        has_column = "geom_4326" in [c.lower() for c in _columns(con, table)]
+        if not force and has_column and fingerprint == _meta_get(con, f"{table}.geom_4326"):
+            continue
+        _drop_indexes(con, table)
+        con.execute(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS geom_4326 GEOMETRY;')
+        con.execute(f"""
+            UPDATE "{table}"
+            SET geom_4326 = ST_Transform(geom, 'EPSG:{int(srid)}', 'EPSG:4326', TRUE);
+        """)
+        _meta_set(con, f"{table}.geom_4326", fingerprint)
+        done.append(table)
+    return done
+
+
+def build_spatial_order(con: duckdb.DuckDBPyConnection, force: bool = False) -> list[str]:
+    """
+    Reescribe las tablas de SPATIAL_ORDER ordenadas por el índice de Hilbert del centro
+    de cada geometría (dentro de la extensión de la tabla) y con su bbox WGS84 en
+    xmin/ymin/xmax/ymax. Así las filas vecinas comparten row group y las estadísticas
+    min/max de esas columnas bastan para saltarse los que caen fuera de un viewport.
+    Solo se rehace si cambiaron las geometrías. Devuelve las tablas reescritas.
+    """
+    done = []
+    present = _tables(con)
+    for table, geom in SPATIAL_ORDER.items():
+        if table not in present:
+            continue
+        columns = _columns(con, table)
+        lower = [c.lower() for c in columns]
+        if geom not in lower:
+            continue
+        row = con.execute(f"""
+            SELECT COUNT(*), bit_xor(hash({geom})),
+                   MIN(ST_XMin({geom})), MIN(ST_YMin({geom})), MAX(ST_XMax({geom})), MAX(ST_YMax({geom}))
+            FROM "{table}";
+        """).fetchone()
+        fingerprint = f"v{SPATIAL_ORDER_VERSION}|{geom}|{ROW_GROUP_SIZE}|{row[0]}:{row[1]}"
+        if (not force and fingerprint == _meta_get(con, f"{table}.spatial_order")
+                and all(c in lower for c in BBOX_COLUMNS)):
+            continue
+        order = ""
+        if row[2] is not None:
+            extent = f"ST_MakeBox2D(ST_Point({row[2]!r}, {row[3]!r}), ST_Point({row[4]!r}, {row[5]!r}))"
+            order = f"ORDER BY ST_Hilbert({geom}, {extent})"
+        keep = ", ".join(f'"{c}"' for c in columns if c.lower() not in BBOX_COLUMNS)
+        _drop_indexes(con, table)
+        con.execute(f"""
+            CREATE OR REPLACE TABLE "{table}" AS
+            SELECT {keep},
+                   ST_XMin({geom}) AS xmin, ST_YMin({geom}) AS ymin,
+                   ST_XMax({geom}) AS xmax, ST_YMax({geom}) AS ymax
+            FROM "{table}"
+            {order};
+        """)
+        _meta_set(con, f"{table}.spatial_order", fingerprint)
+        done.append(table)
+    return done
+
+
+def build_grid_cells(con: duckdb.DuckDBPyConnection, force: bool = False) -> list[str]:
+    """
+    Agrega los puntos de GRID_LAYERS en celdas cuadradas para cada zoom de GRID_ZOOMS
+    (tabla grid_cells: n, valores no nulos nv, suma, mínimo y máximo por celda; la media
+    es total / nv, igual que AVG en vivo). Se guarda dx para que la API compruebe que el
+    tamaño coincide con el suyo. Solo se recalcula si cambiaron los puntos. Devuelve las
+    capas rehechas.
+    """
+    if "grid_cells" in _tables(con) and "nv" not in _columns(con, "grid_cells"):
+        # esquema anterior sin nv: se rehace entera
+        con.execute("DROP TABLE grid_cells;")
+        force = True
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS grid_cells (
+          layer VARCHAR, z INTEGER, dx DOUBLE, dy DOUBLE, cx BIGINT, cy BIGINT,
+          n BIGINT, nv BIGINT, total DOUBLE, vmin DOUBLE, vmax DOUBLE
+        );
+    """)
+    done = []
+    present = _tables(con)
+    for table, (geom, value) in GRID_LAYERS.items():
+        if table not in present or geom not in [c.lower() for c in _columns(con, table)]:
+            continue
+        row = con.execute(f'SELECT COUNT(*), bit_xor(hash({geom}, {value or "NULL"})) FROM "{table}"').fetchone()
+        fingerprint = f"{GRID_CELL_PX}|{GRID_REF_LAT}|{list(GRID_ZOOMS)}|{row[0]}:{row[1]}"
+        if not force and fingerprint == _meta_get(con, f"grid_cells.{table}"):
+            continue
+        con.execute("DELETE FROM grid_cells WHERE layer = ?;", [table])
+        stats = (f"COUNT(*), COUNT({value}), SUM({value}), MIN({value}), MAX({value})" if value
+                 else "COUNT(*), 0, NULL, NULL, NULL")
+        for z in GRID_ZOOMS:
+            dx = 360.0 / (1 << z) * GRID_CELL_PX / 256
+            dy = dx * math.cos(math.radians(GRID_REF_LAT))
+            con.execute(f"""
+                INSERT INTO grid_cells
+                SELECT '{table}', {z}, {dx!r}, {dy!r},
+                       CAST(floor(ST_X({geom}) / {dx!r}) AS BIGINT) AS cx,
+                       CAST(floor(ST_Y({geom}) / {dy!r}) AS BIGINT) AS cy,
+                       {stats}
+                FROM "{table}"
+                WHERE {geom} IS NOT NULL
+                GROUP BY cx, cy;
+            """)
+        _meta_set(con, f"grid_cells.{table}", fingerprint)
+        done.append(table)
+    return done
+
+
+def build_all(con: duckdb.DuckDBPyConnection) -> None:
+    con.execute("LOAD spatial;")
+    # Primero las columnas y el reordenado (quitan los índices), luego ref_key/ref14 con
+    # sus índices ART y al final los índices espaciales
+    if build_building_lods(con):
+        print("✅ niveles de detalle de buildings recalculados")
+    for table in build_wgs84_copies(con):
+        print(f"✅ geom_4326 en {table}")
+    for table in build_spatial_order(con):
+        print(f"✅ {table} ordenada por curva de Hilbert, con bbox por fila")
+    for table in build_ref_keys(con):
+        print(f"✅ ref_key/ref14 en {table}")
+    for table in build_grid_cells(con):
+        print(f"✅ celdas de grid de {table}")
+    if build_cels_points(con):
+        print("✅ cels_points recalculada")
+    for name in build_rtree_indexes(con):
+        print(f"✅ índice RTREE {name}")
+
+
+if __name__ == "__main__":
+    from ingest import api_warehouse
+    con = connect(sys.argv[1] if len(sys.argv) > 1 else api_warehouse())
+    build_all(con)
+    con.close()
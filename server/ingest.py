@@ -0,0 +1,291 @@
+# ingest.py — carga del warehouse a partir de un manifiesto de fuentes (sustituye a los antiguos register*.py e init_db.py)
+#
+#   python ingest.py [ingest.json]                    # recarga todas las tablas del manifiesto
+#   python ingest.py ingest.json --only buildings     # solo esas; el resto se copia del warehouse actual
+#   python ingest.py ingest.json --fresh              # desde cero (sin copiar nada, ni la tabla points)
+#
+# El warehouse nuevo se construye en <warehouse>.building y sustituye al actual con un
+# rename atómico al terminar: la API sigue sirviendo el anterior mientras tanto y
+# recicla sus cursores al detectar el cambio (snapshot.py).
+#
+# El warehouse es el DUCKDB_PATH de la API (entorno o public_api/.env, relativo a
+# public_api/), resuelto igual que en public_api/app.py, así que se carga el fichero
+# que la API abre. Un "warehouse" en el manifiesto lo sustituye (p. ej. para pruebas).
+#
+# Manifiesto (rutas relativas al propio manifiesto):
+#   {
+#     "tables": {
+#       "buildings": {"format": "parquet", "path": "data/edificios.parquet", "geometry": "geometry"},
+#       "autoconsumos_CELS": {"format": "csv", "path": "data/cels.csv", "options": {"delim": ";"}},
+#       "address_index": {"format": "addresses", "path": "resources/map/emsv_calle_num_reference.json"}
+#     }
+#   }
+# Formatos: parquet (read_parquet, admite globs), csv (read_csv), gdal (ST_Read: GeoJSON,
+# Shapefile, GeoPackage...; opción "layer") y addresses (JSON calle -> número -> referencia).
+# "geometry" nombra la columna (WKB, WKT o GEOMETRY) que pasa a ser `geom`; "columns"
+# limita las columnas cargadas.
+import argparse, json, os, shutil, sys, time, unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+import pyarrow as pa
+from dotenv import load_dotenv
+
+from derived import build_all, connect
+
+MANIFEST = "ingest.json"
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "public_api")
+FORMATS = ("parquet", "csv", "gdal", "addresses")
+
+# Tabla de puntos guardados desde la API (POST /points): nunca viene de un fichero
+POINTS_DDL = """
+CREATE TABLE IF NOT EXISTS points (
+  id BIGINT,
+  created_at TIMESTAMP DEFAULT now(),
+  user_id VARCHAR,
+  geom GEOMETRY,
+  buffer_m DOUBLE DEFAULT 100.0,
+  props JSON
+);
+"""
+POINT_BUFFERS_VIEW = """
+CREATE OR REPLACE VIEW point_buffers AS
+SELECT id, user_id, created_at, buffer_m, ST_Buffer(geom, buffer_m / 111000.0)::GEOMETRY AS geom
+FROM points;
+"""
+
+_PREFIXES = ["CALLE ", "CL ", "C/ ", "AVENIDA ", "AV ", "AV.", "PASEO ", "PS ", "PLAZA ", "PZA "]
+
+
+def norm(s: str) -> str:
+    """Misma normalización de calles/números que /address/lookup."""
+    if s is None:
+        return ""
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    s = s.upper().strip()
+    for p in _PREFIXES:
+        if s.startswith(p):
+            s = s[len(p):]
+    return " ".join(s.split())
+
+
+def _lit(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _paths(spec: dict) -> str:
+    paths = spec["path"] if isinstance(spec["path"], list) else [spec["path"]]
+    return "[" + ", ".join(_lit(p) for p in paths) + "]"
+
+
+def _options(spec: dict) -> str:
+    opts = spec.get("options") or {}
+    return "".join(f", {k} = {_lit(v) if isinstance(v, str) else json.dumps(v)}" for k, v in opts.items())
+
+
+def api_warehouse() -> str:
+    """DUCKDB_PATH tal como lo resuelve la API (entorno o public_api/.env, relativo a public_api/)."""
+    load_dotenv(os.path.join(API_DIR, ".env"))
+    raw = os.getenv("DUCKDB_PATH", "warehouse.duckdb")
+    return os.path.normpath(raw if os.path.isabs(raw) else os.path.join(API_DIR, raw))
+
+
+def load_manifest(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    api = api_warehouse()
+    if manifest.get("warehouse"):
+        manifest["warehouse"] = os.path.normpath(os.path.join(base, manifest["warehouse"]))
+        if manifest["warehouse"] != api:
+            print(f"⚠️  el warehouse del manifiesto ({manifest['warehouse']}) no es el DUCKDB_PATH "
+                  f"de la API ({api}): la API no verá esta carga")
+    else:
+        manifest["warehouse"] = api
+    for name, spec in manifest.get("tables", {}).items():
+        if spec.get("format") not in FORMATS:
+            raise SystemExit(f"{name}: formato desconocido {spec.get('format')!r} (usa {', '.join(FORMATS)})")
+        paths = spec["path"] if isinstance(spec["path"], list) else [spec["path"]]
+        paths = [p if "://" in p else os.path.join(base, p) for p in paths]
+        spec["path"] = paths if isinstance(spec["path"], list) else paths[0]
+    return manifest
+
+
+def _source(con: duckdb.DuckDBPyConnection, spec: dict) -> str:
+    fmt = spec["format"]
+    if fmt == "parquet":
+        return f"read_parquet({_paths(spec)}{_options(spec)})"
+    if fmt == "csv":
+        return f"read_csv({_paths(spec)}{_options(spec)})"
+    layer = f", layer = {_lit(spec['layer'])}" if spec.get("layer") else ""
+    return f"ST_Read({_lit(spec['path'])}{layer}{_options(spec)})"
+
+
+def _geometry_expr(con: duckdb.DuckDBPyConnection, source: str, column: str) -> str:
+    """`column` como GEOMETRY según su tipo en la fuente (WKB, WKT o ya GEOMETRY)."""
+    types = {r[0]: r[1] for r in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()}
+    if column not in types:
+        raise SystemExit(f"la fuente no tiene la columna de geometría {column!r}")
+    col = _ident(column)
+    if types[column] == "BLOB":
+        return f"ST_GeomFromWKB({col})"
+    if types[column] == "VARCHAR":
+        return f"ST_GeomFromText({col})"
+    return f"CAST({col} AS GEOMETRY)"
+
+
+def _load_addresses(con: duckdb.DuckDBPyConnection, name: str, spec: dict) -> None:
+    with open(spec["path"], encoding="utf-8") as f:
+        data = json.load(f)
+    streets, numbers, refs = [], [], []
+    for street, nums in data.items():
+        s = norm(street)
+        for num, ref in (nums or {}).items():
+            streets.append(s)
+            numbers.append(norm(str(num)))
+            refs.append(str(ref))
+    rows = pa.table({"street_norm": streets, "number_norm": numbers, "reference": refs})
+    con.register("_addresses", rows)
+    try:
+        con.execute(f"CREATE TABLE {_ident(name)} AS SELECT * FROM _addresses;")
+    finally:
+        con.unregister("_addresses")
+
+
+def load_table(con: duckdb.DuckDBPyConnection, name: str, spec: dict) -> tuple[int, float]:
+    """Crea la tabla `name` desde su fuente en una sola sentencia. Devuelve (filas, segundos)."""
+    t0 = time.perf_counter()
+    con.execute("LOAD spatial;")
+    if spec["format"] == "addresses":
+        _load_addresses(con, name, spec)
+    else:
+        source = _source(con, spec)
+        geometry = spec.get("geometry") or ("geom" if spec["format"] == "gdal" else None)
+        if spec.get("columns"):
+            columns = ", ".join(_ident(c) for c in spec["columns"] if c != geometry)
+        else:
+            columns = f"* EXCLUDE ({_ident(geometry)})" if geometry else "*"
+        select = f"{_geometry_expr(con, source, geometry)} AS geom, {columns}" if geometry else columns
+        con.execute(f"CREATE TABLE {_ident(name)} AS SELECT {select} FROM {source};")
+    rows = con.execute(f"SELECT COUNT(*) FROM {_ident(name)}").fetchone()[0]
+    return rows, time.perf_counter() - t0
+
+
+def _cursor(con: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyConnection:
+    """Cursor sobre el warehouse en construcción (los cursores no heredan el USE de connect())."""
+    cur = con.cursor()
+    cur.execute("USE warehouse;")
+    return cur
+
+
+def _carry_over(con: duckdb.DuckDBPyConnection, current: str, skip: set[str]) -> list[str]:
+    """Copia del warehouse actual las tablas que no se recargan (points, derivadas, --only)."""
+    con.execute(f"ATTACH {_lit(current)} AS old (READ_ONLY);")
+    try:
+        names = [r[0] for r in con.execute(
+            "SELECT table_name FROM duckdb_tables() WHERE database_name = 'old' AND schema_name = 'main'"
+        ).fetchall()]
+        copied = []
+        for name in names:
+            if name in skip:
+                continue
+            con.execute(f"CREATE TABLE {_ident(name)} AS SELECT * FROM old.main.{_ident(name)};")
+            copied.append(name)
+        return copied
+    finally:
+        con.execute("DETACH old;")
+
+
+def _swap(building: str, target: str, backup: bool) -> None:
+    """Sustituye el warehouse de una vez; su WAL (si quedó alguno) no debe aplicarse al nuevo."""
+    wal = target + ".wal"
+    if backup and os.path.exists(target):
+        bak = target + ".bak"
+        for p in (bak, bak + ".wal"):
+            if os.path.exists(p):
+                os.remove(p)
+        try:
+            os.link(target, bak)
+        except OSError:
+            shutil.copy2(target, bak)
+        if os.path.exists(wal):
+            os.replace(wal, bak + ".wal")
+    elif os.path.exists(wal):
+        os.remove(wal)
+    os.replace(building, target)
+
+
+def ingest(manifest: dict, only: list[str] | None = None, fresh: bool = False,
+           jobs: int = 4, backup: bool = True) -> None:
+    target = manifest["warehouse"]
+    tables = {n: s for n, s in manifest.get("tables", {}).items() if not only or n in only}
+    if only:
+        missing = set(only) - set(tables)
+        if missing:
+            raise SystemExit(f"tablas fuera del manifiesto: {', '.join(sorted(missing))}")
+
+    building = target + ".building"
+    for p in (building, building + ".wal"):
+        if os.path.exists(p):
+            os.remove(p)
+    t0 = time.perf_counter()
+    con = connect(building)
+    try:
+        con.execute("INSTALL spatial; LOAD spatial;")
+        if not fresh and os.path.exists(target):
+            for name in _carry_over(con, target, set(tables)):
+                print(f"↪️  {name} copiada del warehouse actual")
+
+        # Tablas independientes en paralelo, cada una en su cursor (DuckDB además paraleliza cada lectura)
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(tables) or 1))) as pool:
+            futures = {name: pool.submit(load_table, _cursor(con), name, spec) for name, spec in tables.items()}
+            for name, future in futures.items():
+                rows, seconds = future.result()
+                print(f"✅ {name}: {rows:,} filas en {seconds:.1f}s")
+
+        con.execute(POINTS_DDL)
+        con.execute(POINT_BUFFERS_VIEW)
+        if con.execute("SELECT 1 FROM duckdb_tables() WHERE database_name = 'warehouse'"
+                       " AND table_name = 'address_index'").fetchone():
+            con.execute("CREATE INDEX IF NOT EXISTS idx_addr ON address_index(street_norm, number_norm);")
+
+        build_all(con)
+        con.execute("ANALYZE;")
+        con.execute("CHECKPOINT;")
+    except BaseException:
+        con.close()
+        for p in (building, building + ".wal"):
+            if os.path.exists(p):
+                os.remove(p)
+        raise
+    con.close()
+    _swap(building, target, backup)
+    print(f"✅ warehouse {target} listo en {time.perf_counter() - t0:.1f}s")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Construye el warehouse a partir de un manifiesto de fuentes")
+    ap.add_argument("manifest", nargs="?", default=MANIFEST)
+    ap.add_argument("--only", help="tablas a recargar, separadas por comas (el resto se conserva)")
+    ap.add_argument("--fresh", action="store_true", help="no copiar nada del warehouse actual")
+    ap.add_argument("--jobs", type=int, default=4, help="tablas cargadas a la vez")
+    ap.add_argument("--no-backup", action="store_true", help="no guardar el warehouse anterior en .bak")
+    args = ap.parse_args()
+
+    if args.fresh and args.only:
+        ap.error("--fresh y --only son incompatibles")
+    manifest = load_manifest(args.manifest)
+    only = [t.strip() for t in args.only.split(",")] if args.only else None
+    ingest(manifest, only=only, fresh=args.fresh, jobs=args.jobs, backup=not args.no_backup)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except duckdb.Error as e:
+        sys.exit(f"❌ {e}")
@@ -0,0 +1,123 @@
+# admission.py — per-endpoint-class concurrency caps, bounded wait queues and query deadlines
+from __future__ import annotations
+import asyncio, json, math, time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class EndpointClass:
+    """
+    - concurrency: requests of this class running at once
+    - queue: requests allowed to wait for a slot; beyond that → 429 straight away
+    - max_wait: seconds a queued request waits before giving up → 503
+    - deadline: seconds a running request may take; its DuckDB query is interrupted after
+    """
+    name: str
+    concurrency: int
+    queue: int
+    max_wait: float
+    deadline: float
+    running: int = 0
+    waiting: int = 0
+    admitted: int = 0
+    rejected_queue: int = 0
+    rejected_wait: int = 0
+    _sem: asyncio.Semaphore | None = field(default=None, repr=False)
+
+    @classmethod
+    def parse(cls, name: str, spec: str) -> "EndpointClass":
+        """'concurrency,queue,max_wait,deadline', e.g. '4,16,2,30'."""
+        c, qsize, wait, deadline = (v.strip() for v in spec.split(","))
+        return cls(name, max(1, int(c)), max(0, int(qsize)), float(wait), float(deadline))
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.max_wait))
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue": self.queue,
+            "running": self.running,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected_queue": self.rejected_queue,
+            "rejected_wait": self.rejected_wait,
+            "max_wait_s": self.max_wait,
+            "deadline_s": self.deadline,
+        }
+
+    async def acquire(self) -> int | None:
+        """None once admitted, else the status to answer with (429 / 503)."""
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concurrency)
+        if not self._sem.locked():
+            await self._sem.acquire()  # free slot: taken without suspending
+            self.running += 1
+            self.admitted += 1
+            return None
+        if self.waiting >= self.queue:
+            self.rejected_queue += 1
+            return 429
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected_wait += 1
+            return 503
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        self.admitted += 1
+        return None
+
+    def release(self) -> None:
+        self.running -= 1
+        self._sem.release()
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware holding a slot of the request's class for the whole
+    request, streamed body included. Paths map to classes by exact match or by a
+    prefix ending in "/"; unmapped paths are not limited. The admitted request's
+    deadline goes to scope["state"]["deadline"] (monotonic), where get_conn's
+    watcher enforces it with DuckDB's interrupt().
+    """
+
+    def __init__(self, app, classes: dict[str, EndpointClass], routes: dict[str, str]):
+        self.app = app
+        self.classes = classes
+        self.exact = {p: c for p, c in routes.items() if not p.endswith("/")}
+        self.prefixes = [(p, c) for p, c in routes.items() if p.endswith("/")]
+
+    def class_for(self, path: str) -> EndpointClass | None:
+        name = self.exact.get(path)
+        if name is None:
+            name = next((c for p, c in self.prefixes if path.startswith(p)), None)
+        return self.classes.get(name) if name else None
+
+    async def __call__(self, scope, receive, send):
+        limit = self.class_for(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = await limit.acquire()
+        if status is not None:
+            detail = ("Demasiadas peticiones en espera" if status == 429
+                      else "Servidor ocupado, inténtalo de nuevo")
+            body = json.dumps({"detail": detail}).encode()
+            await send({"type": "http.response.start", "status": status, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(limit.retry_after).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        state = dict(scope.get("state") or {}, deadline=time.monotonic() + limit.deadline)
+        try:
+            await self.app(dict(scope, state=state), receive, send)
+        finally:
+            limit.release()
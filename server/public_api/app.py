@@ -1,13 +1,28 @@
-# app.py — single FastAPI app, per-request DuckDB connections
+# app.py — single FastAPI app, pooled DuckDB cursors over one database per worker
 from __future__ import annotations
-import os, json, duckdb, unicodedata
-from typing import List, Tuple
+import os, re, json, math, time, base64, asyncio, duckdb, unicodedata
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
 
-from fastapi import FastAPI, HTTPException, Query, Depends, APIRouter
+from fastapi import FastAPI, HTTPException, Query, Depends, APIRouter, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+import grid, proximity, slowlog
+from admission import AdmissionMiddleware, EndpointClass
+from metrics import MetricsMiddleware, RequestMetrics, add_rows, gauges, phase
+from exports import PARQUET_CONTENT_TYPE, default_export_dir, latest_version, read_manifest
+from compress import CompressionMiddleware, scope_encoding
+from cache import CacheMiddleware, ConditionalMiddleware, ResultCache
+from pool import DuckDBPool, PoolTimeout
+from spatial import DERIVED_COLUMNS, envelope_filter, geojson_bounds, has_bbox_columns, table_columns as _table_columns
+from streaming import FORMATS, feature_json, feature_select, negotiate_format, props_struct, quote_ident, stream_features
+from snapshot import WarehouseSnapshot
+from tiles import TILE_LAYERS, MVT_CONTENT_TYPE, TileStore, default_store_path, render_tile, valid_tile
+
 # ============================================================
 # SETTINGS
 # ============================================================
@@ -23,9 +38,182 @@ def _resolve_db_path() -> str:
 
 DB_PATH = _resolve_db_path()
 READ_ONLY = os.getenv("READ_ONLY", "true").lower() in ("1", "true", "yes")
+# Radio de un CELS cuando su registro no trae uno propio (columna `radio`)
+CELS_DEFAULT_RADIUS_M = float(os.getenv("CELS_DEFAULT_RADIUS_M", "2000"))
+
+POOL = DuckDBPool(
+    DB_PATH,
+    read_only=READ_ONLY,
+    size=int(os.getenv("DUCKDB_POOL_SIZE", "8")),
+    timeout=float(os.getenv("DUCKDB_POOL_TIMEOUT", "5")),
+    max_uses=int(os.getenv("DUCKDB_POOL_MAX_USES", "10000")),
+    max_age=float(os.getenv("DUCKDB_POOL_MAX_AGE", "3600")),
+    health_check_after=float(os.getenv("DUCKDB_POOL_HEALTHCHECK", "30")),
+    threads=int(os.getenv("DUCKDB_THREADS", "4")),
+    drain_timeout=float(os.getenv("DUCKDB_POOL_DRAIN_TIMEOUT", "10")),
+)
 
-app = FastAPI(title=f"EMSV API ({'RO' if READ_ONLY else 'RW'})")
+SNAPSHOT = WarehouseSnapshot(DB_PATH)
+
+# Pre-rendered tiles (see seed_tiles.py); misses are rendered live and written back
+TILE_STORE_PATH = os.getenv("TILE_STORE_PATH") or default_store_path(DB_PATH)
+TILE_STORE_ENABLED = os.getenv("TILE_STORE", "true").lower() in ("1", "true", "yes")
+TILE_STORE_WRITEBACK = os.getenv("TILE_STORE_WRITEBACK", "true").lower() in ("1", "true", "yes")
+TILE_STORE: TileStore | None = None
+
+# GeoParquet snapshots written by export_snapshot.py, served as static files
+EXPORT_DIR = os.getenv("EXPORT_DIR") or default_export_dir(DB_PATH)
+
+# Slow-query log (off by default): queries over SLOW_QUERY_MS, plus a SLOW_QUERY_SAMPLE
+# fraction of all, are profiled with EXPLAIN ANALYZE into a rotating JSON-lines file
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+SLOW_QUERY_SAMPLE = float(os.getenv("SLOW_QUERY_SAMPLE", "0"))
+SLOW_QUERY_LOG_PATH = os.getenv("SLOW_QUERY_LOG") or os.path.splitext(DB_PATH)[0] + ".slow_queries.jsonl"
+SLOW_QUERY_LOG: slowlog.SlowQueryLog | None = None
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global TILE_STORE, SLOW_QUERY_LOG
+    POOL.open()
+    if TILE_STORE_ENABLED:
+        TILE_STORE = TileStore(TILE_STORE_PATH, SNAPSHOT.version)
+    if SLOW_QUERY_MS > 0 or SLOW_QUERY_SAMPLE > 0:
+        SLOW_QUERY_LOG = slowlog.SlowQueryLog(
+            POOL,
+            SLOW_QUERY_LOG_PATH,
+            threshold_ms=SLOW_QUERY_MS,
+            sample=SLOW_QUERY_SAMPLE,
+            max_bytes=int(float(os.getenv("SLOW_QUERY_LOG_MB", "10")) * 1024 * 1024),
+            cooldown=float(os.getenv("SLOW_QUERY_COOLDOWN", "60")),
+        )
+        slowlog.install(SLOW_QUERY_LOG)
+    try:
+        yield
+    finally:
+        if SLOW_QUERY_LOG is not None:
+            slowlog.install(None)
+            SLOW_QUERY_LOG.close()
+            SLOW_QUERY_LOG = None
+        if TILE_STORE is not None:
+            TILE_STORE.close()
+            TILE_STORE = None
+        POOL.close()
+
+app = FastAPI(title=f"EMSV API ({'RO' if READ_ONLY else 'RW'})", lifespan=lifespan)
 api = APIRouter(prefix="/api_2") 
+
+# Middleware, innermost first: compression < admission < result cache < ETag < metrics < CORS.
+# Compressing below the cache means hits replay stored compressed bytes without
+# recompressing; cache hits and 304s never take an admission slot.
+COMPRESSION = os.getenv("COMPRESSION", "true").lower() in ("1", "true", "yes")
+if COMPRESSION:
+    app.add_middleware(CompressionMiddleware, exclude=("/exports/",))
+vary = scope_encoding if COMPRESSION else None
+
+# Endpoint classes: "concurrency,queue,max_wait_s,deadline_s". Heavy layer/zonal
+# traffic can hold at most its own slots (and pool cursors), so lookups stay fast.
+ENDPOINT_CLASSES = {
+    name: EndpointClass.parse(name, os.getenv(f"ADMISSION_{name.upper()}", default))
+    for name, default in (("lookup", "8,32,1,5"), ("layer", "4,16,2,30"), ("zonal", "2,8,2,20"))
+}
+ENDPOINT_ROUTES = {
+    "/address/lookup": "lookup",
+    "/buildings/metrics": "lookup",
+    "/buildings/by_ref": "lookup",
+    "/cadastre/feature": "lookup",
+    "/points/count": "lookup",
+    "/buffers": "layer",
+    "/points/features": "layer",
+    "/points/grid": "layer",
+    "/shadows/features": "layer",
+    "/irradiance/features": "layer",
+    "/irradiance/grid": "layer",
+    "/buildings/features": "layer",
+    "/buildings/irradiance": "layer",
+    "/cels/features": "layer",
+    "/tiles/": "layer",
+    "/shadows/zonal": "zonal",
+    "/irradiance/zonal": "zonal",
+    "/cels/within": "zonal",
+    "/cels/within_dynamic": "zonal",
+    "/cels/nearest": "zonal",
+}
+app.add_middleware(AdmissionMiddleware, classes=ENDPOINT_CLASSES, routes=ENDPOINT_ROUTES)
+
+# Response cache for the read-only layer/zonal endpoints. True = bbox is snapped to
+# RESULT_CACHE_GRID degrees so nearby viewports share entries (not for counts).
+CACHED_PATHS = {
+    "/buffers": True,
+    "/points/count": False,
+    "/points/features": True,
+    "/shadows/features": True,
+    "/shadows/zonal": False,
+    "/irradiance/features": True,
+    "/irradiance/zonal": False,
+    "/buildings/features": True,
+    "/buildings/irradiance": True,
+    "/cels/features": True,
+    "/cels/within": False,
+    "/cels/within_dynamic": False,
+    "/cels/nearest": False,
+    "/irradiance/grid": True,
+    "/points/grid": True,
+}
+RESULT_CACHE_MB = float(os.getenv("RESULT_CACHE_MB", "256"))
+RESULT_CACHE: ResultCache | None = None
+if READ_ONLY and RESULT_CACHE_MB > 0:
+    RESULT_CACHE = ResultCache(
+        max_bytes=int(RESULT_CACHE_MB * 1024 * 1024),
+        ttl=float(os.getenv("RESULT_CACHE_TTL", "3600")),
+        version=SNAPSHOT.version,
+    )
+    # below the ETag check and CORS, so cached bodies never carry CORS headers
+    app.add_middleware(
+        CacheMiddleware,
+        cache=RESULT_CACHE,
+        paths=CACHED_PATHS,
+        grid=float(os.getenv("RESULT_CACHE_GRID", "0.002")),
+        variant=vary,
+    )
+
+# ETag = warehouse version + request hash, so If-None-Match is answered before any query.
+# Read-only deployments only change on reload, so clients may reuse responses for
+# HTTP_CACHE_MAX_AGE seconds; a read-write API makes them revalidate every time.
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "3600"))
+app.add_middleware(
+    ConditionalMiddleware,
+    version=SNAPSHOT.version,
+    cache_control=(f"public, max-age={HTTP_CACHE_MAX_AGE}" if READ_ONLY and HTTP_CACHE_MAX_AGE > 0
+                   else "public, no-cache"),
+    # export files are versioned by path and validated by FileResponse itself; the
+    # /exports manifest changes with export_snapshot.py runs, not with the warehouse
+    exclude=("/debug", "/docs", "/redoc", "/openapi.json", "/exports", "/metrics"),
+    variant=vary,
+    vary="Accept-Encoding" if COMPRESSION else None,
+)
+
+# Per-endpoint latency by phase, rows and bytes; outside the cache and ETag check so
+# hits and 304s are measured too. Served in Prometheus text format at /metrics.
+METRICS_ENABLED = os.getenv("METRICS", "true").lower() in ("1", "true", "yes")
+REQUEST_METRICS = RequestMetrics()
+
+@lru_cache(maxsize=4096)
+def endpoint_label(path: str) -> str:
+    """Route template of `path` (e.g. /tiles/{layer}/{z}/{x}/{y}.mvt), so labels stay bounded."""
+    for route in app.router.routes:
+        regex = getattr(route, "path_regex", None)
+        if regex is not None and regex.match(path):
+            return route.path
+    return "other"
+
+if METRICS_ENABLED:
+    app.add_middleware(
+        MetricsMiddleware,
+        metrics=REQUEST_METRICS,
+        label=endpoint_label,
+        exclude=("/metrics", "/docs", "/redoc", "/openapi.json"),
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,70 +222,320 @@ app.add_middleware(
 )
 
 # ============================================================
-# DATABASE CONNECTION HANDLING (per request)
+# DATABASE CONNECTION HANDLING (pooled cursors)
 # ============================================================
 
-def get_conn():
-    """Open a new DuckDB connection per request (safe for concurrency/workers)."""
-    con = duckdb.connect(DB_PATH, read_only=READ_ONLY)
-    # Spatial extension should already be installed once in your DB; LOAD is cheap.
-    con.execute("LOAD spatial;")
-    # Tweak concurrency a bit; ignore if not supported
+# How often a request holding a cursor checks whether its client is still there
+DISCONNECT_POLL = float(os.getenv("DISCONNECT_POLL", "0.25"))
+
+def _checkout() -> duckdb.DuckDBPyConnection:
+    """Check out a cursor from the worker's pool; the database stays open between requests."""
+    # Read-write, our own writes change the fingerprint (WAL): reopen only for a new file
+    POOL.ensure_version(SNAPSHOT.version() if READ_ONLY else SNAPSHOT.identity())
     try:
-        con.execute("PRAGMA threads=4;")
-    except duckdb.Error:
-        pass
+        with phase("connect"):
+            return POOL.acquire()
+    except PoolTimeout as e:
+        raise HTTPException(503, f"Servidor ocupado: {e}", headers={"Retry-After": "1"}) from e
+
+def _discard_after(e: BaseException) -> bool:
+    """Whether a cursor that raised `e` is closed instead of going back to the pool."""
+    if isinstance(e, duckdb.InterruptException):
+        return False  # an interrupted cursor is reusable
+    if isinstance(e, duckdb.Error):
+        return True
+    # q() wraps DuckDB errors as 500s; don't hand that cursor to the next request
+    return isinstance(e, HTTPException) and e.status_code >= 500
+
+async def _watch(request: Request, con: duckdb.DuckDBPyConnection) -> None:
+    """Interrupt the cursor's query when the client leaves or the request's deadline passes."""
+    deadline = request.scope.get("state", {}).get("deadline")
+    while not await request.is_disconnected():
+        if deadline is not None and time.monotonic() >= deadline:
+            request.state.timed_out = True
+            break
+        await asyncio.sleep(DISCONNECT_POLL)
+    # Harmless if the query already finished: DuckDB clears the flag on the next query
+    con.interrupt()
+
+@asynccontextmanager
+async def request_conn(request: Request):
+    """
+    Request-bound cursor. While the request runs (and its response streams), a task
+    watches the client and interrupts the cursor's query as soon as it disconnects,
+    e.g. when the map aborts a superseded request while panning, or when the deadline
+    set by AdmissionMiddleware for the endpoint's class runs out.
+    """
+    con = await run_in_threadpool(_checkout)
+    slowlog.request_info.set(f"{request.url.path}?{request.url.query}" if request.url.query else request.url.path)
+    watcher = asyncio.create_task(_watch(request, con))
+    discard = False
     try:
-        con.execute("SET lock_timeout='5s';")
-    except duckdb.Error:
-        pass
+        yield con
+    except HTTPException as e:
+        discard = _discard_after(e)
+        if e.status_code == 499 and getattr(request.state, "timed_out", False):
+            raise HTTPException(504, "La consulta superó su tiempo máximo") from e
+        raise
+    except BaseException as e:
+        discard = _discard_after(e)
+        raise
+    finally:
+        watcher.cancel()
+        POOL.release(con, discard=discard)
+
+async def get_conn(request: Request):
+    """request_conn as a dependency (held until the response has been sent)."""
+    async with request_conn(request) as con:
+        yield con
+
+def get_write_conn():
+    """Cursor for writes: not interrupted on disconnect, so a saved point is not lost."""
+    with conn_scope() as con:
+        yield con
+
+@contextmanager
+def conn_scope():
+    """Cursor for code outside the request dependency (no disconnect watching)."""
+    con = _checkout()
+    discard = False
     try:
         yield con
+    except BaseException as e:
+        discard = _discard_after(e)
+        raise
     finally:
-        con.close()
+        POOL.release(con, discard=discard)
 
 def q(con: duckdb.DuckDBPyConnection, sql: str, params: list | tuple = ()):
-    """Query helper that returns [] on empty and wraps errors."""
+    """Query helper that returns [] on empty and wraps errors; slow queries go to the slow-query log."""
+    t0 = time.perf_counter()
     try:
-        return con.execute(sql, params).fetchall() or []
+        with phase("query"):
+            cur = con.execute(sql, params)
+        with phase("fetch"):
+            rows = cur.fetchall() or []
+    except duckdb.InterruptException as e:
+        raise HTTPException(499, "Petición cancelada por el cliente") from e
     except duckdb.Error as e:
         raise HTTPException(500, f"DuckDB error: {e}") from e
+    slowlog.observe(sql, params, time.perf_counter() - t0)
+    add_rows(len(rows))
+    return rows
 
 # ============================================================
 # HELPERS
 # ============================================================
 
-def parse_bbox(bbox: str | None) -> tuple[str, list]:
-    if not bbox:
-        return "", []
+def _bbox_parts(bbox: str) -> list[float]:
     parts = bbox.split(",")
     if len(parts) != 4:
         raise HTTPException(400, "bbox debe ser 'minx,miny,maxx,maxy'")
-    minx, miny, maxx, maxy = map(float, parts)
-    return "WHERE ST_Intersects(geom, ST_MakeEnvelope(?, ?, ?, ?))", [minx, miny, maxx, maxy]
+    try:
+        vals = [float(p) for p in parts]
+    except ValueError:
+        raise HTTPException(400, "bbox debe contener 4 números")
+    if not all(math.isfinite(v) for v in vals):
+        raise HTTPException(400, "bbox debe contener 4 números finitos")
+    return vals
+
+def parse_bbox(bbox: str | None, geom: str = "geom", bbox_columns: bool = False) -> tuple[str, list]:
+    if not bbox:
+        return "", []
+    where, params = envelope_filter(*_bbox_parts(bbox), geom=geom, bbox_columns=bbox_columns)
+    return f"WHERE {where}", params
 
 def parse_bbox_for_srid(bbox: str | None, target_srid: int) -> tuple[str, list]:
     if not bbox:
         return "", []
-    parts = bbox.split(",")
-    if len(parts) != 4:
-        raise HTTPException(400, "bbox debe ser 'minx,miny,maxx,maxy'")
-    minx, miny, maxx, maxy = map(float, parts)
-    where = (
-        "WHERE ST_Intersects("
-        "  geom,"
-        "  ST_Transform("
-        "    ST_MakeEnvelope(?, ?, ?, ?),"
-        "    'EPSG:4326',"
-        f"    'EPSG:{target_srid}',"
-        "    TRUE"
-        "  )"
-        ")"
-    )
-    return where, [minx, miny, maxx, maxy]
+    where, params = envelope_filter(*_bbox_parts(bbox), srid=target_srid)
+    return f"WHERE {where}", params
 
-def fc(features: list[dict]) -> dict:
-    return {"type": "FeatureCollection", "features": features}
+def encode_cursor(key: int) -> str:
+    """Opaque page token: last key seen + warehouse version it belongs to."""
+    raw = json.dumps([SNAPSHOT.version(), key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+def decode_cursor(cursor: str | None) -> int | None:
+    if not cursor:
+        return None
+    try:
+        version, key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        key = int(key)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "cursor no válido")
+    if version != SNAPSHOT.version():
+        # rowids are only stable within one warehouse build
+        raise HTTPException(409, "cursor caducado: los datos han cambiado, vuelve a la primera página")
+    return key
+
+def after_cursor(where: str, key: str, cursor: str | None) -> str:
+    """Add the keyset condition `key > last` (inlined so row groups before it are skipped)."""
+    last = decode_cursor(cursor)
+    if last is None:
+        return where
+    return f"{where} AND {key} > {last}" if where else f"WHERE {key} > {last}"
+
+def zone_prefilter(geometry: dict, geom: str, srid: int = 4326, bbox_columns: bool = False) -> str:
+    """
+    Bbox predicate of a zonal geometry, ANDed before the exact ST_Intersects so
+    the RTREE index narrows the candidates ("" if the geometry has no coordinates).
+    """
+    bounds = geojson_bounds(geometry)
+    if bounds is None:
+        return ""
+    eps = 1e-9  # points/lines have a zero-area bbox
+    minx, miny, maxx, maxy = bounds
+    try:
+        where, _ = envelope_filter(minx - eps, miny - eps, maxx + eps, maxy + eps, geom=geom, srid=srid,
+                                   bbox_columns=bbox_columns)
+    except ValueError:
+        raise HTTPException(400, "Geometría con coordenadas no válidas")
+    return f"{where} AND "
+
+# Building footprints by map zoom: (from zoom, geometry column, min footprint m²).
+# ~120 km / 2^z per pixel here, so below z17 the full outline is sub-pixel detail and
+# below z15 buildings under ~40 m² are a pixel or less. No zoom = full detail.
+BUILDING_LOD = ((17, "geom", 0.0), (15, "geom_lod1", 4.0), (0, "geom_lod2", 40.0))
+
+def building_lod(con: duckdb.DuckDBPyConnection, zoom: int | None, alias: str = "") -> tuple[str, str]:
+    """
+    Geometry column and size predicate ("" or "footprint_m2 >= n") for `zoom`.
+    Falls back to full detail if derived.build_building_lods has not run on this warehouse.
+    """
+    if zoom is None:
+        return f"{alias}geom", ""
+    column, min_m2 = next((c, m) for z, c, m in BUILDING_LOD if zoom >= z)
+    if column == "geom" or column not in table_columns(con, "buildings"):
+        return f"{alias}geom", ""
+    return f"{alias}{column}", f"{alias}footprint_m2 >= {min_m2!r}"
+
+def irr_geom_4326(con: duckdb.DuckDBPyConnection) -> bool:
+    """True if irr_points carries the WGS84 copy from derived.build_wgs84_copies."""
+    return "geom_4326" in table_columns(con, "irr_points")
+
+def and_where(where: str, cond: str) -> str:
+    if not cond:
+        return where
+    return f"{where} AND {cond}" if where else f"WHERE {cond}"
+
+_REF_RE = re.compile(r"[0-9A-Z]{1,32}")
+
+def ref_key_literal(ref: str, not_found: str) -> str:
+    """
+    Canonical cadastral key (same rule as derived.ref_key) as an SQL literal.
+    Validated to [0-9A-Z] and inlined so `ref_key = '...'` is answered from the ART index.
+    """
+    key = ref.strip().upper()
+    if not _REF_RE.fullmatch(key):
+        raise HTTPException(404, not_found)
+    return f"'{key}'"
+
+# (warehouse version, table) -> columns; entries of older versions are dropped in bulk
+_SCHEMA: dict[tuple[str, str], tuple[str, ...]] = {}
+
+def table_columns(con: duckdb.DuckDBPyConnection, table: str) -> tuple[str, ...]:
+    """
+    Columns of `table`, looked up once per warehouse version. Runs outside q(): catalog
+    lookups are not the request's query for the metrics or the slow-query log.
+    """
+    key = (SNAPSHOT.version(), table)
+    columns = _SCHEMA.get(key)
+    if columns is None:
+        if len(_SCHEMA) > 256:
+            _SCHEMA.clear()
+        columns = _SCHEMA[key] = _table_columns(con, table)
+    return columns
+
+def has_bbox(con: duckdb.DuckDBPyConnection, table: str) -> bool:
+    """True if derived.build_spatial_order gave `table` its per-row bbox columns."""
+    return has_bbox_columns(table_columns(con, table))
+
+def property_columns(con: duckdb.DuckDBPyConnection, table: str, exclude: tuple[str, ...] = DERIVED_COLUMNS) -> list[str]:
+    """Columns of `table` in declaration order, minus the geometry and derived keys."""
+    skip = {c.lower() for c in exclude}
+    return [c for c in table_columns(con, table) if c.lower() not in skip]
+
+def select_fields(con: duckdb.DuckDBPyConnection, table: str, fields: str | None) -> list[str]:
+    """Property columns of `table`, or only those named in the comma-separated `fields`."""
+    available = property_columns(con, table)
+    if fields is None:
+        return available
+    by_name = {c.lower(): c for c in available}
+    wanted = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in wanted if f.lower() not in by_name]
+    if unknown:
+        raise HTTPException(400, f"Campos desconocidos: {', '.join(unknown)}")
+    return list(dict.fromkeys(by_name[f.lower()] for f in wanted))
+
+def column_list(columns: list[str]) -> str:
+    """Quoted select list with a trailing comma ("" for no columns)."""
+    return "".join(f"{quote_ident(c)}, " for c in columns)
+
+def output_format(
+    request: Request,
+    fmt: str | None = Query(None, alias="format", description=f"{' | '.join(FORMATS)} (por defecto según Accept)"),
+) -> str:
+    """Explicit ?format= wins; otherwise negotiated from the Accept header."""
+    return fmt or negotiate_format(request.headers.get("accept"))
+
+def grid_features(
+    con: duckdb.DuckDBPyConnection,
+    layer: str,
+    bbox: str,
+    zoom: int,
+    shape: str,
+    fmt: str,
+    value: str | None = None,
+    point: str = "geom",
+    filter_geom: str = "geom",
+    filter_srid: int = 4326,
+    precomputed: bool = True,
+):
+    """
+    Cells of `layer` over a bbox at `zoom` as polygon features with count/mean/min/max.
+    Square cells come from grid_cells when derived.py precomputed that zoom (unless
+    `precomputed` is off); otherwise the points are binned live. `point` is the WGS84
+    point expression, `filter_geom`/`filter_srid` the indexed column for the bbox.
+    """
+    dx, dy = grid.cell_size(zoom)
+    cells = grid.snap_bounds(_bbox_parts(bbox), dx, dy)
+    if (cells[2] - cells[0] + 1) * (cells[3] - cells[1] + 1) > grid.MAX_CELLS:
+        raise HTTPException(400, "bbox demasiado grande para este zoom")
+
+    square = shape == "square"
+    if square and precomputed and grid.has_level(con, layer, zoom, dx):
+        cells_sql = grid.precomputed_cells_sql(layer, zoom, cells)
+    else:
+        # bbox grown to whole cells. Hexagons straddle the squares: those centred up to a
+        # cell beyond it are returned (so the bbox is covered) and their points are read
+        # from one more cell out, farther than any hexagon reaches from its centre
+        pad = 0 if square else 2
+        where, _ = envelope_filter(
+            (cells[0] - pad) * dx, (cells[1] - pad) * dy, (cells[2] + 1 + pad) * dx, (cells[3] + 1 + pad) * dy,
+            geom=filter_geom, srid=filter_srid, bbox_columns=has_bbox(con, layer),
+        )
+        v = f", {value} AS v" if value else ""
+        points = f"SELECT ST_X({point}) AS x, ST_Y({point}) AS y{v} FROM {layer} WHERE {where}"
+        if square:
+            cells_sql = grid.square_cells_sql(points, "v" if value else None, dx, dy)
+        else:
+            centres = ((cells[0] - 1) * dx, (cells[1] - 1) * dy, (cells[2] + 2) * dx, (cells[3] + 2) * dy)
+            cells_sql = grid.hex_cells_sql(points, "v" if value else None, dx, dy, centres)
+
+    geom = grid.square_geom(dx, dy) if square else grid.hex_geom(dx, dy)
+    props = "{'count': n, 'mean': mean, 'min': vmin, 'max': vmax}"
+    return stream_features(con, f"""
+        WITH cells AS ({cells_sql})
+        SELECT {feature_select(fmt, geom, props)}
+        FROM cells
+        ORDER BY cy, cx;
+    """, [], fmt)
+
+SHAPE_QUERY = Query("square", pattern="^(square|hex)$", description="Forma de las celdas")
+
+FIELDS_QUERY = Query(None, description="Propiedades a devolver, separadas por comas (vacío = ninguna)")
+PRECISION_QUERY = Query(None, ge=0, le=15, description="Decimales de las coordenadas")
 
 # ============================================================
 # MODELS
@@ -119,46 +557,28 @@ class CelsWithinReq(BaseModel):
 # BUFFERS
 # ============================================================
 
-def _select_buffers(con: duckdb.DuckDBPyConnection, where_sql: str, params: list) -> List[Tuple]:
-    sql = f"""
-        WITH f AS (
-          SELECT id, user_id, buffer_m, geom
-          FROM point_buffers
-          {where_sql}
-        )
-        SELECT id, user_id, buffer_m, ST_AsGeoJSON(geom) AS geom_json
-        FROM f;
-    """
-    return q(con, sql, params)
-
 @app.get("/buffers")
 def get_buffers(
     bbox: str | None = None,
     limit: int = 1000,
     offset: int = 0,
+    cursor: str | None = Query(None, description="next_cursor de la página anterior"),
+    fmt: str = Depends(output_format),
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
-    where_sql = ""
-    params: list = []
-    if bbox:
-        w, p = parse_bbox(bbox)
-        where_sql = f"{w} LIMIT ? OFFSET ?"
-        params = p + [limit, offset]
-    else:
-        where_sql = "LIMIT ? OFFSET ?"
-        params = [limit, offset]
-
-    rows = _select_buffers(con, where_sql, params)
-    features = [{
-        "type": "Feature",
-        "geometry": json.loads(gjson) if isinstance(gjson, str) else gjson,
-        "properties": {
-            "id": rid,
-            "user_id": ruser,
-            "buffer_m": float(rbuf) if rbuf is not None else None
-        }
-    } for rid, ruser, rbuf, gjson in rows]
-    return fc(features)
+    where, params = parse_bbox(bbox)
+    where = after_cursor(where, "id", cursor)
+    props = "{'id': id, 'user_id': user_id, 'buffer_m': CAST(buffer_m AS DOUBLE)}"
+    return stream_features(con, f"""
+        WITH f AS (
+          SELECT id, user_id, buffer_m, geom
+          FROM point_buffers
+          {where}
+          ORDER BY id
+          LIMIT ? OFFSET ?
+        )
+        SELECT {feature_select(fmt, "geom", props)}, id AS _k FROM f ORDER BY _k;
+    """, params + [limit, offset], fmt, limit, encode_cursor)
 
 # ============================================================
 # POINTS
@@ -167,7 +587,7 @@ def get_buffers(
 @app.post("/points")
 def save_point(
     req: SavePointReq,
-    con: duckdb.DuckDBPyConnection = Depends(get_conn),
+    con: duckdb.DuckDBPyConnection = Depends(get_write_conn),
 ):
     if READ_ONLY:
         raise HTTPException(403, "Esta API está en modo read-only")
@@ -192,7 +612,7 @@ def points_count(
     bbox: str | None = None,
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
-    where, params = parse_bbox(bbox)
+    where, params = parse_bbox(bbox, bbox_columns=has_bbox(con, "big_points"))
     cnt = q(con, f"SELECT COUNT(*) FROM big_points {where};", params)[0][0]
     return {"count": int(cnt)}
 
@@ -201,24 +621,43 @@ def points_features(
     bbox: str | None = Query(None),
     limit: int = 2000,
     offset: int = 0,
+    cursor: str | None = Query(None, description="next_cursor de la página anterior"),
+    fmt: str = Depends(output_format),
+    fields: str | None = FIELDS_QUERY,
+    precision: int | None = PRECISION_QUERY,
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
-    where, params = parse_bbox(bbox)
-    rows = q(con, f"""
+    where, params = parse_bbox(bbox, bbox_columns=has_bbox(con, "big_points"))
+    where = after_cursor(where, "rowid", cursor)
+    columns = select_fields(con, "big_points", fields)
+    return stream_features(con, f"""
         WITH f AS (
-          SELECT geom, * EXCLUDE (geom)
+          SELECT {column_list(columns)}geom, rowid AS _k
           FROM big_points
           {where}
+          ORDER BY _k
           LIMIT ? OFFSET ?
         )
-        SELECT ST_AsGeoJSON(geom), to_json(f) FROM f;
-    """, params + [limit, offset])
-
-    feats = [
-        {"type": "Feature", "geometry": json.loads(g), "properties": json.loads(p) if isinstance(p, str) else {}}
-        for g, p in rows
-    ]
-    return fc(feats)
+        SELECT {feature_select(fmt, "geom", props_struct(columns), precision)}, _k FROM f ORDER BY _k;
+    """, params + [limit, offset], fmt, limit, encode_cursor)
+
+@app.get("/points/grid")
+def points_grid(
+    bbox: str = Query(..., description="minx,miny,maxx,maxy (WGS84)"),
+    zoom: int = Query(..., ge=0, le=22),
+    shape: str = SHAPE_QUERY,
+    field: str | None = Query(None, description="Columna numérica para mean/min/max"),
+    fmt: str = Depends(output_format),
+    con: duckdb.DuckDBPyConnection = Depends(get_conn),
+):
+    value = None
+    if field:
+        columns = select_fields(con, "big_points", field)
+        if len(columns) != 1:
+            raise HTTPException(400, "field debe ser una sola columna")
+        value = f"TRY_CAST({quote_ident(columns[0])} AS DOUBLE)"
+    # precomputed cells only carry counts for big_points
+    return grid_features(con, "big_points", bbox, zoom, shape, fmt, value=value, precomputed=value is None)
 
 # ============================================================
 # SHADOWS
@@ -229,35 +668,35 @@ def shadows_features(
     bbox: str | None = Query(None),
     limit: int = 5000,
     offset: int = 0,
+    cursor: str | None = Query(None, description="next_cursor de la página anterior"),
+    fmt: str = Depends(output_format),
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
-    where, params = parse_bbox(bbox)
-    rows = q(con, f"""
+    where, params = parse_bbox(bbox, bbox_columns=has_bbox(con, "shadows"))
+    where = after_cursor(where, "rowid", cursor)
+    props = "{'shadow_count': CAST(shadow_count AS DOUBLE)}"
+    return stream_features(con, f"""
         WITH f AS (
-          SELECT geom, shadow_count
+          SELECT geom, shadow_count, rowid AS _k
           FROM shadows
           {where}
+          ORDER BY _k
           LIMIT ? OFFSET ?
         )
-        SELECT ST_AsGeoJSON(geom), shadow_count FROM f;
-    """, params + [limit, offset])
-
-    feats = [
-        {"type": "Feature", "geometry": json.loads(g), "properties": {"shadow_count": float(s) if s is not None else None}}
-        for g, s in rows
-    ]
-    return fc(feats)
+        SELECT {feature_select(fmt, "geom", props)}, _k FROM f ORDER BY _k;
+    """, params + [limit, offset], fmt, limit, encode_cursor)
 
 @app.post("/shadows/zonal")
 def shadows_zonal(req: ZonalReq, con: duckdb.DuckDBPyConnection = Depends(get_conn)):
     geojson = json.dumps(req.geometry)
-    rows = q(con, """
+    pre = zone_prefilter(req.geometry, "s.geom", bbox_columns=has_bbox(con, "shadows"))
+    rows = q(con, f"""
         WITH zone_raw AS (SELECT ST_GeomFromGeoJSON(?::VARCHAR) AS g),
         zone AS (
           SELECT CASE WHEN ST_IsValid(g) THEN g ELSE ST_Buffer(g, 0) END AS g FROM zone_raw
         ),
         hits AS (
-          SELECT s.shadow_count FROM shadows s, zone z WHERE ST_Intersects(s.geom, z.g)
+          SELECT s.shadow_count FROM shadows s, zone z WHERE {pre}ST_Intersects(s.geom, z.g)
         )
         SELECT COALESCE(COUNT(*),0), AVG(shadow_count), MIN(shadow_count), MAX(shadow_count) FROM hits;
     """, [geojson])
@@ -276,35 +715,56 @@ def shadows_zonal(req: ZonalReq, con: duckdb.DuckDBPyConnection = Depends(get_co
 @app.get("/irradiance/features")
 def irradiance_features(
     bbox: str | None = Query(None),
+    fmt: str = Depends(output_format),
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
-    where, params = parse_bbox_for_srid(bbox, 25830)
-    rows = q(con, f"""
-        SELECT ST_AsGeoJSON(ST_Transform(geom, 'EPSG:25830','EPSG:4326', TRUE)), value
+    if irr_geom_4326(con):
+        where, params = parse_bbox(bbox, geom="geom_4326", bbox_columns=has_bbox(con, "irr_points"))
+        geom = "geom_4326"
+    else:
+        where, params = parse_bbox_for_srid(bbox, 25830)
+        geom = "ST_Transform(geom, 'EPSG:25830','EPSG:4326', TRUE)"
+    props = "{'value': CAST(value AS DOUBLE)}"
+    return stream_features(con, f"""
+        SELECT {feature_select(fmt, geom, props)}
         FROM irr_points
         {where};
-    """, params)
-    feats = [
-        {"type": "Feature", "geometry": json.loads(g), "properties": {"value": float(v) if v is not None else None}}
-        for g, v in rows
-    ]
-    return fc(feats)
+    """, params, fmt)
+
+@app.get("/irradiance/grid")
+def irradiance_grid(
+    bbox: str = Query(..., description="minx,miny,maxx,maxy (WGS84)"),
+    zoom: int = Query(..., ge=0, le=22),
+    shape: str = SHAPE_QUERY,
+    fmt: str = Depends(output_format),
+    con: duckdb.DuckDBPyConnection = Depends(get_conn),
+):
+    value = "CAST(value AS DOUBLE)"
+    if irr_geom_4326(con):
+        return grid_features(con, "irr_points", bbox, zoom, shape, fmt, value=value,
+                             point="geom_4326", filter_geom="geom_4326")
+    return grid_features(con, "irr_points", bbox, zoom, shape, fmt, value=value,
+                         point="ST_Transform(geom, 'EPSG:25830', 'EPSG:4326', TRUE)", filter_srid=25830)
 
 @app.post("/irradiance/zonal")
 def irradiance_zonal(req: ZonalReq, con: duckdb.DuckDBPyConnection = Depends(get_conn)):
     geojson = json.dumps(req.geometry)
-    rows = q(con, """
+    # points are matched in WGS84 when the copy exists, else the zone goes to 25830
+    if irr_geom_4326(con):
+        pre = zone_prefilter(req.geometry, "p.geom_4326", bbox_columns=has_bbox(con, "irr_points"))
+        col, zone = "p.geom_4326", "ST_GeomFromGeoJSON(?::VARCHAR)"
+    else:
+        pre = zone_prefilter(req.geometry, "p.geom", srid=25830)
+        col, zone = "p.geom", "ST_Transform(ST_GeomFromGeoJSON(?::VARCHAR), 'EPSG:4326','EPSG:25830', TRUE)"
+    rows = q(con, f"""
         WITH zone AS (
-          SELECT ST_Transform(
-            ST_GeomFromGeoJSON(?::VARCHAR),
-            'EPSG:4326','EPSG:25830', TRUE
-          ) AS g
+          SELECT {zone} AS g
         ),
         zone_ok AS (
           SELECT CASE WHEN ST_IsValid(g) THEN g ELSE ST_Buffer(g,0) END AS g FROM zone
         ),
         hits AS (
-          SELECT p.value FROM irr_points p, zone_ok z WHERE ST_Intersects(p.geom, z.g)
+          SELECT p.value FROM irr_points p, zone_ok z WHERE {pre}ST_Intersects({col}, z.g)
         )
         SELECT COALESCE(COUNT(*),0), AVG(value), MIN(value), MAX(value) FROM hits;
     """, [geojson])
@@ -325,61 +785,65 @@ def buildings_features(
     bbox: str | None = Query(None),
     limit: int = 50000,
     offset: int = 0,
+    cursor: str | None = Query(None, description="next_cursor de la página anterior"),
+    fmt: str = Depends(output_format),
+    zoom: int | None = Query(None, ge=0, le=22, description="Zoom del mapa: geometría simplificada"),
+    fields: str | None = FIELDS_QUERY,
+    precision: int | None = PRECISION_QUERY,
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
-    where, params = parse_bbox(bbox)
-    rows = q(con, f"""
+    where, params = parse_bbox(bbox, bbox_columns=has_bbox(con, "buildings"))
+    where = after_cursor(where, "rowid", cursor)
+    geom, min_size = building_lod(con, zoom)
+    where = and_where(where, min_size)
+    columns = select_fields(con, "buildings", fields)
+    return stream_features(con, f"""
         WITH f AS (
-          SELECT geom, * EXCLUDE (geom)
+          SELECT {column_list(columns)}{geom} AS geom, rowid AS _k
           FROM buildings
           {where}
+          ORDER BY _k
           LIMIT ? OFFSET ?
         )
-        SELECT ST_AsGeoJSON(geom), to_json(f) FROM f;
-    """, params + [limit, offset])
-    feats = [
-        {"type": "Feature", "geometry": json.loads(g), "properties": json.loads(p) if isinstance(p, str) else {}}
-        for g, p in rows
-    ]
-    return fc(feats)
+        SELECT {feature_select(fmt, "geom", props_struct(columns), precision)}, _k FROM f ORDER BY _k;
+    """, params + [limit, offset], fmt, limit, encode_cursor)
 
 @app.get("/buildings/irradiance")
 def buildings_irradiance(
     bbox: str | None = Query(None),
     limit: int = 50000,
     offset: int = 0,
+    cursor: str | None = Query(None, description="next_cursor de la página anterior"),
+    fmt: str = Depends(output_format),
+    zoom: int | None = Query(None, ge=0, le=22, description="Zoom del mapa: geometría simplificada"),
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
-    where, params = parse_bbox(bbox)
-    rows = q(con, f"""
+    where, params = parse_bbox(bbox, geom="b.geom", bbox_columns=has_bbox(con, "buildings"))
+    where = after_cursor(where, "b.rowid", cursor)
+    geom, min_size = building_lod(con, zoom, alias="b.")
+    where = and_where(where, min_size)
+    props = "{'reference': reference, 'irr_building': CAST(COALESCE(irr_mean_kWhm2_y, irr_average) AS DOUBLE)}"
+    return stream_features(con, f"""
         WITH f AS (
-          SELECT b.geom, b.reference, m.irr_mean_kWhm2_y, m.irr_average
+          SELECT {geom} AS geom, b.reference, m.irr_mean_kWhm2_y, m.irr_average, b.rowid AS _k
           FROM buildings b
-          LEFT JOIN edificios_metrics m ON UPPER(b.reference)=UPPER(m.reference)
+          LEFT JOIN edificios_metrics m ON b.ref_key = m.ref_key
           {where}
+          ORDER BY _k
           LIMIT ? OFFSET ?
         )
-        SELECT ST_AsGeoJSON(geom), reference, irr_mean_kWhm2_y, irr_average FROM f;
-    """, params + [limit, offset])
-    feats = []
-    for g, ref, irr_mean, irr_avg in rows:
-        v = irr_mean if irr_mean is not None else irr_avg
-        feats.append({
-            "type": "Feature",
-            "geometry": json.loads(g),
-            "properties": {"reference": ref, "irr_building": float(v) if v is not None else None},
-        })
-    return fc(feats)
+        SELECT {feature_select(fmt, "geom", props)}, _k FROM f ORDER BY _k;
+    """, params + [limit, offset], fmt, limit, encode_cursor)
 
 @app.get("/buildings/metrics")
 def buildings_metrics(reference: str, con: duckdb.DuckDBPyConnection = Depends(get_conn)):
-    ref = reference.strip()
-    rows = q(con, """
+    key = ref_key_literal(reference, "No metrics for this reference")
+    rows = q(con, f"""
         SELECT reference,
                irr_average, area_m2, superficie_util_m2, pot_kWp,
                energy_total_kWh, factor_capacidad_pct, irr_mean_kWhm2_y,reduccion_emisiones, ahorro_eur, certificadoCO2, cal_norenov, certificadoCO2_es_estimado, cal_norenov_es_estimado
-        FROM edificios_metrics WHERE UPPER(reference)=UPPER(?) LIMIT 1;
-    """, [ref])
+        FROM edificios_metrics WHERE ref_key = {key} LIMIT 1;
+    """)
     if not rows:
         raise HTTPException(404, "No metrics for this reference")
     r = rows[0]
@@ -405,28 +869,22 @@ def buildings_metrics(reference: str, con: duckdb.DuckDBPyConnection = Depends(g
 @app.get("/buildings/by_ref")
 def building_by_reference(
     ref: str = Query(..., description="Referencia catastral exacta"),
+    fields: str | None = FIELDS_QUERY,
+    precision: int | None = PRECISION_QUERY,
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
-    ref_norm = ref.strip()
-    rows = q(con, """
-        WITH f AS (
-          SELECT geom, * EXCLUDE (geom)
-          FROM buildings
-          WHERE UPPER(reference) = UPPER(?)
-          LIMIT 1
-        )
-        SELECT ST_AsGeoJSON(geom), to_json(f) FROM f;
-    """, [ref_norm])
+    key = ref_key_literal(ref, "Referencia no encontrada")
+    props = props_struct(select_fields(con, "buildings", fields))
+    rows = q(con, f"""
+        SELECT {feature_json("geom", props, precision)}
+        FROM buildings
+        WHERE ref_key = {key}
+        LIMIT 1;
+    """)
 
     if not rows:
         raise HTTPException(404, "Referencia no encontrada")
-
-    gjson, props = rows[0]
-    return {
-        "type": "Feature",
-        "geometry": json.loads(gjson),
-        "properties": json.loads(props) if isinstance(props, str) else (props or {})
-    }
+    return json.loads(rows[0][0])
 
 # ============================================================
 # ADDRESS LOOKUP
@@ -489,6 +947,8 @@ def cels_features(
     bbox: str | None = Query(None, description="minx,miny,maxx,maxy (WGS84)"),
     limit: int = 20000,
     offset: int = 0,
+    cursor: str | None = Query(None, description="next_cursor de la página anterior"),
+    fmt: str = Depends(output_format),
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
     if not bbox:
@@ -498,102 +958,141 @@ def cels_features(
     offset = max(0, int(offset))
 
     where, params = parse_bbox(bbox)
-    rows = q(con, f"""
-        WITH j AS (
-          SELECT 
-            ST_PointOnSurface(b.geom) AS pt,
-            c.id, c.nombre, c.street_norm, c.number_norm, c.reference, c.auto_CEL,
-            CAST(c.por_ocupacion AS DOUBLE) AS por_ocupacion
-          FROM buildings b
-          JOIN autoconsumos_CELS c
-            ON LEFT(UPPER(b.reference), 14) = LEFT(UPPER(c.reference), 14)
-          {where.replace("geom", "pt")}
-          LIMIT ? OFFSET ?
-        )
-        SELECT ST_AsGeoJSON(pt), to_json(struct_pack(
+    where = after_cursor(where, "rowid", cursor)
+    props = f"""struct_pack(
             id := id,
             nombre := nombre,
             street_norm := street_norm,
             number_norm := number_norm,
             reference := reference,
             auto_CEL := auto_CEL,
-            por_ocupacion := por_ocupacion
-        ))
-        FROM j;
-    """, params + [limit, offset])
+            por_ocupacion := por_ocupacion,
+            radio := COALESCE(radius_m, {CELS_DEFAULT_RADIUS_M!r})
+        )"""
+    # cels_points is materialized by derived.py (one point per CELS building)
+    return stream_features(con, f"""
+        WITH j AS (
+          SELECT geom, id, nombre, street_norm, number_norm, reference, auto_CEL, por_ocupacion, radius_m,
+                 rowid AS _k
+          FROM cels_points
+          {where}
+          ORDER BY _k
+          LIMIT ? OFFSET ?
+        )
+        SELECT {feature_select(fmt, "geom", props)}, _k
+        FROM j
+        ORDER BY _k;
+    """, params + [limit, offset], fmt, limit, encode_cursor)
+
 
+def _cels_hit(row: tuple) -> dict:
+    cid, nombre, street, number, ref, auto_cel, por_oc, radius, dist = row
     return {
-        "type": "FeatureCollection",
-        "features": [
-            {
-                "type": "Feature",
-                "geometry": json.loads(gjson),
-                "properties": json.loads(props) if isinstance(props, str) else (props or {}),
-            }
-            for gjson, props in rows
-        ],
+        "id": cid,
+        "nombre": nombre or "(sin nombre)",
+        "street_norm": street,
+        "number_norm": number,
+        "reference": ref,
+        "auto_CEL": int(auto_cel) if auto_cel is not None else None,
+        "por_ocupacion": float(por_oc) if por_oc is not None else None,
+        "radius_m": float(radius) if radius is not None else None,
+        "distance_m": float(dist) if dist is not None else None,
     }
 
-
-
-
-
+def _proximity(fn, *args) -> list[dict]:
+    try:
+        with phase("query"):
+            rows = fn(*args)
+    except ValueError as e:
+        raise HTTPException(400, f"Geometría no válida: {e}") from e
+    except duckdb.InterruptException as e:
+        raise HTTPException(499, "Petición cancelada por el cliente") from e
+    except duckdb.Error as e:
+        raise HTTPException(500, f"DuckDB error: {e}") from e
+    add_rows(len(rows))
+    return [_cels_hit(r) for r in rows]
 
 @app.post("/cels/within")
 def cels_within_buffer(
     req: CelsWithinReq,
-    radius_m: float = Query(500, description="Radio del buffer CELS en metros"),
+    radius_m: float = Query(500, gt=0, le=50000, description="Radio del buffer CELS en metros"),
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
-    geojson_str = json.dumps(req.geometry)
-    # 1 degree lon ~ 85km near Madrid; rough conversion is fine for UI proximity
-    radius_deg = radius_m / 85000.0
-    rows = q(con, """
-        WITH input_geom AS (SELECT ST_GeomFromGeoJSON(?::VARCHAR) AS geom),
-        cels_points AS (
-        SELECT c.id, c.nombre, c.street_norm, c.number_norm, c.reference AS cels_ref, c.auto_CEL,
-                c.por_ocupacion,
-                ST_Centroid(b.geom) AS point_geom
-        FROM autoconsumos_CELS c
-        JOIN buildings b ON LEFT(UPPER(b.reference),14)=LEFT(UPPER(c.reference),14)
-        ),
-        input_point AS (SELECT ST_Centroid(geom) AS center FROM input_geom)
-        SELECT cp.id, cp.nombre, cp.street_norm, cp.number_norm, cp.cels_ref, cp.auto_CEL,
-            cp.por_ocupacion,
-            ST_Distance(cp.point_geom, ip.center) AS distance_deg
-        FROM cels_points cp, input_point ip
-        WHERE ST_Distance(cp.point_geom, ip.center) <= ?
-        ORDER BY distance_deg;
-    """, [geojson_str, radius_deg])
-
-    cels = []
-    for row in rows:
-        # indices: 0..6 datos, 7 distancia
-        dist_m = (float(row[7]) * 85000.0) if row[7] is not None else None
-        por_oc = float(row[6]) if row[6] is not None else None
-        cels.append({
-            "id": row[0],
-            "nombre": row[1] or "(sin nombre)",
-            "street_norm": row[2],
-            "number_norm": row[3],
-            "reference": row[4],
-            "auto_CEL": int(row[5]) if row[5] is not None else None,
-            "por_ocupacion": por_oc,             # ⬅️ devolverlo
-            "distance_m": dist_m,
-        })
+    cels = _proximity(proximity.within_radius, con, req.geometry, radius_m, CELS_DEFAULT_RADIUS_M)
     return {"count": len(cels), "cels": cels, "radius_m": radius_m}
 
+@app.post("/cels/within_dynamic")
+def cels_within_dynamic(req: CelsWithinReq, con: duckdb.DuckDBPyConnection = Depends(get_conn)):
+    """CELS cuyo propio radio (columna `radio`, o CELS_DEFAULT_RADIUS_M) alcanza la geometría."""
+    cels = _proximity(proximity.within_own_radius, con, req.geometry, CELS_DEFAULT_RADIUS_M)
+    return {"count": len(cels), "cels": cels}
+
+@app.post("/cels/nearest")
+def cels_nearest(
+    req: CelsWithinReq,
+    k: int = Query(5, ge=1, le=100, description="Número de CELS más cercanos"),
+    con: duckdb.DuckDBPyConnection = Depends(get_conn),
+):
+    cels = _proximity(proximity.nearest, con, req.geometry, k, CELS_DEFAULT_RADIUS_M)
+    return {"count": len(cels), "cels": cels}
+
+
+@app.get("/debug/pool")
+def debug_pool():
+    return POOL.stats()
+
+
+@app.get("/debug/admission")
+def debug_admission():
+    return {name: c.stats() for name, c in ENDPOINT_CLASSES.items()}
+
+
+@app.get("/debug/cache")
+def debug_cache():
+    return RESULT_CACHE.stats() if RESULT_CACHE is not None else {"enabled": False}
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(404, "Métricas desactivadas")
+    lines = REQUEST_METRICS.render()
+    pool = POOL.stats()
+    lines += gauges("emsv_pool_cursors", "Pool cursors by state", ("state",),
+                    {("busy",): pool["busy"], ("idle",): pool["idle"], ("size",): pool["size"]})
+    lines += gauges("emsv_pool_events", "Pool cursor events since start", ("event",),
+                    {("created",): pool["created"], ("recycled",): pool["recycled"],
+                     ("timeouts",): pool["timeouts"]})
+    lines += gauges("emsv_admission_slots", "Admission slots by class", ("class", "state"), {
+        (name, k): c.stats()[k] for name, c in ENDPOINT_CLASSES.items() for k in ("running", "waiting")
+    })
+    lines += gauges("emsv_admission_rejected", "Requests rejected by admission control", ("class", "reason"), {
+        (name, reason): c.stats()[f"rejected_{reason}"]
+        for name, c in ENDPOINT_CLASSES.items() for reason in ("queue", "wait")
+    })
+    if RESULT_CACHE is not None:
+        cache = RESULT_CACHE.stats()
+        lines += gauges("emsv_result_cache", "Result cache state", ("stat",), {
+            (k,): cache[k] for k in ("entries", "bytes", "max_bytes", "hits", "misses", "evictions")
+        })
+        lines += gauges("emsv_result_cache_hit_ratio", "Result cache hits / lookups", (),
+                        {(): cache["hit_ratio"]})
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/slow_queries")
+def debug_slow_queries(limit: int = Query(50, ge=1, le=500)):
+    """Últimas consultas lentas o muestreadas, con su perfil de EXPLAIN ANALYZE (JSON y en texto)."""
+    if SLOW_QUERY_LOG is None:
+        return {"enabled": False}
+    return {"enabled": True, **SLOW_QUERY_LOG.stats(), "queries": SLOW_QUERY_LOG.recent(limit)}
+
 
 @app.get("/debug/cels/count")
 def debug_cels_count(con: duckdb.DuckDBPyConnection = Depends(get_conn)):
     try:
         count_cels = q(con, "SELECT COUNT(*) FROM autoconsumos_CELS")[0][0]
-        count_matches = q(con, """
-            SELECT COUNT(*)
-            FROM buildings b
-            JOIN autoconsumos_CELS c
-              ON LEFT(UPPER(b.reference), 14) = LEFT(UPPER(c.reference), 14)
-        """)[0][0]
+        count_matches = q(con, "SELECT COUNT(*) FROM cels_points")[0][0]
         sample = q(con, """
             SELECT c.id, c.nombre, c.reference, c.auto_CEL
             FROM autoconsumos_CELS c
@@ -618,32 +1117,86 @@ def cadastre_by_refcat(
     con: duckdb.DuckDBPyConnection = Depends(get_conn),
 ):
     ref_norm = refcat.strip()
+    key = ref_key_literal(ref_norm, "Referencia catastral no encontrada")
 
     if not include_feature:
-        exists = q(con, "SELECT 1 FROM buildings WHERE UPPER(reference)=UPPER(?) LIMIT 1", [ref_norm])
+        exists = q(con, f"SELECT 1 FROM buildings WHERE ref_key = {key} LIMIT 1")
         if not exists:
             raise HTTPException(404, "Referencia catastral no encontrada")
         return {"reference": ref_norm}
 
-    rows = q(con, """
-        WITH f AS (
-          SELECT geom, * EXCLUDE (geom)
-          FROM buildings
-          WHERE UPPER(reference)=UPPER(?)
-          LIMIT 1
-        )
-        SELECT ST_AsGeoJSON(geom), to_json(f) FROM f;
-    """, [ref_norm])
+    props = props_struct(property_columns(con, "buildings"))
+    rows = q(con, f"""
+        SELECT {feature_json("geom", props)}
+        FROM buildings
+        WHERE ref_key = {key}
+        LIMIT 1;
+    """)
 
     if not rows:
         raise HTTPException(404, "Referencia catastral no encontrada")
+    return {"reference": ref_norm, "feature": json.loads(rows[0][0])}
+# ============================================================
+# VECTOR TILES
+# ============================================================
+
+def _render_tile(con: duckdb.DuckDBPyConnection, layer: str, z: int, x: int, y: int) -> bytes:
+    try:
+        with phase("query"):
+            return render_tile(con, layer, z, x, y, table_columns(con, TILE_LAYERS[layer].source))
+    except duckdb.InterruptException as e:
+        raise HTTPException(499, "Petición cancelada por el cliente") from e
+    except duckdb.Error as e:
+        raise HTTPException(500, f"DuckDB error: {e}") from e
+
+@app.get("/tiles/{layer}/{z}/{x}/{y}.mvt")
+async def vector_tile(request: Request, layer: str, z: int, x: int, y: int):
+    if layer not in TILE_LAYERS:
+        raise HTTPException(404, f"Capa desconocida: {layer}")
+    if not valid_tile(z, x, y):
+        raise HTTPException(400, "Tile fuera de rango")
+
+    data = await run_in_threadpool(TILE_STORE.get, layer, z, x, y) if TILE_STORE is not None else None
+    if data is None:
+        # a cursor only for misses, watched like get_conn's (disconnect, class deadline)
+        version = SNAPSHOT.version()
+        async with request_conn(request) as con:
+            data = await run_in_threadpool(_render_tile, con, layer, z, x, y)
+        if TILE_STORE is not None and TILE_STORE_WRITEBACK:
+            await run_in_threadpool(TILE_STORE.put, layer, z, x, y, data, version)
+
+    # ETag / Cache-Control come from ConditionalMiddleware
+    if not data:
+        return Response(status_code=204)
+    return Response(data, media_type=MVT_CONTENT_TYPE)
+
+# ============================================================
+# EXPORTS (GeoParquet snapshots)
+# ============================================================
+
+@app.get("/exports")
+def exports_manifest():
+    version = latest_version(EXPORT_DIR)
+    manifest = read_manifest(EXPORT_DIR, version) if version else None
+    if manifest is None:
+        raise HTTPException(404, "No hay ninguna exportación disponible")
+    for info in manifest["layers"].values():
+        for f in info["files"]:
+            f["url"] = f"/exports/{version}/{f['path']}"
+    return manifest
+
+
+@app.get("/exports/{version}/{path:path}")
+def exports_file(version: str, path: str):
+    root = os.path.realpath(os.path.join(EXPORT_DIR, version))
+    full = os.path.realpath(os.path.join(root, path))
+    if (version.startswith(".") or not full.startswith(root + os.sep)
+            or not full.endswith(".parquet") or not os.path.isfile(full)):
+        raise HTTPException(404, "Fichero no encontrado")
+    # a version's files never change, so they can be cached forever; Range is handled by FileResponse
+    return FileResponse(
+        full,
+        media_type=PARQUET_CONTENT_TYPE,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
 
-    gjson, props = rows[0]
-    return {
-        "reference": ref_norm,
-        "feature": {
-            "type": "Feature",
-            "geometry": json.loads(gjson),
-            "properties": json.loads(props) if isinstance(props, str) else (props or {})
-        }
-    }
\ No newline at end of file
@@ -0,0 +1,278 @@
+# cache.py — response caching: in-process LRU/TTL results and HTTP validators (ETag)
+from __future__ import annotations
+import hashlib, math, threading, time
+from collections import OrderedDict
+from typing import Callable
+from urllib.parse import parse_qsl, urlencode
+
+from compress import merge_vary
+
+
+class ResultCache:
+    """
+    Byte-bounded LRU with a TTL. Entries belong to one warehouse version: the first
+    access after `version()` changes flushes everything.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, version: Callable[[], str], max_entry_bytes: int | None = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes or max(1, max_bytes // 8)
+        self._version = version
+        self._stamp = version()
+        self._lock = threading.Lock()
+        self._data: OrderedDict[str, tuple[float, int, int, list, bytes]] = OrderedDict()
+        self._bytes = 0
+        self.hits = self.misses = self.evictions = self.flushes = 0
+
+    def _check_version(self) -> None:
+        current = self._version()
+        if current != self._stamp:
+            self._data.clear()
+            self._bytes = 0
+            self._stamp = current
+            self.flushes += 1
+
+    def get(self, key: str) -> tuple[int, list, bytes] | None:
+        with self._lock:
+            self._check_version()
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2], entry[3], entry[4]
+
+    def version(self) -> str:
+        return self._version()
+
+    def put(self, key: str, status: int, headers: list, body: bytes, version: str | None = None) -> bool:
+        """Store a response; skipped if the warehouse changed since `version` was read."""
+        size = len(body) + len(key) + 64
+        if size > self.max_entry_bytes:
+            return False
+        with self._lock:
+            self._check_version()
+            if version is not None and version != self._stamp:
+                return False
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, size, status, headers, body)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._data:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+        return True
+
+    def _drop(self, key: str) -> None:
+        entry = self._data.pop(key)
+        self._bytes -= entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else None,
+                "evictions": self.evictions,
+                "flushes": self.flushes,
+                "version": self._stamp,
+            }
+
+
+def snap_bbox(bbox: str, grid: float) -> str:
+    """Grow a 'minx,miny,maxx,maxy' bbox outwards to multiples of `grid` degrees."""
+    try:
+        minx, miny, maxx, maxy = (float(v) for v in bbox.split(","))
+    except ValueError:
+        return bbox  # let the endpoint reject it
+    if not all(math.isfinite(v) for v in (minx, miny, maxx, maxy)):
+        return bbox
+
+    # the quotient is rounded first: 40.3 / 0.01 is 4029.999…, and flooring it would
+    # grow an already aligned edge by a cell, so a snapped bbox would not snap to itself
+    def down(v: float) -> float:
+        return round(math.floor(round(v / grid, 6)) * grid, 9)
+
+    def up(v: float) -> float:
+        return round(math.ceil(round(v / grid, 6)) * grid, 9)
+
+    return f"{down(minx)!r},{down(miny)!r},{up(maxx)!r},{up(maxy)!r}"
+
+
+class CacheMiddleware:
+    """
+    Pure ASGI middleware in front of `paths` ({path: snap_bbox?}). The key is method +
+    path + sorted query (+ body hash for POST) + Accept + `variant(scope)` (e.g. the
+    negotiated content coding, when compression runs below). When snapping, the rewritten bbox is
+    also what the endpoint sees, so every viewport inside the same grid cells shares
+    one entry. Misses stream through untouched and are stored if small enough.
+    """
+
+    def __init__(
+        self,
+        app,
+        cache: ResultCache,
+        paths: dict[str, bool],
+        grid: float = 0.002,
+        variant: Callable[[dict], str] | None = None,
+    ):
+        self.app = app
+        self.cache = cache
+        self.paths = paths
+        self.grid = grid
+        self.variant = variant
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "POST") or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        pairs = parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+        if self.paths[scope["path"]] and self.grid > 0:
+            pairs = [(k, snap_bbox(v, self.grid) if k == "bbox" else v) for k, v in pairs]
+        query = urlencode(sorted(pairs))
+        scope = dict(scope, query_string=query.encode("latin-1"))
+
+        body = b""
+        if scope["method"] == "POST":
+            chunks = []
+            while True:
+                msg = await receive()
+                if msg["type"] == "http.disconnect":
+                    return
+                chunks.append(msg.get("body", b""))
+                if not msg.get("more_body"):
+                    break
+            body = b"".join(chunks)
+        accept = dict(scope.get("headers") or []).get(b"accept", b"").decode("latin-1")
+        variant = self.variant(scope) if self.variant is not None else ""
+        key = (f"{scope['method']} {scope['path']}?{query}"
+               f"#{hashlib.sha1(body).hexdigest() if body else ''}|{accept}|{variant}")
+
+        hit = self.cache.get(key)
+        if hit is not None:
+            status, headers, payload = hit
+            await send({"type": "http.response.start", "status": status,
+                        "headers": headers + [(b"x-cache", b"HIT")]})
+            await send({"type": "http.response.body", "body": payload})
+            return
+
+        version = self.cache.version()
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if scope["method"] == "POST" and not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        captured: dict = {"status": 0, "headers": [], "chunks": [], "size": 0, "keep": True}
+
+        async def capture(msg):
+            if msg["type"] == "http.response.start":
+                captured["status"] = msg["status"]
+                captured["headers"] = [h for h in msg.get("headers", []) if h[0].lower() != b"set-cookie"]
+                msg = dict(msg, headers=list(msg.get("headers", [])) + [(b"x-cache", b"MISS")])
+            elif msg["type"] == "http.response.body" and captured["keep"]:
+                chunk = msg.get("body", b"")
+                captured["size"] += len(chunk)
+                if captured["size"] > self.cache.max_entry_bytes:
+                    captured["keep"] = False
+                    captured["chunks"] = []
+                else:
+                    captured["chunks"].append(chunk)
+                if not msg.get("more_body") and captured["keep"] and captured["status"] == 200:
+                    self.cache.put(key, 200, captured["headers"], b"".join(captured["chunks"]), version)
+            await send(msg)
+
+        await self.app(scope, replay, capture)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """
+    If-None-Match uses weak comparison: W/ prefixes are ignored. `*` ("any current
+    representation") is not honoured: answering it before the endpoint runs would turn
+    404s and 400s into 304s.
+    """
+    for tag in header.split(","):
+        if tag.strip().removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ConditionalMiddleware:
+    """
+    Strong ETags for GET/HEAD: the warehouse version plus a hash of path, sorted query,
+    Accept and `variant(scope)`, so a tag is known before the endpoint runs. A matching If-None-Match
+    is answered 304 straight away, without touching DuckDB. 200/204 responses get the
+    ETag and, unless the endpoint set its own, `cache_control`. `vary` names the request
+    header `variant` reads; it goes in Vary on 304s and tagged responses alike.
+    """
+
+    def __init__(
+        self,
+        app,
+        version: Callable[[], str],
+        cache_control: str,
+        exclude: tuple[str, ...] = (),
+        variant: Callable[[dict], str] | None = None,
+        vary: str | None = None,
+    ):
+        self.app = app
+        self.version = version
+        self.cache_control = cache_control.encode("latin-1")
+        self.exclude = exclude
+        self.variant = variant
+        self.vary = vary.encode("latin-1") if vary else None
+
+    def etag(self, scope) -> str:
+        headers = dict(scope.get("headers") or [])
+        pairs = parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+        h = hashlib.sha1()
+        h.update(scope["path"].encode())
+        h.update(b"?" + urlencode(sorted(pairs)).encode("latin-1"))
+        h.update(b"#" + headers.get(b"accept", b""))
+        if self.variant is not None:
+            h.update(b"|" + self.variant(scope).encode("latin-1"))
+        return f'"{self.version()}-{h.hexdigest()[:16]}"'
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] not in ("GET", "HEAD")
+                or scope["path"].startswith(self.exclude)):
+            await self.app(scope, receive, send)
+            return
+
+        etag = self.etag(scope)
+        validators = [(b"etag", etag.encode("latin-1")), (b"cache-control", self.cache_control)]
+        if_none_match = dict(scope.get("headers") or []).get(b"if-none-match")
+        if if_none_match is not None and _etag_matches(if_none_match.decode("latin-1"), etag):
+            headers = merge_vary(list(validators), self.vary) if self.vary else validators
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def tag(msg):
+            if msg["type"] == "http.response.start" and msg["status"] in (200, 204):
+                headers = list(msg.get("headers", []))
+                present = {k.lower() for k, _ in headers}
+                headers += [(k, v) for k, v in validators if k not in present]
+                if self.vary:
+                    headers = merge_vary(headers, self.vary)
+                msg = dict(msg, headers=headers)
+            await send(msg)
+
+        await self.app(scope, receive, tag)
@@ -0,0 +1,186 @@
+# compress.py — response compression (brotli / zstd / gzip) negotiated per request
+from __future__ import annotations
+import zlib
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import brotli
+except ImportError:  # optional: only offered when installed
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MIN_SIZE = 1024   # smaller single-chunk bodies are sent as they are
+OFFLOAD_SIZE = 64 * 1024   # larger chunks are compressed in the threadpool, off the event loop
+
+# Compressible responses: text, JSON and the binary map formats (MVT, Arrow, FlatGeobuf).
+# Parquet exports are already compressed (and served with byte ranges).
+COMPRESSIBLE = (
+    "text/",
+    "application/json",
+    "application/geo+json",
+    "application/x-ndjson",
+    "application/vnd.mapbox-vector-tile",
+    "application/vnd.apache.arrow.stream",
+    "application/flatgeobuf",
+)
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        # sync flush: the client can decode every chunk as soon as it arrives
+        return self._z.compress(data) + self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._z.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self, level: int):
+        self._c = brotli.Compressor(quality=level)
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._c.process(data) + self._c.flush()
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+class _Zstd:
+    def __init__(self, level: int):
+        self._c = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._c.compress(data) + self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# Server preference when the client weighs them equally; levels tuned for on-the-fly use
+ENCODERS: dict[str, tuple[type, int]] = {}
+if brotli is not None:
+    ENCODERS["br"] = (_Brotli, 5)
+if zstandard is not None:
+    ENCODERS["zstd"] = (_Zstd, 3)
+ENCODERS["gzip"] = (_Gzip, 6)
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str:
+    """Best supported coding for an Accept-Encoding header ("identity" if none)."""
+    weights: dict[str, float] = {}
+    for item in (accept_encoding or "").split(","):
+        name, *opts = [p.strip() for p in item.split(";")]
+        q = 1.0
+        for opt in opts:
+            if opt.startswith("q="):
+                try:
+                    q = float(opt[2:])
+                except ValueError:
+                    q = 0.0
+        if name:
+            weights[name.lower()] = q
+    best, best_q = "identity", 0.0
+    for name in ENCODERS:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def scope_encoding(scope) -> str:
+    """Coding this request will get; part of the cache key and ETag of compressed responses."""
+    headers = dict(scope.get("headers") or [])
+    return negotiate_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+
+
+def merge_vary(headers: list, value: bytes) -> list:
+    """`headers` with `value` added to Vary (once)."""
+    for i, (k, v) in enumerate(headers):
+        if k.lower() == b"vary":
+            if value.lower() not in [t.strip().lower() for t in v.split(b",")]:
+                headers[i] = (k, v + b", " + value)
+            return headers
+    return headers + [(b"vary", value)]
+
+
+def _encode(encoder, body: bytes, more: bool) -> bytes:
+    data = encoder.chunk(body) if body else b""
+    return data if more else data + encoder.finish()
+
+
+class CompressionMiddleware:
+    """
+    Pure ASGI middleware compressing response bodies chunk by chunk, so streamed
+    features leave compressed while DuckDB is still producing them. Sits below the
+    result cache, which therefore stores (and replays) compressed bodies.
+
+    Every response on a non-excluded path carries Vary: Accept-Encoding, compressed or
+    not, so shared caches keep the codings apart. Chunks of OFFLOAD_SIZE or more are
+    compressed in the threadpool: a multi-MB body must not stall the event loop.
+    """
+
+    def __init__(self, app, minimum_size: int = MIN_SIZE, exclude: tuple[str, ...] = ()):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.exclude = exclude
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude):
+            await self.app(scope, receive, send)
+            return
+        coding = scope_encoding(scope)
+        if coding == "identity" or scope["method"] == "HEAD":
+            async def vary(msg):
+                if msg["type"] == "http.response.start":
+                    msg = dict(msg, headers=merge_vary(list(msg.get("headers", [])), b"Accept-Encoding"))
+                await send(msg)
+
+            await self.app(scope, receive, vary)
+            return
+
+        start: dict | None = None
+        encoder = None
+
+        async def wrapped(msg):
+            nonlocal start, encoder
+            if msg["type"] == "http.response.start":
+                headers = merge_vary(list(msg.get("headers", [])), b"Accept-Encoding")
+                names = {k.lower(): v for k, v in headers}
+                ctype = names.get(b"content-type", b"").decode("latin-1").lower()
+                if (msg["status"] != 200 or b"content-encoding" in names
+                        or not ctype.startswith(COMPRESSIBLE)):
+                    await send(dict(msg, headers=headers))
+                    return
+                start = dict(msg, headers=headers)   # held until the first body chunk
+                return
+            if msg["type"] != "http.response.body" or start is None:
+                await send(msg)
+                return
+
+            body, more = msg.get("body", b""), msg.get("more_body", False)
+            if encoder is None:
+                headers = start["headers"]
+                if not more and len(body) < self.minimum_size:
+                    await send(dict(start, headers=headers))
+                    start = None
+                    await send(msg)
+                    return
+                headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+                headers.append((b"content-encoding", coding.encode()))
+                await send(dict(start, headers=headers))
+                cls, level = ENCODERS[coding]
+                encoder = cls(level)
+            if len(body) >= OFFLOAD_SIZE:
+                data = await run_in_threadpool(_encode, encoder, body, more)
+            else:
+                data = _encode(encoder, body, more)
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, wrapped)
@@ -0,0 +1,55 @@
+# export_snapshot.py — write the warehouse layers to versioned GeoParquet for bulk download
+#
+#   python export_snapshot.py                         # every layer, keep the last 2 versions
+#   python export_snapshot.py --layers buildings irr_points --force
+#
+# Run it after ingest.py. The version is the warehouse fingerprint,
+# so re-running on an unchanged warehouse is a no-op. Files are served by the API
+# under /exports/<version>/... (static, with byte ranges); DuckDB is never touched then.
+from __future__ import annotations
+import argparse, os, time
+
+import duckdb
+from dotenv import load_dotenv
+
+from exports import EXPORT_LAYERS, default_export_dir, export_snapshot, prune
+from snapshot import warehouse_fingerprint
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def main() -> None:
+    load_dotenv()
+    db_default = os.getenv("DUCKDB_PATH", "warehouse.duckdb")
+    if not os.path.isabs(db_default):
+        db_default = os.path.abspath(os.path.join(HERE, db_default))
+
+    ap = argparse.ArgumentParser(description="Export warehouse layers to GeoParquet")
+    ap.add_argument("--db", default=db_default)
+    ap.add_argument("--out", default=os.getenv("EXPORT_DIR") or None)
+    ap.add_argument("--layers", nargs="*", default=list(EXPORT_LAYERS), choices=list(EXPORT_LAYERS))
+    ap.add_argument("--keep", type=int, default=2, help="versions kept on disk")
+    ap.add_argument("--force", action="store_true", help="rewrite the current version")
+    args = ap.parse_args()
+
+    out = args.out or default_export_dir(args.db)
+    version = warehouse_fingerprint(args.db)
+    con = duckdb.connect(args.db, read_only=True)
+    con.execute("LOAD spatial;")
+
+    t0 = time.perf_counter()
+    try:
+        manifest = export_snapshot(con, out, version, args.layers, force=args.force)
+    finally:
+        con.close()
+
+    for name, info in manifest["layers"].items():
+        size = sum(f["bytes"] for f in info["files"])
+        print(f"{name}: {info['rows']} rows, {len(info['files'])} files, {size / 1e6:.1f} MB")
+    for old in prune(out, args.keep):
+        print(f"🗑  removed {old}")
+    print(f"✅ snapshot {version} in {time.perf_counter() - t0:.1f}s → {os.path.join(out, version)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# exports.py — versioned GeoParquet snapshots of the warehouse layers, for bulk consumers
+from __future__ import annotations
+import json, os, shutil, time
+from dataclasses import dataclass
+
+import duckdb
+
+from spatial import DERIVED_COLUMNS
+
+PARTITION_ZOOM = 14     # web-mercator tile (~2.4 km here) used as the spatial partition key
+ROW_GROUP_SIZE = 100_000
+PARQUET_CONTENT_TYPE = "application/vnd.apache.parquet"
+
+@dataclass(frozen=True)
+class ExportLayer:
+    table: str
+    srid: int | None         # CRS of `geom`; None = attribute table, written as one file
+
+
+EXPORT_LAYERS: dict[str, ExportLayer] = {
+    "buildings": ExportLayer("buildings", 4326),
+    "edificios_metrics": ExportLayer("edificios_metrics", None),
+    "shadows": ExportLayer("shadows", 4326),
+    "irr_points": ExportLayer("irr_points", 25830),
+    "autoconsumos_CELS": ExportLayer("autoconsumos_CELS", None),
+}
+
+
+def default_export_dir(db_path: str) -> str:
+    return os.path.splitext(db_path)[0] + ".exports"
+
+
+def _tile_sql(lon: str, lat: str, z: int) -> tuple[str, str]:
+    n = float(2 ** z)
+    x = f"CAST(floor(({lon} + 180.0) / 360.0 * {n!r}) AS INTEGER)"
+    y = (f"CAST(floor((1.0 - ln(tan(radians({lat})) + 1.0 / cos(radians({lat}))) / pi()) / 2.0 * {n!r})"
+         " AS INTEGER)")
+    return x, y
+
+
+def _columns(con: duckdb.DuckDBPyConnection, table: str) -> list[str]:
+    rows = con.execute("""
+        SELECT column_name FROM duckdb_columns()
+        WHERE schema_name = 'main' AND table_name = ?
+        ORDER BY column_index;
+    """, [table]).fetchall()
+    return [r[0] for r in rows]
+
+
+def _export_layer(con: duckdb.DuckDBPyConnection, name: str, layer: ExportLayer, out: str) -> dict:
+    cols = [c for c in _columns(con, layer.table) if c.lower() not in DERIVED_COLUMNS]
+    select = ", ".join('"' + c.replace('"', '""') + '"' for c in cols)
+    options = f"FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE {ROW_GROUP_SIZE}"
+    # rows without geometry have no tile to be partitioned into; `rows` counts the same
+    where = "" if layer.srid is None else "WHERE geom IS NOT NULL"
+
+    if layer.srid is None:
+        path = os.path.join(out, f"{name}.parquet")
+        con.execute(f"COPY (SELECT {select} FROM \"{layer.table}\") TO '{path}' ({options});")
+        partitioned = False
+    else:
+        # Published in WGS84 lon/lat whatever the storage CRS; GeoParquet metadata comes
+        # from the spatial extension for the GEOMETRY column.
+        geom = "geom" if layer.srid == 4326 else f"ST_Transform(geom, 'EPSG:{layer.srid}', 'EPSG:4326', TRUE)"
+        tx, ty = _tile_sql("ST_X(c)", "ST_Y(c)", PARTITION_ZOOM)
+        path = os.path.join(out, name)
+        con.execute(f"""
+            COPY (
+              SELECT * EXCLUDE (c), {tx} AS tile_x, {ty} AS tile_y
+              FROM (SELECT {select + ', ' if select else ''}{geom} AS geom, ST_Centroid({geom}) AS c
+                    FROM "{layer.table}" {where})
+              ORDER BY tile_x, tile_y
+            ) TO '{path}' ({options}, PARTITION_BY (tile_x, tile_y));
+        """)
+        partitioned = True
+
+    rows = con.execute(f'SELECT COUNT(*) FROM "{layer.table}" {where}').fetchone()[0]
+    paths = [path]
+    if partitioned:
+        paths = [os.path.join(root, fn) for root, _dirs, names in os.walk(path)
+                 for fn in names if fn.endswith(".parquet")]
+    files = [{"path": os.path.relpath(p, out).replace(os.sep, "/"), "bytes": os.path.getsize(p)} for p in paths]
+    return {
+        "table": layer.table,
+        "rows": int(rows),
+        "partition": f"tile_x/tile_y (z{PARTITION_ZOOM})" if partitioned else None,
+        "files": sorted(files, key=lambda f: f["path"]),
+    }
+
+
+def export_snapshot(
+    con: duckdb.DuckDBPyConnection,
+    export_dir: str,
+    version: str,
+    layers: list[str] | None = None,
+    force: bool = False,
+) -> dict:
+    """
+    Write every layer under `export_dir/<version>/` plus a manifest.json, then point
+    `export_dir/latest.json` at it. Built in a temp dir and renamed, so readers never
+    see a half-written version. An existing version is kept unless `force`, or unless
+    its manifest is missing or unreadable (e.g. left behind by an interrupted run).
+    """
+    final = os.path.join(export_dir, version)
+    if os.path.isdir(final) and not force:
+        manifest = read_manifest(export_dir, version)
+        if manifest is not None:
+            return manifest
+    os.makedirs(export_dir, exist_ok=True)
+    tmp = os.path.join(export_dir, f".{version}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    present = {r[0] for r in con.execute(
+        "SELECT table_name FROM duckdb_tables() WHERE schema_name = 'main'"
+    ).fetchall()}
+    manifest = {"version": version, "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "layers": {}}
+    try:
+        for name in layers or list(EXPORT_LAYERS):
+            layer = EXPORT_LAYERS[name]
+            if layer.table not in present:
+                continue
+            manifest["layers"][name] = _export_layer(con, name, layer, tmp)
+        with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(tmp, final)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    latest = os.path.join(export_dir, "latest.json")
+    with open(latest + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": version}, f)
+    os.replace(latest + ".tmp", latest)
+    return manifest
+
+
+def latest_version(export_dir: str) -> str | None:
+    try:
+        with open(os.path.join(export_dir, "latest.json"), encoding="utf-8") as f:
+            return json.load(f).get("version")
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def read_manifest(export_dir: str, version: str) -> dict | None:
+    try:
+        with open(os.path.join(export_dir, version, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def prune(export_dir: str, keep: int) -> list[str]:
+    """Delete all but the `keep` newest versions (never the one latest.json points to)."""
+    current = latest_version(export_dir)
+    versions = [
+        d for d in os.listdir(export_dir)
+        if not d.startswith(".") and os.path.isfile(os.path.join(export_dir, d, "manifest.json"))
+    ]
+    versions.sort(key=lambda d: os.path.getmtime(os.path.join(export_dir, d)), reverse=True)
+    removed = []
+    for d in versions[max(1, keep):]:
+        if d != current:
+            shutil.rmtree(os.path.join(export_dir, d), ignore_errors=True)
+            removed.append(d)
+    return removed
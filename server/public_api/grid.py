@@ -0,0 +1,137 @@
+# grid.py — point layers binned into square or hexagonal cells sized to the map zoom
+from __future__ import annotations
+import math
+
+import duckdb
+
+SHAPES = ("square", "hex")
+CELL_PX = 32            # cell side on screen, in pixels of a 256 px tile
+GRID_REF_LAT = 40.3     # Getafe: cells are square on screen at this latitude
+MAX_CELLS = 50_000      # bbox/zoom combinations producing more cells are rejected
+
+
+def cell_size(zoom: int) -> tuple[float, float]:
+    """
+    Cell side in degrees (dx, dy) for `zoom`. Same formula as derived.build_grid_cells,
+    whose precomputed levels store dx so a mismatch is detected, not served.
+    """
+    dx = 360.0 / (1 << zoom) * CELL_PX / 256
+    return dx, dx * math.cos(math.radians(GRID_REF_LAT))
+
+
+def snap_bounds(bounds: list[float], dx: float, dy: float) -> tuple[int, int, int, int]:
+    """Cell index range (cx0, cy0, cx1, cy1) covering a WGS84 bbox."""
+    minx, miny, maxx, maxy = bounds
+    return (math.floor(minx / dx), math.floor(miny / dy), math.floor(maxx / dx), math.floor(maxy / dy))
+
+
+def has_level(con: duckdb.DuckDBPyConnection, layer: str, zoom: int, dx: float) -> bool:
+    """
+    True if derived.py precomputed square cells of this size for `layer`. Tables built
+    before grid_cells had nv (non-null values) are ignored: their mean counted NULLs.
+    """
+    try:
+        row = con.execute(
+            "SELECT nv FROM grid_cells WHERE layer = ? AND z = ? AND abs(dx - ?) < 1e-12 LIMIT 1",
+            [layer, zoom, dx],
+        ).fetchone()
+    except (duckdb.CatalogException, duckdb.BinderException):
+        return False
+    return row is not None
+
+
+def _stats(value: str | None) -> str:
+    if value is None:
+        return "COUNT(*) AS n, NULL::DOUBLE AS mean, NULL::DOUBLE AS vmin, NULL::DOUBLE AS vmax"
+    return f"COUNT(*) AS n, AVG({value}) AS mean, MIN({value}) AS vmin, MAX({value}) AS vmax"
+
+
+def precomputed_cells_sql(layer: str, zoom: int, cells: tuple[int, int, int, int]) -> str:
+    """
+    Cells (cx, cy, n, mean, vmin, vmax) read from grid_cells; inlined so the scan prunes.
+    The mean divides by the non-null count, like AVG on the live path.
+    """
+    cx0, cy0, cx1, cy1 = cells
+    return f"""
+        SELECT cx, cy, n, total / nullif(nv, 0) AS mean, vmin, vmax
+        FROM grid_cells
+        WHERE layer = '{layer}' AND z = {int(zoom)}
+          AND cx BETWEEN {cx0} AND {cx1} AND cy BETWEEN {cy0} AND {cy1}
+    """
+
+
+def square_cells_sql(points: str, value: str | None, dx: float, dy: float) -> str:
+    """
+    Square cells of `points` (a subquery with lon/lat columns x, y and the value).
+    The caller snaps the bbox to whole cells, so edge cells are complete.
+    """
+    return f"""
+        SELECT CAST(floor(x / {dx!r}) AS BIGINT) AS cx, CAST(floor(y / {dy!r}) AS BIGINT) AS cy,
+               {_stats(value)}
+        FROM ({points})
+        GROUP BY ALL
+    """
+
+
+def square_geom(dx: float, dy: float) -> str:
+    return f"ST_MakeEnvelope(cx * {dx!r}, cy * {dy!r}, (cx + 1) * {dx!r}, (cy + 1) * {dy!r})"
+
+
+def _hex_center(dx: float, dy: float) -> tuple[str, str]:
+    """Lon/lat expressions of the centre of axial cell (cx, cy)."""
+    s = dx / math.sqrt(3)
+    return f"({s!r} * sqrt(3) * (cx + cy / 2.0))", f"({s!r} * 1.5 * cy / {dx / dy!r})"
+
+
+def hex_cells_sql(
+    points: str, value: str | None, dx: float, dy: float,
+    centres: tuple[float, float, float, float] | None = None,
+) -> str:
+    """
+    Pointy-top hexagons of circumradius dx/√3 (width dx), binned in a plane where
+    lat is scaled by dx/dy so hexagons are regular on screen. Axial (q, r) come
+    from cube rounding. With `centres` (minx, miny, maxx, maxy) only hexagons
+    centred inside it are returned: the caller reads points at least one cell
+    beyond it, so none of them is cut at the edge of the query window.
+    """
+    s = dx / math.sqrt(3)
+    k = dx / dy
+    where = ""
+    if centres is not None:
+        x, y = _hex_center(dx, dy)
+        minx, miny, maxx, maxy = centres
+        where = f"WHERE {x} BETWEEN {minx!r} AND {maxx!r} AND {y} BETWEEN {miny!r} AND {maxy!r}"
+    return f"""
+        WITH a AS (
+          SELECT (sqrt(3) / 3 * x - (y * {k!r}) / 3) / {s!r} AS fq,
+                 (2.0 / 3 * (y * {k!r})) / {s!r} AS fr,
+                 *
+          FROM ({points})
+        ),
+        c AS (
+          SELECT *, abs(rq - fq) AS dq, abs(rr - fr) AS dr, abs(rs + fq + fr) AS ds
+          FROM (SELECT *, round(fq) AS rq, round(fr) AS rr, round(-fq - fr) AS rs FROM a)
+        ),
+        h AS (
+          SELECT CAST(CASE WHEN dq > dr AND dq > ds THEN -rr - rs ELSE rq END AS BIGINT) AS cx,
+                 CAST(CASE WHEN NOT (dq > dr AND dq > ds) AND dr > ds THEN -rq - rs ELSE rr END AS BIGINT) AS cy,
+                 *
+          FROM c
+        )
+        SELECT cx, cy, {_stats(value)}
+        FROM h
+        {where}
+        GROUP BY cx, cy
+    """
+
+
+def hex_geom(dx: float, dy: float) -> str:
+    """Hexagon polygon of axial cell (cx, cy) back in lon/lat."""
+    s = dx / math.sqrt(3)
+    k = dx / dy
+    center_x, center_y = _hex_center(dx, dy)
+    corners = []
+    for i in range(7):
+        a = math.radians(60 * (i % 6) - 30)
+        corners.append(f"ST_Point({center_x} + {s * math.cos(a)!r}, {center_y} + {s * math.sin(a) / k!r})")
+    return f"ST_MakePolygon(ST_MakeLine([{', '.join(corners)}]))"
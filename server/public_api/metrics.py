@@ -0,0 +1,174 @@
+# metrics.py — in-process request metrics rendered in the Prometheus text format
+from __future__ import annotations
+import bisect, threading, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ROWS_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+# Phases timed inside the request; "serialize" is what remains of the total once
+# connect/query/fetch and the time spent handing bytes to the server (send) are taken out.
+PHASES = ("connect", "query", "fetch", "serialize", "send", "total")
+
+_current: ContextVar[dict | None] = ContextVar("request_metrics", default=None)
+
+
+@contextmanager
+def phase(name: str):
+    """Add the block's wall time to `name` for the current request (no-op outside one)."""
+    acc = _current.get()
+    if acc is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        acc[name] = acc.get(name, 0.0) + time.perf_counter() - t0
+
+
+def add_rows(n: int) -> None:
+    acc = _current.get()
+    if acc is not None:
+        acc["rows"] = acc.get("rows", 0) + n
+
+
+def _fmt_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{str(v)}"' for k, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series: dict[tuple, list] = {}   # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels: tuple, value: float) -> None:
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            s[i] += 1
+        s[-2] += value
+        s[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, s in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, s):
+                cumulative += n
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_fmt_labels(self.labels, labels, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_fmt_labels(self.labels, labels, le)} {s[-1]}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, labels)} {s[-2]}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, labels)} {s[-1]}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name, self.help, self.labels = name, help, labels
+        self._series: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple, value: float = 1) -> None:
+        self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, v in sorted(self._series.items()):
+            yield f"{self.name}{_fmt_labels(self.labels, labels)} {v}"
+
+
+def gauges(name: str, help: str, labels: tuple[str, ...], series: dict[tuple, float]) -> Iterable[str]:
+    yield f"# HELP {name} {help}"
+    yield f"# TYPE {name} gauge"
+    for key, v in sorted(series.items()):
+        yield f"{name}{_fmt_labels(labels, key)} {v if v is not None else 'NaN'}"
+
+
+class RequestMetrics:
+    """Per-endpoint request histograms/counters. Updated once per request under one lock."""
+
+    def __init__(self, prefix: str = "emsv"):
+        self._lock = threading.Lock()
+        self.duration = Histogram(f"{prefix}_request_duration_seconds",
+                                  "Request latency by phase", ("endpoint", "phase"), LATENCY_BUCKETS)
+        self.rows = Histogram(f"{prefix}_response_rows", "Rows returned by DuckDB per request",
+                              ("endpoint",), ROWS_BUCKETS)
+        self.bytes = Histogram(f"{prefix}_response_bytes", "Response body bytes sent (after compression)",
+                               ("endpoint",), BYTES_BUCKETS)
+        self.requests = Counter(f"{prefix}_requests_total", "Requests by status", ("endpoint", "status"))
+        self.cache = Counter(f"{prefix}_result_cache_requests_total", "Result cache lookups",
+                             ("endpoint", "result"))
+
+    def record(self, endpoint: str, status: int, acc: dict, sent: int, cache: str | None) -> None:
+        total = acc["total"]
+        acc["serialize"] = max(0.0, total - sum(acc.get(p, 0.0) for p in ("connect", "query", "fetch", "send")))
+        with self._lock:
+            for p in PHASES:
+                if p in acc:
+                    self.duration.observe((endpoint, p), acc[p])
+            if "rows" in acc:
+                self.rows.observe((endpoint,), acc["rows"])
+            self.bytes.observe((endpoint,), sent)
+            self.requests.inc((endpoint, status))
+            if cache:
+                self.cache.inc((endpoint, cache.lower()))
+
+    def render(self) -> list[str]:
+        with self._lock:
+            lines = []
+            for m in (self.duration, self.rows, self.bytes, self.requests, self.cache):
+                lines.extend(m.render())
+            return lines
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing each request and the bytes it sends. `label(path)`
+    maps a path to its route template so tiles etc. don't explode the label set.
+    """
+
+    def __init__(self, app, metrics: RequestMetrics, label: Callable[[str], str], exclude: tuple[str, ...] = ()):
+        self.app = app
+        self.metrics = metrics
+        self.label = label
+        self.exclude = exclude
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude):
+            await self.app(scope, receive, send)
+            return
+        acc: dict = {}
+        token = _current.set(acc)
+        info = {"status": 0, "sent": 0, "cache": None}
+        t0 = time.perf_counter()
+
+        async def timed_send(msg):
+            if msg["type"] == "http.response.start":
+                info["status"] = msg["status"]
+                for k, v in msg.get("headers", []):
+                    if k.lower() == b"x-cache":
+                        info["cache"] = v.decode("latin-1")
+                await send(msg)
+                return
+            t = time.perf_counter()
+            await send(msg)
+            acc["send"] = acc.get("send", 0.0) + time.perf_counter() - t
+            info["sent"] += len(msg.get("body", b""))
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            acc["total"] = time.perf_counter() - t0
+            _current.reset(token)
+            self.metrics.record(self.label(scope["path"]), info["status"] or 500, acc, info["sent"], info["cache"])
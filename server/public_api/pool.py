@@ -0,0 +1,323 @@
+# pool.py — one DuckDB database per worker, cursors handed out from a bounded pool
+from __future__ import annotations
+import queue, threading, time
+from contextlib import contextmanager
+
+import duckdb
+
+
+class PoolTimeout(RuntimeError):
+    """No cursor became free within the checkout timeout."""
+
+
+class _Slot:
+    __slots__ = ("con", "generation", "uses", "created", "last_used", "closed", "background")
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, generation: int):
+        self.con = con
+        self.generation = generation
+        self.uses = 0
+        self.created = self.last_used = time.monotonic()
+        self.closed = False
+        self.background = False
+
+
+class DuckDBPool:
+    """
+    Opens the warehouse once and hands out cursors (DuckDB connections that share
+    the same database instance, catalog, buffer pool and loaded extensions).
+
+    - size: max cursors checked out at once; extra callers wait up to `timeout` seconds
+    - max_uses / max_age: a cursor is closed and replaced after that many checkouts / seconds
+    - health_check_after: cursors idle longer than this run `SELECT 1` before being reused
+    - drain_timeout: after the file is replaced, how long cursors still running on the old
+      database may finish before they are interrupted and closed
+    - extensions: loaded on every database instance it opens
+
+    Background work (the slow-query log) checks out with `background=True`: one extra
+    cursor of its own, so it never takes a request's slot.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        read_only: bool = True,
+        size: int = 8,
+        timeout: float = 5.0,
+        max_uses: int = 10_000,
+        max_age: float = 3600.0,
+        health_check_after: float = 30.0,
+        threads: int = 4,
+        drain_timeout: float = 10.0,
+        extensions: tuple[str, ...] = ("spatial",),
+    ):
+        self.path = path
+        self.read_only = read_only
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.health_check_after = health_check_after
+        self.threads = threads
+        self.drain_timeout = drain_timeout
+        self.extensions = tuple(extensions)
+
+        self._db: duckdb.DuckDBPyConnection | None = None
+        self._retired: list[duckdb.DuckDBPyConnection] = []
+        self._generation = 0
+        self._version: str | None = None
+        self._idle: queue.LifoQueue[_Slot] = queue.LifoQueue()
+        self._sem = threading.BoundedSemaphore(self.size)
+        self._background = threading.BoundedSemaphore(1)
+        self._busy: dict[int, _Slot] = {}
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._writing = False
+        self._created = 0
+        self._recycled = 0
+        self._timeouts = 0
+
+    # ---------------------------------------------------------- lifecycle
+
+    def open(self) -> None:
+        with self._lock:
+            while True:
+                if self._db is not None:
+                    return
+                if self._writing:
+                    self._drained.wait()
+                    continue
+                self._drain_locked()
+                # The drain waits with the lock released: a concurrent open() or a
+                # write_connection() may have started meanwhile
+                if self._db is None and not self._writing:
+                    break
+            db = duckdb.connect(self.path, read_only=self.read_only)
+            # Extensions and settings live on the database instance, so every cursor sees them.
+            for ext in self.extensions:
+                db.execute(f"LOAD {ext};")
+            try:
+                db.execute(f"PRAGMA threads={int(self.threads)};")
+            except duckdb.Error:
+                pass
+            try:
+                db.execute("SET lock_timeout='5s';")
+            except duckdb.Error:
+                pass
+            self._db = db
+
+    def ensure_version(self, version: str) -> None:
+        """Reopen the database when the warehouse file changed (e.g. it was replaced)."""
+        with self._lock:
+            if version == self._version:
+                return
+            first, self._version = self._version is None, version
+        if not first:
+            self.recycle()
+
+    def recycle(self) -> None:
+        """
+        Open a fresh database instance. Idle cursors are closed now; cursors still in use
+        belong to the old generation and are closed when released (see _drain_locked).
+        """
+        with self._lock:
+            if self._db is not None:
+                self._retired.append(self._db)
+            self._db = None
+            self._generation += 1
+            while True:
+                try:
+                    self._close_slot(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+        self.open()
+
+    @contextmanager
+    def write_connection(self):
+        """
+        Short-lived read-write connection next to a read-only pool. DuckDB will not open
+        one file twice in a process with different settings, so the pool's instance is
+        drained and closed first; checkouts wait for the write and then reopen it.
+        """
+        with self._lock:
+            while self._writing:
+                self._drained.wait()
+            self._writing = True
+            if self._db is not None:
+                self._retired.append(self._db)
+            self._db = None
+            self._generation += 1
+            while True:
+                try:
+                    self._close_slot(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+            self._drain_locked()
+        try:
+            con = duckdb.connect(self.path, read_only=False)
+            try:
+                yield con
+            finally:
+                con.close()
+        finally:
+            with self._lock:
+                self._writing = False
+                self._drained.notify_all()
+
+    def close(self) -> None:
+        with self._lock:
+            while True:
+                try:
+                    self._close_slot(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+            if self._db is not None:
+                self._retired.append(self._db)
+                self._db = None
+            for db in self._retired:
+                db.close()
+            self._retired.clear()
+
+    # ---------------------------------------------------------- checkout
+
+    def acquire(self, background: bool = False) -> duckdb.DuckDBPyConnection:
+        sem = self._background if background else self._sem
+        if not sem.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"no DuckDB cursor free after {self.timeout}s (pool size {self.size})")
+        try:
+            slot = self._checkout()
+        except BaseException:
+            sem.release()
+            raise
+        slot.background = background
+        with self._lock:
+            self._busy[id(slot.con)] = slot
+        return slot.con
+
+    def release(self, con: duckdb.DuckDBPyConnection, discard: bool = False) -> None:
+        with self._lock:
+            slot = self._busy.get(id(con))
+            if slot is None:
+                return
+            slot.uses += 1
+            slot.last_used = time.monotonic()
+            sem = self._background if slot.background else self._sem
+            keep = not (discard or slot.closed or self._db is None
+                        or slot.generation != self._generation or self._expired(slot))
+            if keep:
+                del self._busy[id(con)]
+                self._idle.put(slot)
+        if not keep:
+            # Closed before it leaves _busy, so a drain never sees the old instance as free too early
+            self._close_slot(slot)
+            with self._lock:
+                self._recycled += 1
+                self._busy.pop(id(con), None)
+                self._drained.notify_all()
+        sem.release()
+
+    @contextmanager
+    def connection(self):
+        con = self.acquire()
+        discard = False
+        try:
+            yield con
+        except duckdb.Error:
+            discard = True
+            raise
+        finally:
+            self.release(con, discard=discard)
+
+    def stats(self) -> dict:
+        with self._lock:
+            busy = len(self._busy)
+        return {
+            "size": self.size,
+            "busy": busy,
+            "idle": self._idle.qsize(),
+            "created": self._created,
+            "recycled": self._recycled,
+            "generation": self._generation,
+            "timeouts": self._timeouts,
+        }
+
+    # ---------------------------------------------------------- internals
+
+    def _checkout(self) -> _Slot:
+        if self._db is None:
+            self.open()
+        while True:
+            try:
+                slot = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_slot()
+            if slot.generation != self._generation or self._expired(slot):
+                self._discard_idle(slot)
+                continue
+            if time.monotonic() - slot.last_used > self.health_check_after and not self._healthy(slot):
+                self._discard_idle(slot)
+                continue
+            return slot
+
+    def _new_slot(self) -> _Slot:
+        while True:
+            self.open()
+            with self._lock:
+                if self._db is not None:  # else recycled meanwhile: open the new one
+                    self._created += 1
+                    return _Slot(self._db.cursor(), self._generation)
+
+    def _drain_locked(self) -> None:
+        """
+        Close the previous database instance before connecting again. DuckDB keeps one
+        instance per path while any of its cursors lives, so connect() would otherwise
+        hand back the replaced file. Cursors still running get `drain_timeout` seconds,
+        then are interrupted and closed (their requests fail). Called with the lock held.
+        """
+        deadline = time.monotonic() + self.drain_timeout
+        while True:
+            stale = [s for s in self._busy.values() if s.generation != self._generation and not s.closed]
+            remaining = deadline - time.monotonic()
+            if not stale:
+                break
+            if remaining <= 0:
+                for slot in stale:
+                    try:
+                        slot.con.interrupt()
+                    except duckdb.Error:
+                        pass
+                    self._close_slot(slot)
+                break
+            self._drained.wait(remaining)
+        for db in self._retired:
+            try:
+                db.close()
+            except duckdb.Error:
+                pass
+        self._retired.clear()
+
+    def _discard_idle(self, slot: _Slot) -> None:
+        self._close_slot(slot)
+        with self._lock:
+            self._recycled += 1
+
+    def _expired(self, slot: _Slot) -> bool:
+        return slot.uses >= self.max_uses or time.monotonic() - slot.created > self.max_age
+
+    @staticmethod
+    def _healthy(slot: _Slot) -> bool:
+        try:
+            slot.con.execute("SELECT 1").fetchall()
+            return True
+        except duckdb.Error:
+            return False
+
+    @staticmethod
+    def _close_slot(slot: _Slot) -> None:
+        slot.closed = True
+        try:
+            slot.con.close()
+        except duckdb.Error:
+            pass
@@ -0,0 +1,95 @@
+# proximity.py — radius / k-nearest / per-CELS-radius search over cels_points in EPSG:25830
+from __future__ import annotations
+import json
+
+import duckdb
+
+from spatial import envelope_sql, geojson_bounds
+
+SRID_M = 25830          # ETRS89 / UTM 30N: distances in meters around Getafe
+KNN_START_M = 500.0     # first search radius for k-nearest, quadrupled until k hits are found
+KNN_MAX_STEPS = 4
+
+_COLUMNS = "id, nombre, street_norm, number_norm, reference, auto_CEL, por_ocupacion"
+
+
+def _search_box(geometry: dict, radius_m: float) -> str:
+    """
+    Constant search area: bbox of the input (WGS84) reprojected to 25830 and grown by
+    `radius_m` (+1 m slack for the reprojected edges). Anything within `radius_m` of the
+    input lies inside it, and being constant lets the RTREE on geom_25830 answer it.
+    """
+    bounds = geojson_bounds(geometry)
+    if bounds is None:
+        raise ValueError("geometría sin coordenadas")
+    env = envelope_sql(*bounds, srid=SRID_M)
+    return f"ST_Envelope(ST_Buffer({env}, {float(radius_m) + 1.0!r}))"
+
+
+def _search(
+    con: duckdb.DuckDBPyConnection,
+    geometry: dict,
+    search_m: float,
+    radius_expr: str,
+    default_radius_m: float,
+    limit: int | None = None,
+) -> list[tuple]:
+    limit_sql = f"LIMIT {int(limit)}" if limit else ""
+    return con.execute(f"""
+        WITH zone AS (
+          SELECT ST_Transform(ST_GeomFromGeoJSON(?::VARCHAR), 'EPSG:4326', 'EPSG:{SRID_M}', TRUE) AS g
+        ),
+        cand AS (
+          SELECT {_COLUMNS},
+                 COALESCE(radius_m, {float(default_radius_m)!r}) AS radius_m,
+                 ST_Distance(cp.geom_25830, zone.g) AS distance_m
+          FROM cels_points cp, zone
+          WHERE ST_Intersects(cp.geom_25830, {_search_box(geometry, search_m)})
+        )
+        SELECT {_COLUMNS}, radius_m, distance_m
+        FROM cand
+        WHERE distance_m <= {radius_expr}
+        QUALIFY row_number() OVER (PARTITION BY id ORDER BY distance_m) = 1
+        ORDER BY distance_m
+        {limit_sql};
+    """, [json.dumps(geometry)]).fetchall()
+
+
+def within_radius(con, geometry: dict, radius_m: float, default_radius_m: float) -> list[tuple]:
+    """CELS whose location is at most `radius_m` meters from the geometry."""
+    return _search(con, geometry, radius_m, f"{float(radius_m)!r}", default_radius_m)
+
+
+def within_own_radius(con, geometry: dict, default_radius_m: float) -> list[tuple]:
+    """CELS whose own radius (radius_m, or the default) reaches the geometry."""
+    row = con.execute(
+        f"SELECT MAX(COALESCE(radius_m, {float(default_radius_m)!r})) FROM cels_points"
+    ).fetchone()
+    if not row or row[0] is None:
+        return []
+    return _search(con, geometry, float(row[0]), "radius_m", default_radius_m)
+
+
+def nearest(con, geometry: dict, k: int, default_radius_m: float) -> list[tuple]:
+    """
+    The k CELS closest to the geometry. Searches growing radii through the index; once
+    k hits lie within radius r they are the true k nearest. Falls back to a full scan.
+    """
+    r = KNN_START_M
+    for _ in range(KNN_MAX_STEPS):
+        rows = _search(con, geometry, r, f"{r!r}", default_radius_m, limit=k)
+        if len(rows) >= k:
+            return rows
+        r *= 4
+    return con.execute(f"""
+        WITH zone AS (
+          SELECT ST_Transform(ST_GeomFromGeoJSON(?::VARCHAR), 'EPSG:4326', 'EPSG:{SRID_M}', TRUE) AS g
+        )
+        SELECT {_COLUMNS},
+               COALESCE(radius_m, {float(default_radius_m)!r}) AS radius_m,
+               ST_Distance(cp.geom_25830, zone.g) AS distance_m
+        FROM cels_points cp, zone
+        QUALIFY row_number() OVER (PARTITION BY id ORDER BY distance_m) = 1
+        ORDER BY distance_m
+        LIMIT {int(k)};
+    """, [json.dumps(geometry)]).fetchall()
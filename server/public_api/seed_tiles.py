@@ -0,0 +1,94 @@
+# seed_tiles.py — render the vector tile pyramid over the Getafe boundary into the tile store
+#
+#   python seed_tiles.py                       # every layer, from its minzoom up to 16
+#   python seed_tiles.py --layers buildings --maxzoom 17 --workers 8
+#
+# Run it after ingest.py; the API also drops the store by itself
+# when the warehouse fingerprint no longer matches the one the tiles were rendered from.
+from __future__ import annotations
+import argparse, json, os, time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from shapely.geometry import box, shape
+from shapely.ops import unary_union
+
+from pool import DuckDBPool
+from snapshot import warehouse_fingerprint
+from spatial import table_columns
+from tiles import TILE_LAYERS, TileStore, default_store_path, lonlat_to_tile, render_tile, tile_bounds_lonlat
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOUNDARY = os.path.join(HERE, "..", "resources", "map", "Limite_Getafe.geojson")
+BATCH = 500
+
+
+def load_area(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    feats = data["features"] if data.get("type") == "FeatureCollection" else [data]
+    return unary_union([shape(ft["geometry"]) for ft in feats])
+
+
+def tiles_covering(area, z: int):
+    minx, miny, maxx, maxy = area.bounds
+    x0, y0 = lonlat_to_tile(minx, maxy, z)
+    x1, y1 = lonlat_to_tile(maxx, miny, z)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            if area.intersects(box(*tile_bounds_lonlat(z, x, y))):
+                yield x, y
+
+
+def main() -> None:
+    load_dotenv()
+    db_default = os.getenv("DUCKDB_PATH", "warehouse.duckdb")
+    if not os.path.isabs(db_default):
+        db_default = os.path.abspath(os.path.join(HERE, db_default))
+
+    ap = argparse.ArgumentParser(description="Pre-render MVT tiles into the tile store")
+    ap.add_argument("--db", default=db_default)
+    ap.add_argument("--store", default=os.getenv("TILE_STORE_PATH") or None)
+    ap.add_argument("--boundary", default=BOUNDARY)
+    ap.add_argument("--layers", nargs="*", default=list(TILE_LAYERS), choices=list(TILE_LAYERS))
+    ap.add_argument("--minzoom", type=int, default=None, help="default: each layer's minzoom")
+    ap.add_argument("--maxzoom", type=int, default=16)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    args = ap.parse_args()
+
+    store_path = args.store or default_store_path(args.db)
+    version = warehouse_fingerprint(args.db)
+    store = TileStore(store_path, lambda: version)
+    area = load_area(args.boundary)
+
+    pool = DuckDBPool(args.db, read_only=True, size=args.workers, timeout=None)
+    pool.open()
+    with pool.connection() as con:
+        columns = {layer: table_columns(con, TILE_LAYERS[layer].source) for layer in args.layers}
+
+    def render(job: tuple[str, int, int, int]) -> tuple[str, int, int, int, bytes]:
+        layer, z, x, y = job
+        with pool.connection() as con:
+            return layer, z, x, y, render_tile(con, layer, z, x, y, columns[layer])
+
+    t0 = time.perf_counter()
+    total = 0
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as ex:
+            for layer in args.layers:
+                start = max(TILE_LAYERS[layer].minzoom, args.minzoom or 0)
+                for z in range(start, args.maxzoom + 1):
+                    jobs = [(layer, z, x, y) for x, y in tiles_covering(area, z)]
+                    for i in range(0, len(jobs), BATCH):
+                        store.put_many(list(ex.map(render, jobs[i:i + BATCH])), version)
+                    total += len(jobs)
+                    print(f"{layer} z{z}: {len(jobs)} tiles")
+    finally:
+        pool.close()
+        store.close()
+
+    print(f"✅ {total} tiles in {time.perf_counter() - t0:.1f}s → {store_path} (warehouse {version})")
+
+
+if __name__ == "__main__":
+    main()
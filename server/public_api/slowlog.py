@@ -0,0 +1,199 @@
+# slowlog.py — opt-in slow-query log: profiles and EXPLAIN ANALYZE plans of slow or sampled queries
+from __future__ import annotations
+import collections, hashlib, json, logging, logging.handlers, queue, random, threading, time
+from contextvars import ContextVar
+
+import duckdb
+
+# Request (path?query) a query belongs to; set by get_conn so entries show the bbox/zoom asked for
+request_info: ContextVar[str | None] = ContextVar("slow_query_request", default=None)
+
+_active: "SlowQueryLog | None" = None
+
+
+def install(log: "SlowQueryLog | None") -> None:
+    global _active
+    _active = log
+
+
+def observe(sql: str, params, seconds: float) -> None:
+    """Called by the query helpers after each query; no-op unless a log is installed."""
+    if _active is not None:
+        _active.observe(sql, params, seconds)
+
+
+def _profileable(sql: str) -> bool:
+    head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    return head in ("SELECT", "WITH", "FROM")
+
+
+def plan_text(profile: dict) -> str:
+    """Indented operator tree of an EXPLAIN (ANALYZE, FORMAT JSON) profile, for reading in the log."""
+    lines: list[str] = []
+
+    def walk(node: dict, depth: int) -> None:
+        name = (node.get("operator_name") or "").strip()
+        if name and name != "EXPLAIN_ANALYZE":
+            lines.append(f"{'  ' * depth}{name}  rows={node.get('operator_cardinality', 0)}"
+                         f"  time={node.get('operator_timing', 0.0):.6f}s")
+            for key, value in (node.get("extra_info") or {}).items():
+                if isinstance(value, list):
+                    value = ", ".join(map(str, value))
+                lines.append(f"{'  ' * depth}    {key}: {value}")
+            depth += 1
+        for child in node.get("children") or []:
+            walk(child, depth)
+
+    walk(profile, 0)
+    return "\n".join(lines)
+
+
+class SlowQueryLog:
+    """
+    Queries slower than `threshold_ms`, plus a `sample` fraction of all queries, are
+    re-run once on a background cursor with EXPLAIN ANALYZE (JSON profile, plus a
+    text plan derived from it) and appended as JSON lines to a rotating log; the latest entries stay in memory
+    for /debug/slow_queries.
+
+    The capture re-executes the query, so it runs on one worker thread with a short
+    queue (excess captures are dropped) and the pool's background cursor (never a
+    request's slot), each statement is profiled at most once per `cooldown` seconds and
+    a capture running longer than `capture_timeout` is interrupted. Only read queries
+    (SELECT / WITH / FROM) are re-run.
+    """
+
+    def __init__(
+        self,
+        pool,
+        path: str,
+        threshold_ms: float = 0.0,
+        sample: float = 0.0,
+        max_bytes: int = 10 * 1024 * 1024,
+        backups: int = 3,
+        keep: int = 200,
+        cooldown: float = 60.0,
+        capture_timeout: float = 30.0,
+    ):
+        self.pool = pool
+        self.path = path
+        self.threshold = threshold_ms / 1000.0 if threshold_ms > 0 else None
+        self.sample = max(0.0, min(1.0, sample))
+        self.cooldown = cooldown
+        self.capture_timeout = capture_timeout
+        self._recent: collections.deque = collections.deque(maxlen=keep)
+        self._seen: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue(maxsize=8)
+        self.captured = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._logger = logging.getLogger(f"emsv.slow_queries.{id(self)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True
+        )
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        self._logger.addHandler(self._handler)
+        self._worker = threading.Thread(target=self._run, name="slow-query-log", daemon=True)
+        self._worker.start()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold is not None or self.sample > 0
+
+    def observe(self, sql: str, params, seconds: float) -> None:
+        slow = self.threshold is not None and seconds >= self.threshold
+        if not slow and not (self.sample and random.random() < self.sample):
+            return
+        if not _profileable(sql):
+            return
+        key = hashlib.sha1(sql.encode()).hexdigest()[:16]
+        now = time.monotonic()
+        with self._lock:
+            if now - self._seen.get(key, -self.cooldown) < self.cooldown:
+                return
+            self._seen[key] = now
+            if len(self._seen) > 4096:
+                cutoff = now - self.cooldown
+                self._seen = {k: t for k, t in self._seen.items() if t >= cutoff}
+        item = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "reason": "slow" if slow else "sample",
+            "seconds": round(seconds, 6),
+            "request": request_info.get(),
+            "sql_hash": key,
+            "sql": sql.strip(),
+            "params": list(params or ()),
+        }
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _profile(self, con: duckdb.DuckDBPyConnection, sql: str, params) -> tuple[dict | None, str]:
+        body = sql.strip().rstrip(";")
+        timer = threading.Timer(self.capture_timeout, con.interrupt)
+        timer.start()
+        try:
+            raw = con.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {body}", params).fetchall()[0][1]
+        finally:
+            timer.cancel()
+        try:
+            profile = json.loads(raw)
+        except ValueError:
+            return None, raw
+        return profile, plan_text(profile)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                con = self.pool.acquire(background=True)
+            except Exception as e:
+                item["error"] = f"sin cursor: {e}"
+                self.failed += 1
+                self._write(item)
+                continue
+            discard = False
+            try:
+                item["profile"], item["plan"] = self._profile(con, item["sql"], item["params"])
+                self.captured += 1
+            except duckdb.Error as e:
+                discard = not isinstance(e, duckdb.InterruptException)
+                item["error"] = str(e)
+                self.failed += 1
+            except Exception as e:
+                # e.g. an unexpected profile shape: record it, the worker must keep running
+                item["error"] = f"{type(e).__name__}: {e}"
+                self.failed += 1
+            finally:
+                self.pool.release(con, discard=discard)
+            self._write(item)
+
+    def _write(self, item: dict) -> None:
+        self._recent.append(item)
+        self._logger.info(json.dumps(item, ensure_ascii=False, default=str))
+
+    def recent(self, limit: int = 50) -> list[dict]:
+        return list(self._recent)[-limit:][::-1]
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "threshold_ms": self.threshold * 1000 if self.threshold is not None else None,
+            "sample": self.sample,
+            "captured": self.captured,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize(),
+        }
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._worker.join(timeout=self.capture_timeout)
+        self._logger.removeHandler(self._handler)
+        self._handler.close()
@@ -0,0 +1,60 @@
+# snapshot.py — cheap fingerprint of the warehouse file, used to invalidate derived caches
+from __future__ import annotations
+import hashlib, os, threading, time
+
+
+def warehouse_fingerprint(path: str) -> str:
+    """
+    Identifies one on-disk state of the warehouse: inode, size and mtime of the
+    database file and its WAL. Any ingest.py run changes at least one of them.
+    """
+    h = hashlib.sha1()
+    for p in (path, path + ".wal"):
+        try:
+            st = os.stat(p)
+        except FileNotFoundError:
+            h.update(b"-")
+            continue
+        h.update(f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()[:16]
+
+
+def file_identity(path: str) -> str:
+    """
+    Which file sits at `path` (device and inode): changes when ingest.py swaps in a new
+    warehouse, but not when this process writes to it (WAL appends, checkpoints).
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return "-"
+    return f"{st.st_dev}:{st.st_ino}"
+
+
+class WarehouseSnapshot:
+    """Throttled `warehouse_fingerprint` / `file_identity`: stats at most once every `check_every` seconds."""
+
+    def __init__(self, path: str, check_every: float = 1.0):
+        self.path = path
+        self.check_every = check_every
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._version = warehouse_fingerprint(path)
+        self._identity = file_identity(path)
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked >= self.check_every:
+            with self._lock:
+                if now - self._checked >= self.check_every:
+                    self._version = warehouse_fingerprint(self.path)
+                    self._identity = file_identity(self.path)
+                    self._checked = now
+
+    def version(self) -> str:
+        self._refresh()
+        return self._version
+
+    def identity(self) -> str:
+        self._refresh()
+        return self._identity
@@ -0,0 +1,93 @@
+# spatial.py — SQL fragments for bbox filtering shared by the API and the tile renderer
+from __future__ import annotations
+import math
+
+# Per-row WGS84 bbox added by derived.build_spatial_order, which also stores the rows
+# in Hilbert order so each row group covers a compact area
+BBOX_COLUMNS = ("xmin", "ymin", "xmax", "ymax")
+
+# Columns added by derived.py at ingestion; never exposed as feature properties nor exported
+DERIVED_COLUMNS = ("geom", "ref_key", "ref14", "geom_lod1", "geom_lod2", "footprint_m2", "geom_4326",
+                   "geom_25830") + BBOX_COLUMNS
+
+
+def _num(v: float) -> str:
+    v = float(v)
+    if not math.isfinite(v):
+        raise ValueError(f"coordenada no finita: {v}")
+    return repr(v)
+
+
+def envelope_sql(minx: float, miny: float, maxx: float, maxy: float, srid: int = 4326) -> str:
+    """
+    Constant envelope for a WGS84 bbox, reprojected to `srid` when needed.
+
+    Coordinates are inlined as float literals instead of `?` parameters: DuckDB's
+    RTREE scan only kicks in when the other side of ST_Intersects is a constant
+    expression, and prepared parameters are not folded at plan time.
+    """
+    env = f"ST_MakeEnvelope({_num(minx)}, {_num(miny)}, {_num(maxx)}, {_num(maxy)})"
+    if srid == 4326:
+        return env
+    return f"ST_Transform({env}, 'EPSG:4326', 'EPSG:{int(srid)}', TRUE)"
+
+
+def table_columns(con, table: str) -> tuple[str, ...]:
+    """Columns of `table` in declaration order (empty if there is no such table)."""
+    rows = con.execute("""
+        SELECT column_name FROM duckdb_columns()
+        WHERE schema_name = 'main' AND table_name = ?
+        ORDER BY column_index;
+    """, [table]).fetchall()
+    return tuple(r[0] for r in rows)
+
+
+def has_bbox_columns(columns) -> bool:
+    """True if a table with these columns carries BBOX_COLUMNS (older warehouses don't)."""
+    return set(BBOX_COLUMNS) <= {c.lower() for c in columns}
+
+
+def envelope_filter(
+    minx: float, miny: float, maxx: float, maxy: float,
+    geom: str = "geom",
+    srid: int = 4326,
+    bbox_columns: bool = False,
+) -> tuple[str, list]:
+    """
+    Predicate (without WHERE) for rows whose `geom` intersects a WGS84 bbox,
+    answerable from the table's RTREE index. For tables stored in another CRS
+    the envelope is reprojected, not the rows.
+
+    With `bbox_columns` the row's stored bbox is compared first (same table alias
+    as `geom`). Those are plain range filters DuckDB pushes into the scan, so row
+    groups whose min/max fall outside the bbox are skipped from their statistics.
+    """
+    where = f"ST_Intersects({geom}, {envelope_sql(minx, miny, maxx, maxy, srid)})"
+    if bbox_columns:
+        alias = geom[:geom.rfind(".") + 1]
+        where = (f"{alias}xmax >= {_num(minx)} AND {alias}xmin <= {_num(maxx)} AND "
+                 f"{alias}ymax >= {_num(miny)} AND {alias}ymin <= {_num(maxy)} AND {where}")
+    return where, []
+
+
+def geojson_bounds(geometry: dict) -> tuple[float, float, float, float] | None:
+    """minx, miny, maxx, maxy of a GeoJSON geometry (None if it has no coordinates)."""
+    xs: list[float] = []
+    ys: list[float] = []
+
+    def walk(c) -> None:
+        if isinstance(c, (list, tuple)) and c and isinstance(c[0], (int, float)):
+            xs.append(float(c[0]))
+            ys.append(float(c[1]))
+        elif isinstance(c, (list, tuple)):
+            for sub in c:
+                walk(sub)
+
+    if geometry.get("type") == "GeometryCollection":
+        for g in geometry.get("geometries") or []:
+            walk(g.get("coordinates"))
+    else:
+        walk(geometry.get("coordinates"))
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
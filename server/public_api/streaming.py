@@ -0,0 +1,301 @@
+# streaming.py — features assembled inside DuckDB and streamed in record batches
+# (GeoJSON / NDJSON text, Arrow IPC with GeoArrow WKB geometry, FlatGeobuf)
+from __future__ import annotations
+import json, os, tempfile, time
+from typing import Any, Callable, Iterator
+
+import duckdb
+import pyarrow as pa
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+import slowlog
+from metrics import add_rows, phase
+
+FORMATS = ("geojson", "ndjson", "arrow", "fgb")
+TEXT_FORMATS = ("geojson", "ndjson")
+BATCH_ROWS = 2048
+
+MEDIA_TYPES = {
+    "geojson": "application/geo+json",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "fgb": "application/flatgeobuf",
+}
+_ACCEPT = {**{v: k for k, v in MEDIA_TYPES.items()}, "application/json": "geojson"}
+
+_EMPTY_PROPS = "'{}'::JSON"
+
+# GeoArrow: WKB geometry in WGS84 lon/lat, declared through the field's extension metadata
+_GEOARROW_WKB = {
+    b"ARROW:extension:name": b"geoarrow.wkb",
+    b"ARROW:extension:metadata": b'{"crs":"OGC:CRS84"}',
+}
+
+
+def negotiate_format(accept: str | None) -> str:
+    """Output format for an Accept header (highest q first, GeoJSON if nothing matches)."""
+    ranked = []
+    for i, item in enumerate((accept or "").split(",")):
+        media, *opts = [p.strip() for p in item.split(";")]
+        q = 1.0
+        for opt in opts:
+            if opt.startswith("q="):
+                try:
+                    q = float(opt[2:])
+                except ValueError:
+                    q = 0.0
+        if media.lower() in _ACCEPT and q > 0:
+            ranked.append((-q, i, _ACCEPT[media.lower()]))
+    return min(ranked)[2] if ranked else "geojson"
+
+
+def feature_json(geom_expr: str, props_expr: str, precision: int | None = None) -> str:
+    """
+    SQL expression producing one serialized GeoJSON Feature per row. With `precision`,
+    coordinates are snapped to that many decimals first, so ST_AsGeoJSON prints short numbers.
+    """
+    if precision is not None:
+        geom_expr = f"ST_ReducePrecision({geom_expr}, {10.0 ** -int(precision)!r})"
+    return (
+        "json_object('type', 'Feature', "
+        f"'geometry', ST_AsGeoJSON({geom_expr})::JSON, "
+        f"'properties', to_json({props_expr}))::VARCHAR"
+    )
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def props_struct(columns: list[str], prefix: str = "") -> str:
+    """Struct literal {'col': col, ...} for the given column names."""
+    if not columns:
+        return _EMPTY_PROPS
+    parts = []
+    for c in columns:
+        key = c.replace("'", "''")
+        parts.append(f"'{key}': {prefix}{quote_ident(c)}")
+    return "{" + ", ".join(parts) + "}"
+
+
+def feature_select(fmt: str, geom_expr: str, props_expr: str, precision: int | None = None) -> str:
+    """
+    Select list for one feature per row in `fmt`: a serialized Feature for the text
+    formats, or a `geometry` column (WKB for Arrow, GEOMETRY for FlatGeobuf) followed
+    by the properties as plain columns for the binary ones.
+    """
+    if fmt in TEXT_FORMATS:
+        return feature_json(geom_expr, props_expr, precision)
+    if precision is not None:
+        geom_expr = f"ST_ReducePrecision({geom_expr}, {10.0 ** -int(precision)!r})"
+    geom = f"ST_AsWKB({geom_expr})" if fmt == "arrow" else geom_expr
+    props = "" if props_expr == _EMPTY_PROPS else f", unnest({props_expr})"
+    return f"{geom} AS geometry{props}"
+
+
+class _Page:
+    """
+    Tracks the page while it streams: rows seen and the key (last column) of the
+    last one, from which the next cursor is made once the page is full.
+    """
+
+    def __init__(self, limit: int | None, make_cursor: Callable[[Any], str] | None):
+        self.limit = limit
+        self.make_cursor = make_cursor
+        self.rows = 0
+        self.last_key = None
+        self.query: tuple[str, Any] | None = None   # (sql, params), for the slow-query log
+        self.seconds = 0.0                          # time spent in DuckDB so far
+
+    def batches(self, reader: pa.RecordBatchReader) -> Iterator[list[str]]:
+        batches = iter(reader)
+        while True:
+            t0 = time.perf_counter()
+            with phase("fetch"):
+                batch = next(batches, None)
+            self.seconds += time.perf_counter() - t0
+            if batch is None:
+                if self.query is not None:
+                    slowlog.observe(*self.query, self.seconds)
+                return
+            if batch.num_rows:
+                self.rows += batch.num_rows
+                add_rows(batch.num_rows)
+                if self.make_cursor is not None:
+                    self.last_key = batch.column(batch.num_columns - 1)[-1].as_py()
+                yield batch
+
+    def next_cursor(self) -> str | None:
+        if self.make_cursor is None or self.limit is None or self.rows < self.limit:
+            return None
+        return self.make_cursor(self.last_key)
+
+
+def _feature_collection(reader: pa.RecordBatchReader, page: _Page) -> Iterator[bytes]:
+    yield b'{"type":"FeatureCollection","features":['
+    first = True
+    for batch in page.batches(reader):
+        chunk = ",".join(batch.column(0).to_pylist())
+        yield (chunk if first else "," + chunk).encode()
+        first = False
+    if page.make_cursor is None:
+        yield b"]}"
+    else:
+        yield ('],"next_cursor":' + json.dumps(page.next_cursor()) + "}").encode()
+
+
+def _ndjson(reader: pa.RecordBatchReader, page: _Page) -> Iterator[bytes]:
+    for batch in page.batches(reader):
+        yield ("\n".join(batch.column(0).to_pylist()) + "\n").encode()
+    if page.make_cursor is not None:
+        # last line carries the page cursor (null on the last page)
+        yield (json.dumps({"next_cursor": page.next_cursor()}) + "\n").encode()
+
+
+class _Chunks:
+    """Write-only file for the IPC writer; bytes are handed out as they are written."""
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _arrow(reader: pa.RecordBatchReader, page: _Page) -> Iterator[bytes]:
+    """
+    Arrow IPC stream of DuckDB's record batches as they come (no per-row Python work).
+    The page key column is dropped; with paging, a final empty batch carries
+    `next_cursor` in its custom metadata.
+    """
+    keep = len(reader.schema) - (1 if page.make_cursor is not None else 0)
+    fields = [reader.schema.field(i) for i in range(keep)]
+    fields[0] = fields[0].with_metadata(_GEOARROW_WKB)
+    schema = pa.schema(fields)
+    sink = _Chunks()
+    writer = pa.ipc.new_stream(sink, schema)
+    yield sink.take()
+    for batch in page.batches(reader):
+        writer.write_batch(pa.RecordBatch.from_arrays(batch.columns[:keep], schema=schema))
+        yield sink.take()
+    if page.make_cursor is not None:
+        writer.write_batch(pa.RecordBatch.from_pylist([], schema=schema),
+                           custom_metadata={"next_cursor": page.next_cursor() or ""})
+    writer.close()
+    yield sink.take()
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _flatgeobuf(
+    con: duckdb.DuckDBPyConnection, sql: str, params, page: _Page
+) -> tuple[Iterator[bytes], str | None, Callable[[], None]]:
+    """
+    FlatGeobuf through the spatial extension's GDAL writer, which needs a file: the
+    page is materialized in a temp table, written to a temp .fgb and streamed from
+    disk. The whole page is known first, so the next cursor goes in a header.
+
+    The temp table is dropped before this returns (a cursor that cannot drop it fails
+    with a DuckDB error and is discarded). The file is opened and unlinked at once, so
+    it lives only as long as the open handle: a body that never starts (client gone
+    before the first chunk) has no finally to run. The returned cleanup, run as the
+    response's background task, closes the handle (and removes the file where an open
+    file cannot be unlinked).
+    """
+    keyed = page.make_cursor is not None
+    fd, path = tempfile.mkstemp(suffix=".fgb")
+    os.close(fd)
+    os.unlink(path)  # GDAL refuses to overwrite
+    try:
+        try:
+            con.execute(f"CREATE OR REPLACE TEMP TABLE _fgb_page AS {sql.strip().rstrip(';')}", params)
+            cols = "* EXCLUDE (_k)" if keyed else "*"
+            order = "ORDER BY _k" if keyed else ""
+            con.execute(f"""
+                COPY (SELECT {cols} FROM _fgb_page {order}) TO '{path}'
+                WITH (FORMAT GDAL, DRIVER 'FlatGeobuf', SRS 'EPSG:4326');
+            """)
+            if keyed:
+                page.rows, page.last_key = con.execute("SELECT COUNT(*), MAX(_k) FROM _fgb_page").fetchone()
+        finally:
+            con.execute("DROP TABLE IF EXISTS _fgb_page;")
+    except BaseException:
+        _unlink(path)
+        raise
+    f = open(path, "rb")
+    _unlink(path)
+
+    def body() -> Iterator[bytes]:
+        with f:
+            while chunk := f.read(1 << 16):
+                yield chunk
+
+    def cleanup() -> None:
+        f.close()
+        _unlink(path)
+
+    return body(), page.next_cursor(), cleanup
+
+
+def stream_features(
+    con: duckdb.DuckDBPyConnection,
+    sql: str,
+    params: list | tuple = (),
+    fmt: str = "geojson",
+    limit: int | None = None,
+    make_cursor: Callable[[Any], str] | None = None,
+) -> StreamingResponse:
+    """
+    Run `sql` (select list from `feature_select` for the same `fmt`) and stream the
+    rows as a FeatureCollection, NDJSON or Arrow IPC while DuckDB is still producing
+    them; FlatGeobuf is written whole first.
+
+    With `make_cursor`, the last column is the page's ordering key: a full page
+    (`limit` rows) ends with `next_cursor` built from the last key, otherwise null
+    (Arrow: metadata of the last batch; FlatGeobuf: X-Next-Cursor header).
+    """
+    if fmt not in FORMATS:
+        raise HTTPException(400, f"format debe ser uno de {', '.join(FORMATS)}")
+    page = _Page(limit, make_cursor)
+    headers = {"Vary": "Accept"}
+    background = None
+    t0 = time.perf_counter()
+    try:
+        if fmt == "fgb":
+            with phase("query"):
+                body, cursor, cleanup = _flatgeobuf(con, sql, params, page)
+            background = BackgroundTask(cleanup)
+            slowlog.observe(sql, params, time.perf_counter() - t0)
+            add_rows(page.rows)
+            if cursor:
+                headers["X-Next-Cursor"] = cursor
+        else:
+            with phase("query"):
+                reader = con.execute(sql, params).fetch_record_batch(BATCH_ROWS)
+            page.query, page.seconds = (sql, params), time.perf_counter() - t0
+            body = {"geojson": _feature_collection, "ndjson": _ndjson, "arrow": _arrow}[fmt](reader, page)
+    except duckdb.InterruptException as e:
+        raise HTTPException(499, "Petición cancelada por el cliente") from e
+    except duckdb.Error as e:
+        raise HTTPException(500, f"DuckDB error: {e}") from e
+    return StreamingResponse(body, media_type=MEDIA_TYPES[fmt], headers=headers, background=background)
@@ -0,0 +1,194 @@
+# tiles.py — Mapbox Vector Tiles rendered by the DuckDB spatial extension (ST_AsMVT)
+from __future__ import annotations
+import math, os, sqlite3, threading
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+import duckdb
+
+from spatial import envelope_filter, has_bbox_columns
+
+MVT_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+MVT_EXTENT = 4096   # quantization grid per tile side
+MVT_BUFFER = 64     # pixels kept around the tile edge so strokes don't show seams
+MAX_ZOOM = 22
+
+_MERC = 20037508.342789244
+
+
+@dataclass(frozen=True)
+class TileLayer:
+    source: str              # table name or parenthesized subquery exposing `geom`
+    srid: int                # CRS of `geom` in the source
+    properties: tuple[str, ...]
+    minzoom: int = 0
+    wgs84: str | None = None  # WGS84 copy of `geom` (derived.build_wgs84_copies), used when present
+
+
+TILE_LAYERS: dict[str, TileLayer] = {
+    "buildings": TileLayer("buildings", 4326, ("reference",), minzoom=13),
+    "shadows": TileLayer("shadows", 4326, ("shadow_count",), minzoom=14),
+    "irr_points": TileLayer("irr_points", 25830, ("value",), minzoom=16, wgs84="geom_4326"),
+    "cels": TileLayer(
+        "cels_points",
+        4326,
+        ("id", "nombre", "reference", "auto_CEL", "por_ocupacion"),
+        minzoom=11,
+    ),
+}
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int) -> tuple[int, int]:
+    n = 1 << z
+    lat = max(min(lat, 85.0511287798), -85.0511287798)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds_mercator(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    size = 2 * _MERC / (1 << z)
+    minx = -_MERC + x * size
+    maxy = _MERC - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tile_bounds_lonlat(z: int, x: int, y: int, pad: float = 0.0) -> tuple[float, float, float, float]:
+    """WGS84 bounds of a tile, optionally grown by `pad` (fraction of the tile side)."""
+    n = 1 << z
+
+    def lon(xx: float) -> float:
+        return xx / n * 360.0 - 180.0
+
+    def lat(yy: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * yy / n))))
+
+    return lon(x - pad), lat(y + 1 + pad), lon(x + 1 + pad), lat(y - pad)
+
+
+def render_tile(
+    con: duckdb.DuckDBPyConnection, layer: str, z: int, x: int, y: int, columns: Iterable[str] = ()
+) -> bytes:
+    """
+    Encode one tile of `layer`; returns b"" when the tile is empty or below the layer's minzoom.
+    `columns` are the source's columns (spatial.table_columns): the WGS84 copy and the
+    spatial.BBOX_COLUMNS prefilter are used when the warehouse has them.
+    """
+    spec = TILE_LAYERS[layer]
+    if z < spec.minzoom:
+        return b""
+
+    columns = {c.lower() for c in columns}
+    geom, srid = (spec.wgs84, 4326) if spec.wgs84 and spec.wgs84 in columns else ("geom", spec.srid)
+    where, params = envelope_filter(
+        *tile_bounds_lonlat(z, x, y, pad=MVT_BUFFER / MVT_EXTENT), geom=geom, srid=srid,
+        bbox_columns=has_bbox_columns(columns),
+    )
+    geom_3857 = geom if srid == 3857 else f"ST_Transform({geom}, 'EPSG:{srid}', 'EPSG:3857', TRUE)"
+    cols = "".join(f", {p}" for p in spec.properties)
+    props = "".join(f", '{p}': {p}" for p in spec.properties)
+
+    row = con.execute(f"""
+        WITH f AS (
+          SELECT ST_AsMVTGeom(
+                   {geom_3857},
+                   ST_Extent(ST_MakeEnvelope(?, ?, ?, ?)),
+                   {MVT_EXTENT}, {MVT_BUFFER}, TRUE
+                 ) AS mvt_geom
+                 {cols}
+          FROM {spec.source} src
+          WHERE {where}
+        )
+        SELECT ST_AsMVT({{'geom': mvt_geom{props}}}, '{layer}', {MVT_EXTENT}, 'geom')
+        FROM f
+        WHERE mvt_geom IS NOT NULL;
+    """, [*tile_bounds_mercator(z, x, y), *params]).fetchone()
+    return bytes(row[0]) if row and row[0] else b""
+
+
+# ============================================================
+# PRE-RENDERED TILE STORE (MBTiles-style SQLite)
+# ============================================================
+
+def default_store_path(db_path: str) -> str:
+    return os.path.splitext(db_path)[0] + ".tiles.mbtiles"
+
+
+class TileStore:
+    """
+    SQLite file holding rendered tiles for every layer, stamped with the warehouse
+    fingerprint they were rendered from. When `version()` no longer matches the
+    stamp the tiles are dropped, so a stale pyramid is never served.
+
+    Empty tiles are stored as zero-length blobs: a hit on b"" means "known empty".
+    Rows use XYZ numbering (tile_row is the XYZ y, not the flipped TMS row).
+    """
+
+    def __init__(self, path: str, version: Callable[[], str]):
+        self.path = path
+        self._version = version
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL;")
+        self._db.execute("PRAGMA synchronous=NORMAL;")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS tiles (
+              layer TEXT, zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB,
+              PRIMARY KEY (layer, zoom_level, tile_column, tile_row)
+            ) WITHOUT ROWID;
+        """)
+        self._db.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);")
+        self._stamp = self._read_stamp()
+
+    def _read_stamp(self) -> str | None:
+        row = self._db.execute("SELECT value FROM metadata WHERE name='warehouse_fingerprint'").fetchone()
+        return row[0] if row else None
+
+    def _ensure_current(self) -> str:
+        current = self._version()
+        if current != self._stamp:
+            with self._lock:
+                # another worker may already have reset it
+                self._stamp = self._read_stamp()
+                if current != self._stamp:
+                    self._db.execute("BEGIN IMMEDIATE")
+                    self._db.execute("DELETE FROM tiles")
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO metadata VALUES ('warehouse_fingerprint', ?)", [current]
+                    )
+                    self._db.execute("COMMIT")
+                    self._stamp = current
+        return current
+
+    def get(self, layer: str, z: int, x: int, y: int) -> bytes | None:
+        self._ensure_current()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT tile_data FROM tiles WHERE layer=? AND zoom_level=? AND tile_column=? AND tile_row=?",
+                [layer, z, x, y],
+            ).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def put_many(self, items: list[tuple[str, int, int, int, bytes]], version: str | None = None) -> None:
+        """Store rendered tiles; skipped if the warehouse changed since `version` was read."""
+        current = self._ensure_current()
+        if version is not None and version != current:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?)", items)
+            self._db.execute("COMMIT")
+
+    def put(self, layer: str, z: int, x: int, y: int, data: bytes, version: str | None = None) -> None:
+        self.put_many([(layer, z, x, y, data)], version)
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
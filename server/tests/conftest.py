@@ -0,0 +1,4 @@
+# conftest.py — the API modules import each other as top-level modules (run from public_api/)
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "public_api"))
@@ -0,0 +1,109 @@
+import asyncio, json, time
+
+from admission import AdmissionMiddleware, EndpointClass
+
+
+def _scope(path: str) -> dict:
+    return {"type": "http", "method": "GET", "path": path, "headers": [], "state": {}}
+
+
+async def _call(app, path: str) -> tuple[int, dict]:
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(msg):
+        sent.append(msg)
+
+    await app(_scope(path), receive, send)
+    start = next(m for m in sent if m["type"] == "http.response.start")
+    return start["status"], dict(start["headers"])
+
+
+def _stack(spec: str):
+    """An admission-limited endpoint that holds its slot until `gate` is set."""
+    gate = asyncio.Event()
+    seen: list[dict] = []
+
+    async def endpoint(scope, receive, send):
+        seen.append(scope)
+        await gate.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    limits = {"features": EndpointClass.parse("features", spec)}
+    app = AdmissionMiddleware(endpoint, limits, {"/features": "features", "/tiles/": "features"})
+    return app, gate, seen, limits["features"]
+
+
+def test_parse():
+    c = EndpointClass.parse("tiles", "4, 16, 2.5, 30")
+    assert (c.concurrency, c.queue, c.max_wait, c.deadline) == (4, 16, 2.5, 30.0)
+    assert c.retry_after == 3
+
+
+def test_full_queue_is_rejected_with_429():
+    async def main():
+        app, gate, _, limit = _stack("1,1,5,30")
+        running = asyncio.create_task(_call(app, "/features"))
+        queued = asyncio.create_task(_call(app, "/features"))
+        await asyncio.sleep(0.05)
+        status, headers = await _call(app, "/features")
+        gate.set()
+        assert [s for s, _ in await asyncio.gather(running, queued)] == [200, 200]
+        return status, headers, limit
+
+    status, headers, limit = asyncio.run(main())
+    assert status == 429
+    assert headers[b"retry-after"] == b"5"
+    assert limit.rejected_queue == 1 and limit.admitted == 2 and limit.running == 0
+
+
+def test_wait_beyond_max_wait_is_503():
+    async def main():
+        app, gate, _, limit = _stack("1,4,0.1,30")
+        running = asyncio.create_task(_call(app, "/features"))
+        await asyncio.sleep(0.01)
+        status, _ = await _call(app, "/features")
+        gate.set()
+        await running
+        return status, limit
+
+    status, limit = asyncio.run(main())
+    assert status == 503
+    assert limit.rejected_wait == 1 and limit.waiting == 0
+
+
+def test_deadline_and_prefix_routes():
+    async def main():
+        app, gate, seen, _ = _stack("2,0,1,30")
+        gate.set()
+        t0 = time.monotonic()
+        assert (await _call(app, "/tiles/buildings/15/1/2.mvt"))[0] == 200
+        assert (await _call(app, "/other"))[0] == 200
+        return seen, t0
+
+    seen, t0 = asyncio.run(main())
+    assert t0 + 29 < seen[0]["state"]["deadline"] <= time.monotonic() + 30
+    assert "deadline" not in seen[1]["state"]  # unmapped paths are not limited
+
+
+def test_rejection_body_is_json():
+    async def main():
+        app, gate, _, _ = _stack("1,0,1,30")
+        running = asyncio.create_task(_call(app, "/features"))
+        await asyncio.sleep(0.01)
+        sent = []
+
+        async def send(msg):
+            sent.append(msg)
+
+        await app(_scope("/features"), None, send)
+        gate.set()
+        await running
+        return sent
+
+    sent = asyncio.run(main())
+    assert sent[0]["status"] == 429
+    assert json.loads(sent[1]["body"])["detail"]
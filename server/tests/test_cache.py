@@ -0,0 +1,74 @@
+import asyncio, math
+
+import pytest
+
+from cache import ConditionalMiddleware, _etag_matches, snap_bbox
+
+
+def _parts(bbox: str) -> list[float]:
+    return [float(v) for v in bbox.split(",")]
+
+
+def test_snap_bbox_grows_outwards_to_grid():
+    assert snap_bbox("-3.7301,40.3001,-3.7199,40.3099", 0.01) == "-3.74,40.3,-3.71,40.31"
+
+
+def test_snap_bbox_contains_original():
+    bbox = "-3.73215,40.30112,-3.71987,40.30977"
+    minx, miny, maxx, maxy = _parts(bbox)
+    sminx, sminy, smaxx, smaxy = _parts(snap_bbox(bbox, 0.001))
+    assert sminx <= minx and sminy <= miny and smaxx >= maxx and smaxy >= maxy
+
+
+def test_snap_bbox_is_a_stable_key():
+    # nearby viewports share a key; snapping a snapped bbox changes nothing
+    a = snap_bbox("-3.7301,40.3001,-3.7199,40.3099", 0.01)
+    b = snap_bbox("-3.7305,40.3004,-3.7192,40.3091", 0.01)
+    assert a == b
+    assert snap_bbox(a, 0.01) == a
+
+
+def test_snap_bbox_keeps_aligned_values_and_float_noise_out():
+    out = snap_bbox("0.3,0.1,0.7,0.9", 0.1)
+    assert out == "0.3,0.1,0.7,0.9"
+    assert all(len(v) < 12 for v in out.split(","))
+
+
+@pytest.mark.parametrize("bbox", ["1,2,3", "a,b,c,d", "nan,0,1,1", f"0,0,{math.inf},1"])
+def test_snap_bbox_leaves_invalid_input_to_the_endpoint(bbox):
+    assert snap_bbox(bbox, 0.01) == bbox
+
+
+def test_etag_matches_list_and_weak_tags():
+    assert _etag_matches('"a", "b"', '"b"')
+    assert _etag_matches('W/"b"', '"b"')
+    assert not _etag_matches('"a"', '"b"')
+
+
+def test_etag_star_does_not_match():
+    assert not _etag_matches("*", '"b"')
+
+
+def _conditional(if_none_match: bytes | None):
+    async def endpoint(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    app = ConditionalMiddleware(endpoint, version=lambda: "v1", cache_control="public, no-cache",
+                                variant=lambda scope: "gzip", vary="Accept-Encoding")
+    headers = [(b"if-none-match", if_none_match)] if if_none_match else []
+    sent = []
+
+    async def send(msg):
+        sent.append(msg)
+
+    asyncio.run(app({"type": "http", "method": "GET", "path": "/a", "headers": headers}, None, send))
+    return app, sent[0]
+
+
+def test_304_and_200_carry_the_variant_header_in_vary():
+    app, start = _conditional(None)
+    headers = dict(start["headers"])
+    assert start["status"] == 200 and headers[b"vary"] == b"Accept-Encoding"
+    _, start = _conditional(headers[b"etag"])
+    assert start["status"] == 304 and dict(start["headers"])[b"vary"] == b"Accept-Encoding"
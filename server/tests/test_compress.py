@@ -0,0 +1,86 @@
+import asyncio, gzip, threading
+
+import pytest
+
+from compress import ENCODERS, OFFLOAD_SIZE, CompressionMiddleware, _Gzip, merge_vary, negotiate_encoding
+
+
+@pytest.mark.parametrize("header", [None, "", "identity", "deflate", "gzip;q=0"])
+def test_negotiate_encoding_identity(header):
+    assert negotiate_encoding(header) == "identity"
+
+
+def test_negotiate_encoding_gzip():
+    assert negotiate_encoding("gzip") == "gzip"
+    assert negotiate_encoding("GZIP;q=0.5, deflate") == "gzip"
+
+
+def test_negotiate_encoding_prefers_higher_q_then_server_order():
+    both = [n for n in ENCODERS if n != "gzip"]
+    if not both:
+        pytest.skip("only gzip available")
+    other = both[0]
+    assert negotiate_encoding(f"gzip;q=1, {other};q=0.5") == "gzip"
+    assert negotiate_encoding(f"gzip, {other}") == next(iter(ENCODERS))
+
+
+def test_negotiate_encoding_wildcard():
+    assert negotiate_encoding("*") == next(iter(ENCODERS))
+    assert negotiate_encoding("*, gzip;q=0") in [n for n in ENCODERS if n != "gzip"] + ["identity"]
+
+
+def _run(app, accept_encoding: str | None, method: str = "GET") -> tuple[dict, bytes]:
+    headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding else []
+    scope = {"type": "http", "method": method, "path": "/features", "headers": headers}
+    sent = []
+
+    async def send(msg):
+        sent.append(msg)
+
+    asyncio.run(app(scope, None, send))
+    return sent[0], b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def _endpoint(chunks: list[bytes], status: int = 200, ctype: bytes = b"application/geo+json"):
+    async def endpoint(scope, receive, send):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", ctype), (b"vary", b"Accept")]})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+    return endpoint
+
+
+@pytest.mark.parametrize("accept_encoding, status, method", [
+    (None, 200, "GET"), ("gzip", 200, "GET"), ("gzip", 404, "GET"), ("gzip", 200, "HEAD"),
+])
+def test_every_response_varies_on_accept_encoding(accept_encoding, status, method):
+    start, _ = _run(CompressionMiddleware(_endpoint([b"x" * 10], status)), accept_encoding, method)
+    assert dict(start["headers"])[b"vary"] == b"Accept, Accept-Encoding"
+
+
+def test_excluded_paths_are_untouched():
+    app = CompressionMiddleware(_endpoint([b"x" * 5000]), exclude=("/features",))
+    start, body = _run(app, "gzip")
+    assert dict(start["headers"])[b"vary"] == b"Accept" and body == b"x" * 5000
+
+
+def test_large_chunks_are_compressed_off_the_event_loop(monkeypatch):
+    threads = []
+
+    class Recording(_Gzip):
+        def chunk(self, data):
+            threads.append(threading.current_thread() is threading.main_thread())
+            return super().chunk(data)
+
+    monkeypatch.setitem(ENCODERS, "gzip", (Recording, 6))
+    chunks = [b"a" * 100, b"b" * OFFLOAD_SIZE, b"c" * 100]
+    start, body = _run(CompressionMiddleware(_endpoint(chunks)), "gzip")
+    assert dict(start["headers"])[b"content-encoding"] == b"gzip"
+    assert gzip.decompress(body) == b"".join(chunks)
+    assert threads == [True, False, True]
+
+
+def test_merge_vary_adds_once():
+    assert merge_vary([], b"Accept-Encoding") == [(b"vary", b"Accept-Encoding")]
+    once = merge_vary([(b"Vary", b"Accept")], b"Accept-Encoding")
+    assert merge_vary(list(once), b"accept-encoding") == [(b"Vary", b"Accept, Accept-Encoding")]
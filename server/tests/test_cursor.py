@@ -0,0 +1,60 @@
+import os
+
+import pytest
+from fastapi import HTTPException
+
+os.environ.setdefault("DUCKDB_PATH", os.path.join(os.path.dirname(__file__), "missing.duckdb"))
+os.environ.setdefault("TILE_STORE", "false")
+import app  # noqa: E402
+
+
+class _Version:
+    def __init__(self, value: str):
+        self.value = value
+
+    def version(self) -> str:
+        return self.value
+
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    v = _Version("v1")
+    monkeypatch.setattr(app, "SNAPSHOT", v)
+    return v
+
+
+def test_round_trip(snapshot):
+    for key in (0, 1, 122_880, 2**40):
+        assert app.decode_cursor(app.encode_cursor(key)) == key
+
+
+def test_token_is_url_safe_without_padding(snapshot):
+    token = app.encode_cursor(12345)
+    assert "=" not in token and "+" not in token and "/" not in token
+
+
+def test_no_cursor_means_first_page(snapshot):
+    assert app.decode_cursor(None) is None
+    assert app.decode_cursor("") is None
+
+
+def test_cursor_from_another_warehouse_is_rejected(snapshot):
+    token = app.encode_cursor(10)
+    snapshot.value = "v2"
+    with pytest.raises(HTTPException) as e:
+        app.decode_cursor(token)
+    assert e.value.status_code == 409
+
+
+@pytest.mark.parametrize("token", ["not-base64!", "e30", "WyJ2MSJd", "WyJ2MSIsICJ4Il0"])
+def test_garbage_is_a_400(snapshot, token):
+    with pytest.raises(HTTPException) as e:
+        app.decode_cursor(token)
+    assert e.value.status_code == 400
+
+
+def test_after_cursor_inlines_keyset_condition(snapshot):
+    token = app.encode_cursor(42)
+    assert app.after_cursor("", "rowid", token) == "WHERE rowid > 42"
+    assert app.after_cursor("WHERE a = 1", "rowid", token) == "WHERE a = 1 AND rowid > 42"
+    assert app.after_cursor("WHERE a = 1", "rowid", None) == "WHERE a = 1"
@@ -0,0 +1,38 @@
+import json, os
+
+import duckdb
+
+from exports import export_snapshot, read_manifest
+
+
+def _con():
+    con = duckdb.connect()
+    # an attribute layer: exported without the spatial extension
+    con.execute("CREATE TABLE edificios_metrics AS SELECT range AS id, range * 2 AS kwh, 'x' AS ref_key FROM range(5)")
+    return con
+
+
+def test_export_writes_manifest_without_derived_columns(tmp_path):
+    con = _con()
+    manifest = export_snapshot(con, str(tmp_path), "v1", ["edificios_metrics"])
+    assert manifest["layers"]["edificios_metrics"]["rows"] == 5
+    path = os.path.join(tmp_path, "v1", "edificios_metrics.parquet")
+    assert [r[0] for r in con.execute(f"DESCRIBE SELECT * FROM '{path}'").fetchall()] == ["id", "kwh"]
+    assert read_manifest(str(tmp_path), "v1") == manifest
+    assert json.load(open(tmp_path / "latest.json"))["version"] == "v1"
+
+
+def test_existing_version_is_kept(tmp_path):
+    con = _con()
+    first = export_snapshot(con, str(tmp_path), "v1", ["edificios_metrics"])
+    con.execute("INSERT INTO edificios_metrics SELECT 9, 9, 'x'")
+    assert export_snapshot(con, str(tmp_path), "v1", ["edificios_metrics"]) == first
+
+
+def test_version_without_manifest_is_rebuilt(tmp_path):
+    con = _con()
+    export_snapshot(con, str(tmp_path), "v1", ["edificios_metrics"])
+    os.remove(tmp_path / "v1" / "manifest.json")
+    manifest = export_snapshot(con, str(tmp_path), "v1", ["edificios_metrics"])
+    assert manifest["layers"]["edificios_metrics"]["rows"] == 5
+    assert read_manifest(str(tmp_path), "v1") == manifest
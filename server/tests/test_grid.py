@@ -0,0 +1,115 @@
+import math, random
+
+import duckdb
+import pytest
+
+import grid
+
+
+@pytest.fixture(scope="module")
+def con():
+    c = duckdb.connect()
+    rng = random.Random(7)
+    pts = [(rng.uniform(-3.75, -3.65), rng.uniform(40.28, 40.34), rng.random()) for _ in range(20_000)]
+    c.execute("CREATE TABLE p (x DOUBLE, y DOUBLE, v DOUBLE)")
+    c.executemany("INSERT INTO p VALUES (?, ?, ?)", pts)
+    return c
+
+
+def test_cell_size_square_on_screen_at_reference_latitude():
+    dx, dy = grid.cell_size(14)
+    assert dx == pytest.approx(360 / 2**14 * grid.CELL_PX / 256)
+    assert dy == pytest.approx(dx * math.cos(math.radians(grid.GRID_REF_LAT)))
+    assert grid.cell_size(15)[0] == pytest.approx(dx / 2)
+
+
+def test_snap_bounds_covers_bbox():
+    dx, dy = grid.cell_size(14)
+    bounds = [-3.7201, 40.3003, -3.7102, 40.3097]
+    cx0, cy0, cx1, cy1 = grid.snap_bounds(bounds, dx, dy)
+    assert cx0 * dx <= bounds[0] < (cx0 + 1) * dx
+    assert cy0 * dy <= bounds[1] < (cy0 + 1) * dy
+    assert cx1 * dx <= bounds[2] < (cx1 + 1) * dx
+    assert cy1 * dy <= bounds[3] < (cy1 + 1) * dy
+
+
+def test_square_cells_count_every_point_once(con):
+    dx, dy = grid.cell_size(13)
+    rows = con.execute(grid.square_cells_sql("SELECT x, y, v FROM p", "v", dx, dy)).fetchall()
+    assert sum(r[2] for r in rows) == 20_000
+    for cx, cy, n, mean, vmin, vmax in rows[:50]:
+        inside = con.execute(
+            f"SELECT COUNT(*), MIN(v), MAX(v) FROM p WHERE x >= {cx * dx!r} AND x < {(cx + 1) * dx!r}"
+            f" AND y >= {cy * dy!r} AND y < {(cy + 1) * dy!r}").fetchone()
+        assert inside == (n, vmin, vmax)
+
+
+def _hex_center(cx: int, cy: int, dx: float, dy: float) -> tuple[float, float]:
+    s = dx / math.sqrt(3)
+    return s * math.sqrt(3) * (cx + cy / 2), s * 1.5 * cy / (dx / dy)
+
+
+def test_hex_cells_assign_the_nearest_centre(con):
+    dx, dy = grid.cell_size(14)
+    k = dx / dy
+    sql = f"""
+        WITH pts AS (SELECT x, y FROM p LIMIT 2000),
+        cells AS ({grid.hex_cells_sql("SELECT x, y FROM pts", None, dx, dy)})
+        SELECT cx, cy, n FROM cells
+    """
+    rows = con.execute(sql).fetchall()
+    assert sum(r[2] for r in rows) == 2000
+    # every point's hexagon is the one whose centre is nearest on screen (y scaled by dx/dy)
+    centres = [_hex_center(cx, cy, dx, dy) for cx, cy, _ in rows]
+    for x, y in con.execute("SELECT x, y FROM p LIMIT 200").fetchall():
+        best = min(range(len(centres)), key=lambda i: (centres[i][0] - x) ** 2 + ((centres[i][1] - y) * k) ** 2)
+        cx, cy = rows[best][:2]
+        got = con.execute(f"SELECT cx, cy FROM ({grid.hex_cells_sql(f'SELECT {x!r} AS x, {y!r} AS y', None, dx, dy)})"
+                          ).fetchone()
+        assert got == (cx, cy)
+
+
+def test_hex_cells_at_bbox_edge_are_complete(con):
+    """With the padding grid_features uses, returned hexagons hold all their points."""
+    for zoom in (13, 14, 15):
+        dx, dy = grid.cell_size(zoom)
+        bounds = [-3.72, 40.30, -3.705, 40.309]
+        c = grid.snap_bounds(bounds, dx, dy)
+        pts = (f"SELECT x, y FROM p WHERE x BETWEEN {(c[0] - 2) * dx!r} AND {(c[2] + 3) * dx!r}"
+               f" AND y BETWEEN {(c[1] - 2) * dy!r} AND {(c[3] + 3) * dy!r}")
+        centres = ((c[0] - 1) * dx, (c[1] - 1) * dy, (c[2] + 2) * dx, (c[3] + 2) * dy)
+        part = {(a, b): n for a, b, n, *_ in con.execute(grid.hex_cells_sql(pts, None, dx, dy, centres)).fetchall()}
+        full = {(a, b): n for a, b, n, *_ in con.execute(grid.hex_cells_sql("SELECT x, y FROM p", None, dx, dy)).fetchall()}
+        assert part and all(full[key] == n for key, n in part.items())
+        inview = (f"SELECT x, y FROM p WHERE x BETWEEN {bounds[0]} AND {bounds[2]}"
+                  f" AND y BETWEEN {bounds[1]} AND {bounds[3]}")
+        needed = {(a, b) for a, b, *_ in con.execute(grid.hex_cells_sql(inview, None, dx, dy)).fetchall()}
+        assert needed <= set(part)
+
+
+def test_precomputed_mean_ignores_nulls_like_the_live_path():
+    c = duckdb.connect()
+    c.execute("CREATE TABLE p AS SELECT * FROM (VALUES (0.1, 0.1, 2.0), (0.2, 0.2, NULL), (0.3, 0.3, 4.0),"
+              " (5.1, 0.1, NULL)) t(x, y, v)")
+    dx = dy = 1.0
+    live = grid.square_cells_sql("SELECT x, y, v FROM p", "v", dx, dy)
+    c.execute(f"""
+        CREATE TABLE grid_cells AS
+        SELECT 'p' AS layer, 10 AS z, {dx} AS dx, {dy} AS dy, cx, cy,
+               n, COUNT(v) AS nv, SUM(v) AS total, MIN(v) AS vmin, MAX(v) AS vmax
+        FROM (SELECT CAST(floor(x / {dx}) AS BIGINT) AS cx, CAST(floor(y / {dy}) AS BIGINT) AS cy,
+                     COUNT(*) OVER (PARTITION BY cx, cy) AS n, v FROM p)
+        GROUP BY ALL
+    """)
+    assert grid.has_level(c, "p", 10, dx)
+    pre = c.execute(grid.precomputed_cells_sql("p", 10, (0, 0, 5, 0)) + " ORDER BY cx").fetchall()
+    assert pre == c.execute(live + " ORDER BY cx").fetchall()
+    assert pre[0][2:4] == (3, 3.0) and pre[1][3] is None
+
+
+def test_grid_cells_without_non_null_counts_are_not_used():
+    c = duckdb.connect()
+    c.execute("CREATE TABLE grid_cells (layer VARCHAR, z INTEGER, dx DOUBLE, n BIGINT, total DOUBLE)")
+    c.execute("INSERT INTO grid_cells VALUES ('p', 10, 1.0, 1, 1.0)")
+    assert not grid.has_level(c, "p", 10, 1.0)
+    assert not grid.has_level(duckdb.connect(), "p", 10, 1.0)
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from metrics import Counter, Histogram, MetricsMiddleware, RequestMetrics, add_rows, gauges, phase
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram("x_seconds", "help", ("endpoint",), (0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(("/a",), v)
+    lines = list(h.render())
+    assert lines[:2] == ["# HELP x_seconds help", "# TYPE x_seconds histogram"]
+    assert 'x_seconds_bucket{endpoint="/a",le="0.1"} 2' in lines
+    assert 'x_seconds_bucket{endpoint="/a",le="1.0"} 3' in lines
+    assert 'x_seconds_bucket{endpoint="/a",le="+Inf"} 4' in lines
+    assert 'x_seconds_sum{endpoint="/a"} 3.65' in lines
+    assert 'x_seconds_count{endpoint="/a"} 4' in lines
+
+
+def test_counter_and_gauges():
+    c = Counter("reqs_total", "help", ("endpoint", "status"))
+    c.inc(("/a", 200))
+    c.inc(("/a", 200))
+    assert 'reqs_total{endpoint="/a",status="200"} 2' in list(c.render())
+    lines = list(gauges("ratio", "help", ("name",), {("hit",): None, ("size",): 3}))
+    assert 'ratio{name="hit"} NaN' in lines and 'ratio{name="size"} 3' in lines
+
+
+def test_record_serialize_is_the_residual():
+    m = RequestMetrics(prefix="t")
+    m.record("/a", 200, {"total": 1.0, "connect": 0.1, "query": 0.3, "fetch": 0.2, "send": 0.1, "rows": 5},
+             sent=2048, cache="HIT")
+    text = "\n".join(m.render())
+    line = next(l for l in text.splitlines() if l.startswith('t_request_duration_seconds_sum{endpoint="/a",phase="serialize"}'))
+    assert float(line.split()[-1]) == pytest.approx(0.3)
+    assert 't_response_rows_count{endpoint="/a"} 1' in text
+    assert 't_requests_total{endpoint="/a",status="200"} 1' in text
+    assert 't_result_cache_requests_total{endpoint="/a",result="hit"} 1' in text
+
+
+def test_middleware_measures_phases_rows_and_bytes():
+    m = RequestMetrics(prefix="t")
+
+    async def endpoint(scope, receive, send):
+        with phase("query"):
+            add_rows(7)
+        await send({"type": "http.response.start", "status": 201, "headers": [(b"x-cache", b"MISS")]})
+        await send({"type": "http.response.body", "body": b"12345", "more_body": True})
+        await send({"type": "http.response.body", "body": b"678"})
+
+    async def send(msg):
+        pass
+
+    app = MetricsMiddleware(endpoint, m, label=lambda path: "/items/{id}", exclude=("/metrics",))
+    asyncio.run(app({"type": "http", "path": "/items/3"}, None, send))
+    asyncio.run(app({"type": "http", "path": "/metrics"}, None, send))
+    text = "\n".join(m.render())
+    assert 't_requests_total{endpoint="/items/{id}",status="201"} 1' in text
+    assert 't_response_rows_sum{endpoint="/items/{id}"} 7' in text
+    assert 't_response_bytes_sum{endpoint="/items/{id}"} 8' in text
+    assert 'phase="query"' in text and 'phase="send"' in text
+    assert "/metrics" not in text
+
+
+def test_phase_outside_a_request_is_a_no_op():
+    with phase("query"):
+        add_rows(3)
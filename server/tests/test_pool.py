@@ -0,0 +1,165 @@
+import os, threading, time
+
+import duckdb
+import pytest
+
+from pool import DuckDBPool, PoolTimeout
+
+
+def _pool(path: str, **kwargs) -> DuckDBPool:
+    # the pool's behaviour does not depend on spatial, which CI may not have
+    return DuckDBPool(path, extensions=(), **kwargs)
+
+
+def _warehouse(path: str, value: int) -> None:
+    con = duckdb.connect(path)
+    con.execute("CREATE TABLE t AS SELECT ? AS v", [value])
+    con.close()
+
+
+def _swap(tmp_path, path: str, value: int) -> None:
+    new = str(tmp_path / f"new{value}.duckdb")
+    _warehouse(new, value)
+    os.replace(new, path)
+
+
+def _read(pool: DuckDBPool) -> int:
+    with pool.connection() as con:
+        return con.execute("SELECT v FROM t").fetchone()[0]
+
+
+@pytest.fixture
+def path(tmp_path):
+    p = str(tmp_path / "warehouse.duckdb")
+    _warehouse(p, 1)
+    return p
+
+
+def test_swap_with_busy_cursor_waits_for_it_then_serves_new_file(tmp_path, path):
+    pool = _pool(path, size=2, drain_timeout=5.0)
+    pool.ensure_version("v1")
+    busy = pool.acquire()
+    assert busy.execute("SELECT v FROM t").fetchone()[0] == 1
+
+    _swap(tmp_path, path, 2)
+    threading.Timer(0.2, pool.release, [busy]).start()
+    pool.ensure_version("v2")
+    assert _read(pool) == 2
+    pool.close()
+
+
+def test_swap_closes_cursors_that_outlive_drain_timeout(tmp_path, path):
+    pool = _pool(path, size=2, drain_timeout=0.1)
+    pool.ensure_version("v1")
+    busy = pool.acquire()
+
+    _swap(tmp_path, path, 2)
+    pool.ensure_version("v2")
+    assert _read(pool) == 2
+    with pytest.raises(duckdb.Error):
+        busy.execute("SELECT v FROM t").fetchone()
+    pool.release(busy, discard=True)
+    assert pool.stats()["busy"] == 0
+    assert _read(pool) == 2
+    pool.close()
+
+
+def test_concurrent_version_change_recycles_once(path):
+    pool = _pool(path, size=4)
+    pool.ensure_version("v1")
+    assert _read(pool) == 1
+    threads = [threading.Thread(target=pool.ensure_version, args=("v2",)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert pool.stats()["generation"] == 1
+    assert _read(pool) == 1
+    pool.close()
+
+
+def test_same_version_keeps_cursors(path):
+    pool = _pool(path, size=1)
+    pool.ensure_version("v1")
+    _read(pool)
+    pool.ensure_version("v1")
+    assert pool.stats()["idle"] == 1
+    pool.close()
+
+
+def test_concurrent_recycles_during_drain_open_one_database(tmp_path, path, monkeypatch):
+    import pool as pool_module
+
+    opened = []
+    connect = pool_module.duckdb.connect
+
+    def counting_connect(*args, **kwargs):
+        db = connect(*args, **kwargs)
+        opened.append(db)
+        return db
+
+    pool = _pool(path, size=4, drain_timeout=5.0)
+    pool.ensure_version("v1")
+    busy = pool.acquire()
+    _swap(tmp_path, path, 2)
+    monkeypatch.setattr(pool_module.duckdb, "connect", counting_connect)
+
+    # every caller blocks in the drain (lock released) until the old cursor is returned
+    callers = [threading.Thread(target=pool.recycle) for _ in range(3)]
+    callers += [threading.Thread(target=_read, args=(pool,)) for _ in range(2)]
+    for t in callers:
+        t.start()
+    time.sleep(0.2)
+    pool.release(busy)
+    for t in callers:
+        t.join()
+
+    assert len(opened) == 1
+    assert _read(pool) == 2
+    assert pool.stats()["busy"] == 0
+    pool.close()
+
+
+def test_pool_timeout_is_counted(path):
+    pool = _pool(path, size=1, timeout=0.05)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    pool.release(held)
+    assert pool.stats()["timeouts"] == 1
+    pool.close()
+
+
+def test_write_connection_next_to_a_read_only_pool(path):
+    pool = _pool(path, read_only=True, size=2)
+    assert _read(pool) == 1
+    with pool.write_connection() as con:
+        con.execute("UPDATE t SET v = 3")
+    assert _read(pool) == 3
+    with pytest.raises(duckdb.Error):
+        with pool.connection() as con:
+            con.execute("UPDATE t SET v = 4")
+    pool.close()
+
+
+def test_write_connection_waits_for_busy_readers(path):
+    pool = _pool(path, read_only=True, size=2, drain_timeout=5.0)
+    busy = pool.acquire()
+    threading.Timer(0.2, pool.release, [busy]).start()
+    with pool.write_connection() as con:
+        con.execute("UPDATE t SET v = 5")
+    assert _read(pool) == 5
+    pool.close()
+
+
+def test_background_cursor_does_not_take_a_request_slot(path):
+    pool = _pool(path, size=1, timeout=0.05)
+    held = pool.acquire()
+    background = pool.acquire(background=True)
+    assert background.execute("SELECT v FROM t").fetchone()[0] == 1
+    with pytest.raises(PoolTimeout):
+        pool.acquire(background=True)
+    pool.release(background)
+    pool.release(held)
+    assert _read(pool) == 1
+    pool.close()
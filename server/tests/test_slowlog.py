@@ -0,0 +1,58 @@
+import time
+
+import duckdb
+
+import slowlog
+from slowlog import SlowQueryLog
+from pool import DuckDBPool
+
+
+def _wait(log: SlowQueryLog, n: int) -> None:
+    deadline = time.monotonic() + 5
+    while len(log.recent()) < n and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def _log(tmp_path) -> SlowQueryLog:
+    path = str(tmp_path / "w.duckdb")
+    duckdb.connect(path).execute("CREATE TABLE t AS SELECT range AS v FROM range(100)").close()
+    pool = DuckDBPool(path, size=1, timeout=0.05, extensions=())
+    return SlowQueryLog(pool, str(tmp_path / "slow.log"), sample=1.0)
+
+
+def test_capture_profiles_once_with_a_plan(tmp_path):
+    log = _log(tmp_path)
+    log.observe("SELECT sum(v) FROM t WHERE v > ?", [10], 0.5)
+    _wait(log, 1)
+    entry = log.recent()[0]
+    assert "error" not in entry and entry["params"] == [10]
+    assert "rows=" in entry["plan"] and entry["profile"]
+    log.close()
+
+
+def test_worker_survives_unexpected_errors(tmp_path, monkeypatch):
+    log = _log(tmp_path)
+
+    def broken(profile):
+        raise KeyError("operator_name")
+
+    monkeypatch.setattr(slowlog, "plan_text", broken)
+    log.observe("SELECT count(*) FROM t", [], 0.5)
+    _wait(log, 1)
+    assert "KeyError" in log.recent()[0]["error"] and log.failed == 1
+
+    monkeypatch.undo()
+    log.observe("SELECT max(v) FROM t", [], 0.5)
+    _wait(log, 2)
+    assert "error" not in log.recent()[0] and log.captured == 1
+    log.close()
+
+
+def test_capture_does_not_wait_for_request_slots(tmp_path):
+    log = _log(tmp_path)
+    held = log.pool.acquire()  # the only request slot
+    log.observe("SELECT min(v) FROM t", [], 0.5)
+    _wait(log, 1)
+    assert "error" not in log.recent()[0]
+    log.pool.release(held)
+    log.close()
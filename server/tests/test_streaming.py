@@ -0,0 +1,109 @@
+import asyncio, os, re
+
+import duckdb
+import pytest
+from fastapi import HTTPException
+from starlette.requests import ClientDisconnect
+
+from streaming import negotiate_format, stream_features
+
+
+@pytest.mark.parametrize("accept, fmt", [
+    (None, "geojson"),
+    ("", "geojson"),
+    ("*/*", "geojson"),
+    ("application/json", "geojson"),
+    ("application/x-ndjson", "ndjson"),
+    ("application/vnd.apache.arrow.stream", "arrow"),
+    ("application/flatgeobuf", "fgb"),
+    ("application/geo+json;q=0.5, application/x-ndjson", "ndjson"),
+    ("application/x-ndjson;q=0.2, application/vnd.apache.arrow.stream;q=0.9", "arrow"),
+    ("application/x-ndjson, application/flatgeobuf", "ndjson"),   # equal q: first listed
+    ("application/x-ndjson;q=0", "geojson"),
+    ("APPLICATION/X-NDJSON", "ndjson"),
+    ("application/x-ndjson;q=abc", "geojson"),
+])
+def test_negotiate_format(accept, fmt):
+    assert negotiate_format(accept) == fmt
+
+
+class _FgbCursor:
+    """Fake cursor: the COPY writes a file, as the GDAL writer would."""
+
+    def __init__(self, fail_copy: bool = False):
+        self.fail_copy = fail_copy
+        self.statements: list[str] = []
+        self.path = None
+
+    def execute(self, sql, params=()):
+        self.statements.append(" ".join(sql.split()))
+        if sql.lstrip().startswith("COPY"):
+            self.path = re.search(r"TO '([^']+)'", sql).group(1)
+            if self.fail_copy:
+                open(self.path, "wb").write(b"partial")
+                raise duckdb.IOException("disk full")
+            open(self.path, "wb").write(b"fgb" * 1000)
+        return self
+
+
+def _send(response, spec_version: str, send) -> None:
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    try:
+        asyncio.run(response({"type": "http", "asgi": {"spec_version": spec_version}}, receive, send))
+    except ClientDisconnect:
+        pass
+
+
+def test_flatgeobuf_leaves_no_file_when_the_send_fails():
+    con = _FgbCursor()
+    response = stream_features(con, "SELECT 1 AS a", fmt="fgb")
+    assert con.statements[-1] == "DROP TABLE IF EXISTS _fgb_page;"
+
+    async def send(msg):
+        raise OSError("connection reset")
+
+    _send(response, "2.4", send)
+    assert not os.path.exists(con.path)
+
+
+def _target(fd: str) -> str:
+    try:
+        return os.readlink(f"/proc/self/fd/{fd}")
+    except OSError:  # e.g. listdir's own descriptor, already closed
+        return ""
+
+
+def test_flatgeobuf_handle_is_closed_when_the_client_leaves_first():
+    con = _FgbCursor()
+    response = stream_features(con, "SELECT 1 AS a", fmt="fgb")
+
+    async def send(msg):
+        await asyncio.sleep(1)  # the disconnect is seen before the first chunk
+
+    _send(response, "2.0", send)
+    assert not os.path.exists(con.path)
+    if os.path.isdir("/proc/self/fd"):  # the background task closed the unlinked file
+        assert not [fd for fd in os.listdir("/proc/self/fd") if _target(fd).startswith(con.path)]
+
+
+def test_flatgeobuf_body_streams_the_whole_file():
+    con = _FgbCursor()
+    response = stream_features(con, "SELECT 1 AS a", fmt="fgb")
+    chunks = []
+
+    async def send(msg):
+        chunks.append(msg.get("body", b""))
+
+    _send(response, "2.4", send)
+    assert b"".join(chunks) == b"fgb" * 1000
+
+
+def test_flatgeobuf_failure_removes_file_and_table():
+    con = _FgbCursor(fail_copy=True)
+    with pytest.raises(HTTPException) as e:
+        stream_features(con, "SELECT 1 AS a", fmt="fgb")
+    assert e.value.status_code == 500
+    assert not os.path.exists(con.path)
+    assert con.statements[-1] == "DROP TABLE IF EXISTS _fgb_page;"
@@ -0,0 +1,55 @@
+import pytest
+
+from tiles import lonlat_to_tile, render_tile, tile_bounds_lonlat, valid_tile
+
+
+class _Recorder:
+    """Stands in for a cursor: keeps the SQL render_tile would run."""
+
+    def __init__(self):
+        self.sql = None
+
+    def execute(self, sql, params=()):
+        self.sql = sql
+        return self
+
+    def fetchone(self):
+        return None
+
+
+def _sql(layer: str, columns=()) -> str:
+    con = _Recorder()
+    z, (x, y) = 17, lonlat_to_tile(-3.73, 40.30, 17)
+    assert render_tile(con, layer, z, x, y, columns) == b""
+    return con.sql
+
+
+def test_irr_points_uses_the_wgs84_copy_when_present():
+    sql = _sql("irr_points", ("value", "geom", "geom_4326"))
+    assert "ST_Intersects(geom_4326, ST_MakeEnvelope(" in sql
+    assert "ST_Transform(geom_4326, 'EPSG:4326', 'EPSG:3857', TRUE)" in sql
+
+
+def test_irr_points_reprojects_geom_without_the_copy():
+    sql = _sql("irr_points", ("value", "geom"))
+    assert "geom_4326" not in sql
+    assert "ST_Intersects(geom, ST_Transform(ST_MakeEnvelope(" in sql and "'EPSG:25830'" in sql
+    assert "ST_Transform(geom, 'EPSG:25830', 'EPSG:3857', TRUE)" in sql
+
+
+def test_bbox_columns_prefilter_only_when_present():
+    assert "xmax >=" not in _sql("buildings", ("reference", "geom"))
+    assert "xmax >=" in _sql("buildings", ("reference", "geom", "xmin", "ymin", "xmax", "ymax"))
+
+
+def test_below_minzoom_is_empty_without_a_query():
+    con = _Recorder()
+    assert render_tile(con, "irr_points", 10, 500, 390) == b"" and con.sql is None
+
+
+@pytest.mark.parametrize("z", [0, 5, 17])
+def test_tile_of_a_point_contains_it(z):
+    x, y = lonlat_to_tile(-3.73, 40.30, z)
+    assert valid_tile(z, x, y)
+    minx, miny, maxx, maxy = tile_bounds_lonlat(z, x, y)
+    assert minx <= -3.73 <= maxx and miny <= 40.30 <= maxy